@@ -0,0 +1,338 @@
+"""Compiler throughput benchmark with per-stage timing.
+
+This script builds synthetic C sources of controlled size, compiles them
+in-process, and records how long each stage of `main.process_c_file`
+takes, along with the peak memory each stage allocates. It is meant for
+tracking down compile-time regressions: when a build gets slower, the
+scaling curves show whether the lexer, the preprocessor, the parser,
+IL generation, or the register allocator is responsible.
+
+The synthetic sources are controlled by four dimensions:
+
+    funcs   - number of function definitions in the translation unit
+    depth   - nesting depth of the if/while statements in each function body
+    temps   - number of local temporaries kept live in each function
+    headers - number of generated header files included by the source
+
+A sweep varies one dimension at a time while holding the others at their
+base values. Typical use:
+
+    python benchmarks/compile_bench.py run --sweep funcs -o funcs.json
+    python benchmarks/compile_bench.py run --sweep all -o all.json
+    python benchmarks/compile_bench.py plot all.json -o curves.png
+
+The `plot` command requires matplotlib. It runs in a separate invocation
+from `run` because the compiler's own `ctypes` module shadows the standard
+library module of the same name once the compiler is importable.
+"""
+
+import argparse
+import gc
+import json
+import pathlib
+import sys
+import tempfile
+
+COMPILER_DIR = pathlib.Path(__file__).resolve().parent.parent / "shivyc"
+
+# Values used for each dimension when it is not the one being swept
+BASE = {"funcs": 8, "depth": 2, "temps": 4, "headers": 1}
+
+# Values tried for each dimension when it is swept
+SWEEPS = {"funcs": [1, 2, 4, 8, 16, 32, 64],
+          "depth": [0, 1, 2, 4, 8, 16, 32],
+          "temps": [1, 2, 4, 6, 8, 10, 12],
+          "headers": [0, 1, 2, 4, 8, 16, 32]}
+
+# Number of declarations of each kind written to every generated header
+HEADER_DECLS = 20
+
+
+def generate_header(num):
+    """Return the text of the `num`-th synthetic header file."""
+    lines = [f"// Synthetic benchmark header {num}"]
+    for i in range(HEADER_DECLS):
+        lines.append(f"typedef int hdr{num}_t{i};")
+        lines.append(f"struct hdr{num}_s{i} {{ int x; int y; }};")
+        lines.append(f"int hdr{num}_fn{i}(int a, hdr{num}_t{i} b);")
+        lines.append(f"extern int hdr{num}_var{i};")
+    return "\n".join(lines) + "\n"
+
+
+def generate_block(level, depth, temps, indent):
+    """Return lines of a nested if/while block of the given depth.
+
+    Even levels are if-statements and odd levels are while-loops, and
+    each level updates one of the temporaries so the temporaries stay live
+    throughout the body.
+    """
+    if level >= depth:
+        return []
+
+    pad = "    " * indent
+    t = f"t{level % temps}"
+    if level % 2 == 0:
+        head = f"{pad}if (a < b) {{"
+        body = [f"{pad}    {t} = {t} + a;"]
+    else:
+        head = f"{pad}while (a < b) {{"
+        body = [f"{pad}    {t} = {t} - b;", f"{pad}    a = a + 1;"]
+
+    inner = generate_block(level + 1, depth, temps, indent + 1)
+    return [head] + body + inner + [f"{pad}}}"]
+
+
+def generate_function(num, depth, temps):
+    """Return the text of the `num`-th synthetic function."""
+    lines = [f"int f{num}(int a, int b) {{"]
+    lines.append("    int t0 = a + b;")
+    for i in range(1, temps):
+        lines.append(f"    int t{i} = t{i - 1} + a;")
+
+    lines += generate_block(0, depth, temps, 1)
+
+    total = " + ".join(f"t{i}" for i in range(temps))
+    lines.append(f"    return {total};")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_source(directory, funcs, depth, temps, headers):
+    """Write a synthetic translation unit to `directory`.
+
+    Returns the path of the generated C file. Header files are written
+    next to it and included with quoted include directives.
+    """
+    directory = pathlib.Path(directory)
+    parts = []
+    for i in range(headers):
+        name = f"bench_hdr{i}.h"
+        directory.joinpath(name).write_text(generate_header(i))
+        parts.append(f'#include "{name}"\n')
+
+    for i in range(funcs):
+        parts.append(generate_function(i, depth, temps))
+
+    # Call every function so the call lowering is exercised as well. Each
+    # call gets its own argument variable so that no value is live across
+    # a call, which the register allocator cannot yet handle.
+    main = ["int main() {"]
+    for i in range(funcs):
+        main.append(f"    int c{i} = {i};")
+        main.append(f"    c{i} = f{i}(c{i}, c{i});")
+    main += ["    return 0;", "}"]
+    parts.append("\n".join(main) + "\n")
+
+    path = directory.joinpath("bench.c")
+    path.write_text("\n".join(parts))
+    return path
+
+
+def _import_compiler():
+    """Make the compiler modules importable and return them."""
+    if str(COMPILER_DIR) not in sys.path:
+        sys.path.insert(0, str(COMPILER_DIR))
+
+    import main
+    return main
+
+
+def compile_stages(main, file, measure_memory):
+    """Compile `file` once with main.process_c_file, measuring each stage.
+
+    The stages are those the compiler reports to its profiler, in the
+    order they first ran, so stages added to the compiler are measured
+    without changes here. Returns a tuple of the per-stage results and a
+    status string. The per-stage results map a stage name to its wall time
+    in seconds, its nesting depth, and, if `measure_memory` is set, its
+    peak traced memory in bytes. The status is "ok", "error" if the
+    compiler reported errors, or the name of the exception that aborted
+    compilation.
+    """
+    from errors import error_collector
+    from profiler import profiler
+
+    error_collector.clear()
+    args = main.get_arguments([str(file)])
+
+    gc.collect()
+    profiler.enable(time_passes=measure_memory, trace=not measure_memory)
+    try:
+        status = "ok" if main.process_c_file(str(file), args) else "error"
+    except Exception as e:
+        status = type(e).__name__
+
+    results = {}
+    for name, stats in profiler.stages.items():
+        results[name] = {"time": stats.time, "depth": stats.depth}
+        if measure_memory:
+            results[name]["peak_mem"] = stats.peak
+    profiler.clear()
+
+    if status == "ok" and not error_collector.ok():
+        status = "error"
+    return results, status
+
+
+def measure(main, file, repeat):
+    """Measure compilation of `file`.
+
+    Timings are the best of `repeat` untraced runs. Peak memory comes from
+    one extra run under tracemalloc, since tracing slows down allocation
+    enough to distort the timings.
+    """
+    best = {}
+    status = "ok"
+    for _ in range(repeat):
+        results, status = compile_stages(main, file, False)
+        for stage, data in results.items():
+            if stage not in best or data["time"] < best[stage]["time"]:
+                best[stage] = data
+
+    mem_results, _ = compile_stages(main, file, True)
+    for stage, data in mem_results.items():
+        if stage in best:
+            best[stage]["peak_mem"] = data["peak_mem"]
+
+    return best, status
+
+
+def run(args):
+    """Run the requested sweeps and write the results as JSON."""
+    main = _import_compiler()
+
+    dims = list(SWEEPS) if args.sweep == "all" else [args.sweep]
+    records = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dim in dims:
+            for value in SWEEPS[dim]:
+                params = dict(BASE)
+                params[dim] = value
+
+                file = generate_source(tmp, **params)
+                stages, status = measure(main, file, args.repeat)
+
+                record = {"sweep": dim, "value": value, "params": params,
+                          "source_bytes": file.stat().st_size,
+                          "status": status, "stages": stages}
+                records.append(record)
+
+                if not args.quiet:
+                    _print_record(record)
+
+    out = json.dumps({"base": BASE, "records": records}, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(out)
+    else:
+        print(out)
+
+
+def _print_record(record):
+    """Print a one-line summary of a benchmark record to stderr."""
+    times = " ".join(f"{stage}={data['time'] * 1000:.1f}ms"
+                     for stage, data in record["stages"].items()
+                     if not data["depth"])
+    print(f"{record['sweep']}={record['value']:<4} [{record['status']}] "
+          f"{times}", file=sys.stderr)
+
+
+def plot(args):
+    """Plot per-stage scaling curves from a results file."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("plotting requires matplotlib", file=sys.stderr)
+        return 1
+
+    data = json.loads(pathlib.Path(args.results).read_text())
+    dims = []
+    for record in data["records"]:
+        if record["sweep"] not in dims:
+            dims.append(record["sweep"])
+
+    fig, axes = plt.subplots(2, len(dims), squeeze=False,
+                             figsize=(5 * len(dims), 8))
+    for col, dim in enumerate(dims):
+        records = [r for r in data["records"] if r["sweep"] == dim]
+        stages = []
+        for record in records:
+            for stage, stage_data in record["stages"].items():
+                if not stage_data["depth"] and stage not in stages:
+                    stages.append(stage)
+
+        for stage in stages:
+            points = [(r["value"], r["stages"][stage])
+                      for r in records if stage in r["stages"]]
+            if not points:
+                continue
+
+            xs = [x for x, _ in points]
+            axes[0][col].plot(xs, [d["time"] for _, d in points],
+                              marker="o", label=stage)
+            axes[1][col].plot(xs, [d.get("peak_mem", 0) / 1024
+                                   for _, d in points],
+                              marker="o", label=stage)
+
+        axes[0][col].set_title(f"time vs {dim}")
+        axes[0][col].set_ylabel("seconds")
+        axes[1][col].set_title(f"peak memory vs {dim}")
+        axes[1][col].set_ylabel("KiB")
+        for row in (0, 1):
+            axes[row][col].set_xlabel(dim)
+            if args.log:
+                axes[row][col].set_xscale("symlog")
+                axes[row][col].set_yscale("log")
+        axes[0][col].legend()
+
+    fig.tight_layout()
+    fig.savefig(args.output)
+    return 0
+
+
+def get_arguments():
+    """Get the command-line arguments of the benchmark script."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark compiler throughput per stage.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run benchmark sweeps")
+    run_parser.add_argument("--sweep", choices=list(SWEEPS) + ["all"],
+                            default="all", help="dimension to sweep")
+    run_parser.add_argument("--repeat", type=int, default=3,
+                            help="timed runs per data point (best is kept)")
+    run_parser.add_argument("-o", "--output",
+                            help="write JSON results here instead of stdout")
+    run_parser.add_argument("-q", "--quiet", action="store_true",
+                            help="do not print progress to stderr")
+    for dim in BASE:
+        run_parser.add_argument(f"--base-{dim}", type=int, default=BASE[dim],
+                                dest=f"base_{dim}",
+                                help=f"value of {dim} when not swept")
+
+    plot_parser = sub.add_parser("plot", help="plot scaling curves")
+    plot_parser.add_argument("results", help="JSON file written by `run`")
+    plot_parser.add_argument("-o", "--output", default="compile_bench.png",
+                             help="image file to write")
+    plot_parser.add_argument("--log", action="store_true",
+                             help="use logarithmic axes")
+
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark script."""
+    args = get_arguments()
+    if args.command == "run":
+        for dim in BASE:
+            BASE[dim] = getattr(args, f"base_{dim}")
+        run(args)
+        return 0
+    else:
+        return plot(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
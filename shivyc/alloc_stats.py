@@ -0,0 +1,190 @@
+"""Objects used for collecting register allocator statistics.
+
+ASMGen fills in a RegAllocStats object for every function it compiles and
+adds it to the global `alloc_stats` collector. The main executable prints a
+summary for the `-z-reg-alloc-perf` flag and saves the statistics as JSON
+for the `-z-reg-alloc-stats` flag, so allocation quality can be tracked
+across builds.
+
+"""
+
+import json
+import sys
+
+from errors import error_collector, CompilerError
+
+
+class RegAllocStats:
+    """Register allocator statistics for one function.
+
+    Every statistic is computed in time linear in the size of the conflict
+    graph.
+
+    nodes (int) - Number of ILValues in the conflict graph.
+    edges (int) - Number of conflict edges in the conflict graph, including
+    edges to precolored registers.
+    max_degree (int) - Largest number of conflict edges of a single ILValue.
+    spills (int) - Number of ILValues spilled out of registers.
+    rematerialized (int) - Number of spilled ILValues holding a constant,
+    which are read as a literal instead of being stored.
+    spill_rounds (int) - Number of rounds of graph coloring, one more than
+    the number of rounds that ended by spilling a node.
+    coalesced_moves (int) - Number of preference edges removed by merging
+    their two nodes, summed over all coloring rounds.
+    frozen_moves (int) - Number of preference edges given up on, summed
+    over all coloring rounds.
+    liveness_iters (int) - Number of iterations liveness analysis took to
+    reach a fixed point.
+    moves (int) - Number of preference edges in the conflict graph.
+    moves_eliminated (int) - Number of preference edges whose two ends were
+    assigned the same spot, so no move is needed between them.
+    """
+
+    fields = ["nodes", "edges", "max_degree", "spills", "spill_rounds",
+              "rematerialized", "coalesced_moves", "frozen_moves",
+              "liveness_iters", "moves", "moves_eliminated"]
+
+    def __init__(self, func):
+        """Initialize RegAllocStats for the function named `func`."""
+        self.func = func
+        for field in self.fields:
+            setattr(self, field, 0)
+
+        # List of dictionaries describing each call made by this function
+        self.call_sites = []
+
+    def add_graph(self, g):
+        """Record the size of conflict graph `g` before coloring."""
+        self.nodes = len(g.nodes())
+        self.edges = g.num_conflicts()
+        self.max_degree = max((len(g.confs(n)) for n in g.nodes()),
+                              default=0)
+
+    def add_moves(self, g, spotmap):
+        """Record how many preference edges of `g` the spotmap satisfies.
+
+        Each preference edge is seen once from each of its ends, so both
+        counts are halved at the end.
+        """
+        moves = 0
+        eliminated = 0
+        for n1 in g.all_nodes():
+            for n2 in g.prefs(n1):
+                moves += 1
+                if n1 in spotmap and spotmap[n1] == spotmap.get(n2):
+                    eliminated += 1
+
+        self.moves = moves // 2
+        self.moves_eliminated = eliminated // 2
+
+    def add_exact_coloring(self, g, spotmap, spilled):
+        """Record the coloring of `g` found by the exact allocator.
+
+        The exact allocator neither merges nor freezes nodes, so a
+        preference edge counts as coalesced if both its ends were assigned
+        the same spot, and as frozen otherwise.
+        """
+        coalesced = 0
+        frozen = 0
+        for n1 in g.all_nodes():
+            for n2 in g.prefs(n1):
+                if n1 in spotmap and spotmap[n1] == spotmap.get(n2):
+                    coalesced += 1
+                else:
+                    frozen += 1
+
+        self.spills = len(spilled)
+        self.coalesced_moves = coalesced // 2
+        self.frozen_moves = frozen // 2
+
+    def add_call_site(self, callee, loads, default_loads=None):
+        """Record the loads emitted to pass arguments at one call site.
+
+        callee (str) - Name of the called function, or None if unknown.
+        loads (int) - Loads emitted for the arguments and return value.
+        default_loads (int) - Loads the same call site needs with the
+        default calling convention and the same register allocation, if
+        known.
+        """
+        site = {"callee": callee, "loads": loads}
+        if default_loads is not None:
+            site["default_loads"] = default_loads
+            site["loads_saved"] = default_loads - loads
+        self.call_sites.append(site)
+
+    def as_dict(self):
+        """Return these statistics as a dictionary, for JSON export."""
+        stats = {field: getattr(self, field) for field in self.fields}
+        if self.call_sites:
+            stats["call_sites"] = self.call_sites
+        return stats
+
+
+class AllocStatsCollector:
+    """Class that accumulates register allocator statistics.
+
+    Like the error collector, we create a global instance of this class so
+    that ASMGen can report to it without being passed a collector.
+
+    files - Dictionary mapping each C file name to the list of RegAllocStats
+    for the functions in that file.
+    """
+
+    def __init__(self):
+        """Initialize an empty AllocStatsCollector."""
+        self.files = {}
+        self._pending = []
+
+    def add(self, stats):
+        """Add the statistics of one function of the current file."""
+        self._pending.append(stats)
+
+    def end_file(self, file):
+        """Attribute all statistics added since the last call to `file`."""
+        if self._pending:
+            self.files.setdefault(file, []).extend(self._pending)
+        self._pending = []
+
+    def as_dict(self):
+        """Return all collected statistics as a dictionary."""
+        return {"files": {file: {s.func: s.as_dict() for s in stats}
+                          for file, stats in self.files.items()}}
+
+    def write(self, filename):
+        """Save all collected statistics to `filename` as JSON."""
+        try:
+            with open(filename, "w") as stats_file:
+                json.dump(self.as_dict(), stats_file, indent=2)
+        except IOError:
+            descrip = f"could not write statistics file '{filename}'"
+            error_collector.add(CompilerError(descrip))
+
+    def show(self):  # pragma: no cover
+        """Print a summary of the collected statistics to stderr."""
+        fields = RegAllocStats.fields
+        for file, stats in self.files.items():
+            width = max([len("function")] + [len(s.func) for s in stats]) + 2
+
+            print(f"Register allocation: {file}", file=sys.stderr)
+            print(f" {'function':<{width}}" +
+                  "".join(f"{f:>{len(f) + 2}}" for f in fields),
+                  file=sys.stderr)
+            for s in stats:
+                print(f" {s.func:<{width}}" +
+                      "".join(f"{getattr(s, f):>{len(f) + 2}}"
+                              for f in fields), file=sys.stderr)
+
+            for s in stats:
+                for site in s.call_sites:
+                    line = (f" call {s.func} -> {site['callee'] or '?'}: "
+                            f"{site['loads']} loads")
+                    if "loads_saved" in site:
+                        line += f", {site['loads_saved']} saved"
+                    print(line, file=sys.stderr)
+
+    def clear(self):
+        """Forget all collected statistics."""
+        self.__init__()
+
+
+alloc_stats = AllocStatsCollector()
@@ -32,14 +32,15 @@ class _ASMCommand:
 class _ASMCommandMultiSize:
     """Base class for an ASMCommand which takes arguments of different sizes.
 
-    For example, `movsx` and `movzx`.
+    For example, `movsx` and `movzx`. The source may be None for the
+    KCPSM3 shifts, which shift their destination by one bit.
     """
 
     name = None
 
     def __init__(self, dest, source, source_size, dest_size):
         self.dest = dest.asm_str(source_size)
-        self.source = source.asm_str(dest_size)
+        self.source = source.asm_str(dest_size) if source else None
         self.source_size = source_size
         self.dest_size = dest_size
 
@@ -119,6 +120,11 @@ class Jbe(_JumpCommand): name = "jump nc"
 class Load(_ASMCommand): name = "load"
 
 
+class Store(_ASMCommand): name = "store"
+
+class Fetch(_ASMCommand): name = "fetch"
+
+
 class Add(_ASMCommand): name = "add"
 class Addcy(_ASMCommand): name = "addcy"
 
@@ -153,6 +159,8 @@ class Compare(_ASMCommand): name = "compare"
 
 class Call(_ASMCommand): name = "call"
 
+class CallLabel(_JumpCommand): name = "call"
+
 class CallZ(_ASMCommand): name = "call z"
 
 class CallNZ(_ASMCommand): name = "call nz"
@@ -3,8 +3,18 @@
 import itertools
 
 import asm_cmds as asm_cmds
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+import runtime as runtime
 import spots as spots
-from spots import Spot, RegSpot, MemSpot, LiteralSpot
+from alloc_stats import alloc_stats, RegAllocStats
+from call_graph import CallGraph
+from exact_alloc import ExactAllocator
+from il_index import ILIndex
+from linear_scan import LinearScan
+from live_split import LiveRangeSplitter
+from profiler import profiler
+from spots import Spot, RegSpot, MemSpot, LiteralSpot, ScratchSpot
 
 
 class ASMCode:
@@ -23,6 +33,7 @@ class ASMCode:
         self.globals = []
         self.data = []
         self.string_literals = []
+        self.routines = []
 
     def add(self, cmd):
         """Add a command to the code.
@@ -52,6 +63,16 @@ class ASMCode:
         data = ",".join(str(char) for char in chars)
         self.string_literals.append(f"\t.byte {data}")
 
+    def add_routine(self, name):
+        """Link the runtime routine with the given name into the code.
+
+        The routines it calls are linked as well.
+        """
+        if name not in self.routines:
+            self.routines.append(name)
+            for callee in runtime.routine_calls(name):
+                self.add_routine(callee)
+
     def full_code(self):  # noqa: D202
         """Produce the full assembly code.
 
@@ -62,6 +83,8 @@ class ASMCode:
         header = ["\t; KCPSM3 assemble code"]
         header += ["\tADDRESS 000"]
         header += [str(line) for line in self.lines]
+        for name in self.routines:
+            header += [str(line) for line in runtime.routine_lines(name)]
 
         return "\n".join(header + ["\t; END", ""])
 
@@ -110,7 +133,13 @@ class NodeGraph:
             self._conf[n2].append(n1)
 
     def add_pref(self, n1, n2):
-        """Add a preference edge between n1 and n2."""
+        """Add a preference edge between n1 and n2.
+
+        A preference of a node for itself, which a command whose output is
+        also an input produces, is ignored.
+        """
+        if n1 is n2:
+            return
         if n2 not in self._pref[n1]:
             self._pref[n1].append(n2)
         if n1 not in self._pref[n2]:
@@ -199,6 +228,10 @@ class NodeGraph:
         """Return all nodes in this graph, including pseudonodes."""
         return self._all_nodes
 
+    def num_conflicts(self):
+        """Return the number of conflict edges in this graph."""
+        return sum(len(self._conf[n]) for n in self._all_nodes) // 2
+
     def copy(self):
         """Return a deep copy of this graph, but with same ILValue objects."""
         g = NodeGraph()
@@ -244,24 +277,325 @@ class ASMGen:
 
         self.offset = 0
 
+        # Mapping from each Call command to the number of loads emitted to
+        # move its arguments and return value
+        self.call_loads = {}
+
+        # Mapping from each Call command to the number of loads it would
+        # emit with the default calling convention
+        self.default_call_loads = {}
+
+        # Set of Call commands around which live ranges may be split
+        self.split_calls = set()
+
+        # Number of scratchpad bytes used by split live ranges. The slots
+        # are unique across the file, so a callee never overwrites the
+        # slots of its callers.
+        self.scratch_slots = 0
+
+    # Number of bytes in the scratchpad memory
+    scratch_size = 64
+
     def make_asm(self):
-        """Generate ASM code."""
+        """Generate ASM code.
+
+        With interprocedural register allocation or custom calling
+        conventions enabled, functions are compiled bottom-up over the call
+        graph, so the registers clobbered by each callee and the registers
+        its arguments are passed in are known when allocating registers for
+        its callers. The functions are still emitted in their original
+        order, because the first function is placed at address 0.
+        """
         global_spotmap = self._get_global_spotmap()
+
+        call_graph = CallGraph(self.il_code, self.symbol_table)
+        self._reset_conventions(call_graph)
+
+        ipa = self.arguments.ipa_ra or self.arguments.ipa_cc
+        if ipa:
+            components = call_graph.sccs()
+        else:
+            components = [[func] for func in self.il_code.commands]
+
+        if self.arguments.split_live_ranges:
+            self.split_calls = self._get_split_calls(call_graph)
+
+        custom_funcs = set()
+        if self.arguments.ipa_cc:
+            custom_funcs = self._get_custom_conv_funcs(call_graph)
+
+        # Number of loads emitted by each call site with the default calling
+        # convention, used to report the loads saved by custom conventions.
+        default_loads = self.default_call_loads if custom_funcs else {}
+
+        # Mapping from function name to the registers it may clobber
+        clobbers = {}
+
+        # Mapping from function name to its (argument registers, return
+        # register) calling convention, for functions with a custom one
+        conventions = {}
+
+        # Mapping from function name to its ASM code
+        func_code = {}
+
+        for component in components:
+            if ipa and not call_graph.is_recursive(component):
+                self._set_callee_info(
+                    component[0], call_graph, clobbers, conventions)
+
+            for func in component:
+                commands = self.il_code.commands[func]
+                if func in custom_funcs:
+                    self._free_convention(commands)
+
+                start = len(self.asm_code.lines)
+                with profiler.stage("codegen", func):
+                    self.asm_code.add(asm_cmds.Label(func))
+                    stats = RegAllocStats(func)
+                    self._make_asm(commands, global_spotmap, stats)
+
+                    for command, callee in call_graph.calls[func]:
+                        stats.add_call_site(
+                            callee, self.call_loads[command],
+                            default_loads.get(command))
+
+                    alloc_stats.add(stats)
+                    for name, value in stats.as_dict().items():
+                        profiler.set_value(name, value)
+
+                func_code[func] = self.asm_code.lines[start:]
+                del self.asm_code.lines[start:]
+
+                if func in custom_funcs:
+                    conventions[func] = self._get_convention(commands)
+
+            if self.arguments.ipa_ra:
+                for func in component:
+                    clobbers[func] = self._get_clobbers(
+                        func, func_code[func])
+
         for func in self.il_code.commands:
-            self.asm_code.add(asm_cmds.Label(func))
-            self._make_asm(self.il_code.commands[func], global_spotmap)
+            self.asm_code.lines += func_code[func]
+
+    def _reset_conventions(self, call_graph):
+        """Reset every call, argument, and return to the default convention.
+
+        This also records the callee of each direct call. Resetting makes
+        it safe to generate ASM from the same IL code more than once.
+        """
+        for func in call_graph.calls:
+            for command, callee in call_graph.calls[func]:
+                command.callee = callee
+                command.callee_clobber = None
+                command.arg_regs = control_cmds.Call.arg_regs
+                command.ret_reg = spots.S0
+
+        for commands in self.il_code.commands.values():
+            for command in commands:
+                if isinstance(command, value_cmds.LoadArg):
+                    command.arg_reg = command.arg_regs[command.arg_num]
+                    command.params = []
+                elif isinstance(command, control_cmds.Return):
+                    command.ret_reg = spots.S0
+
+    def _get_split_calls(self, call_graph):
+        """Return the set of calls around which live ranges may be split.
+
+        A value stored to the scratchpad around a call is only safe if the
+        call cannot re-enter the caller, which would overwrite the slot. A
+        call which is not direct may reach any function reachable from a
+        function whose address is taken or, unless -fwhole-program is
+        given, from a function visible outside this file other than main.
+        """
+        names = {name: v for v, name in self.symbol_table.names.items()
+                 if v.ctype.is_function()}
+        entries = set(call_graph.address_taken)
+        if not self.arguments.whole_program:
+            entries |= {func for func in call_graph.calls if func != "main"
+                        and self.symbol_table.linkage_type.get(names.get(func))
+                        != self.symbol_table.INTERNAL}
+
+        def reach(roots):
+            """Return the functions reachable by direct calls from roots."""
+            found = set(roots)
+            stack = list(roots)
+            while stack:
+                for callee in call_graph.callees(stack.pop()):
+                    if callee not in found:
+                        found.add(callee)
+                        stack.append(callee)
+            return found
+
+        from_unknown = reach(entries)
+
+        split_calls = set()
+        for func in call_graph.calls:
+            for command, callee in call_graph.calls[func]:
+                reached = reach([callee]) if callee else set()
+                if not callee or any(call_graph.has_unknown_calls(f)
+                                     for f in reached):
+                    reached |= from_unknown
+                if func not in reached:
+                    split_calls.add(command)
+
+        return split_calls
+
+    def _get_scratch_slot(self):
+        """Return a new scratchpad spot, or None if the scratchpad is full.
+
+        Slots are taken from the top of the scratchpad downwards.
+        """
+        if self.scratch_slots == self.scratch_size:
+            return None
+        self.scratch_slots += 1
+        return ScratchSpot(self.scratch_size - self.scratch_slots)
+
+    def _get_custom_conv_funcs(self, call_graph):
+        """Return the set of functions which may use a custom convention.
+
+        A function may only get a custom calling convention if every call
+        to it is a direct call compiled after it. So, it must not be
+        externally visible (unless -fwhole-program is given), must not have
+        its address taken, must not be recursive, and every call to it must
+        pass the right number of arguments. The main function always uses
+        the default convention.
+        """
+        recursive = set()
+        for component in call_graph.sccs():
+            if call_graph.is_recursive(component):
+                recursive |= set(component)
+
+        names = {name: v for v, name in self.symbol_table.names.items()
+                 if v.ctype.is_function()}
+
+        funcs = set()
+        for func in self.il_code.commands:
+            external = (self.symbol_table.linkage_type.get(names.get(func))
+                        != self.symbol_table.INTERNAL)
+            if (func == "main" or func in recursive
+                  or func in call_graph.address_taken
+                  or (external and not self.arguments.whole_program)):
+                continue
+
+            num_params = len(names[func].ctype.args)
+            if all(len(command.args) == num_params
+                   for caller in call_graph.callers[func]
+                   for command, callee in call_graph.calls[caller]
+                   if callee == func):
+                funcs.add(func)
+
+        return funcs
+
+    def _free_convention(self, commands):
+        """Let the register allocator choose the registers of a convention.
+
+        The argument and return registers are chosen by _fix_convention
+        once registers are allocated.
+        """
+        load_args = [c for c in commands if isinstance(c, value_cmds.LoadArg)]
+        for command in load_args:
+            command.arg_reg = None
+            command.params = [c.output for c in load_args if c != command]
+
+        for command in commands:
+            if isinstance(command, control_cmds.Return):
+                command.ret_reg = None
+
+    def _fix_convention(self, commands, spotmap):
+        """Choose argument and return registers from the given spotmap.
+
+        Each argument is passed in the register its value was allocated to,
+        so no loads are needed on entry. The return value is passed in the
+        register most of the returned values were allocated to.
+        """
+        load_args = [c for c in commands if isinstance(c, value_cmds.LoadArg)
+                     and not c.arg_reg]
+        used = {spotmap.get(c.output) for c in load_args}
+        free = [r for r in self.alloc_registers if r not in used]
+        for command in load_args:
+            reg = spotmap.get(command.output)
+            command.arg_reg = reg if isinstance(reg, RegSpot) else free.pop(0)
+
+        returns = [c for c in commands if isinstance(c, control_cmds.Return)
+                   and not c.ret_reg]
+        counts = {}
+        for command in returns:
+            reg = spotmap.get(command.arg)
+            if isinstance(reg, RegSpot):
+                counts[reg] = counts.get(reg, 0) + 1
+
+        ret_reg = max(counts, key=counts.get) if counts else spots.S0
+        for command in returns:
+            command.ret_reg = ret_reg
+
+    def _get_convention(self, commands):
+        """Return the (argument registers, return register) of a function."""
+        load_args = sorted(
+            (c for c in commands if isinstance(c, value_cmds.LoadArg)),
+            key=lambda c: c.arg_num)
+        arg_regs = [c.arg_reg for c in load_args]
+
+        ret_reg = spots.S0
+        for command in commands:
+            if isinstance(command, control_cmds.Return):
+                ret_reg = command.ret_reg
+
+        return arg_regs, ret_reg
+
+    def _set_callee_info(self, func, call_graph, clobbers, conventions):
+        """Tell each direct call in `func` about its already compiled callee.
+
+        Calls whose callee has no known clobber set keep the default of
+        clobbering every register, and calls whose callee has no custom
+        calling convention keep the default convention.
+        """
+        for command, callee in call_graph.calls[func]:
+            if callee in clobbers:
+                command.callee_clobber = clobbers[callee]
+            if callee in conventions:
+                arg_regs, ret_reg = conventions[callee]
+                command.arg_regs = arg_regs
+                command.ret_reg = ret_reg
+
+    def _get_clobbers(self, func, lines):
+        """Return the set of registers that calling `func` may clobber.
+
+        This is every register written by the ASM code of `func`, plus
+        every register clobbered by its IL commands, such as the calls and
+        runtime routines it calls.
+        """
+        registers = {reg.asm_str(0): reg for reg in spots.registers}
+
+        clobbers = set()
+        for line in lines:
+            if isinstance(line, (asm_cmds.Compare, asm_cmds.Store)):
+                continue
+            reg = registers.get(getattr(line, "dest", None))
+            if reg:
+                clobbers.add(reg)
+
+        for command in self.il_code.commands[func]:
+            clobbers |= set(command.clobber())
+
+        return clobbers
 
-    def _make_asm(self, commands, global_spotmap):
-        """Generate ASM code for given command list."""
+    def _make_asm(self, commands, global_spotmap, stats):
+        """Generate ASM code for given command list.
+
+        stats (RegAllocStats) - Statistics object to fill in with
+        information about register allocation of this function.
+        """
+
+        index = ILIndex(commands)
 
         # Get free values
-        free_values = self._get_free_values(commands, global_spotmap)
+        free_values = self._get_free_values(index, global_spotmap)
 
         # If any variable may have its address referenced, assign it a
         # permanent memory spot if it doesn't yet have one.
         move_to_mem = []
-        for command in commands:
-            refs = command.references().values()
+        for references in index.references:
+            refs = references.values()
             for line in refs:
                 for v in line:
                     if v not in refs:
@@ -297,16 +631,134 @@ class ASMGen:
                 # global_spotmap[v] = MemSpot(spots.RBP, -self.offset)
                 free_values.remove(v)
 
-        # Perform liveliness analysis
-        live_vars = self._get_live_vars(commands, free_values)
+        # Free values which hold a known constant
+        remat = self._get_remat_spots(index, free_values, global_spotmap)
+
+        with profiler.stage("liveness"):
+            live_vars = self._get_live_vars(index, free_values, stats)
+
+        # Split live ranges around calls and loops, then redo liveness
+        # analysis on the new commands
+        slots = {}
+        if self.arguments.split_live_ranges:
+            with profiler.stage("split"):
+                splitter = LiveRangeSplitter(
+                    index, free_values, live_vars, self.alloc_registers)
+                commands, slots = splitter.split(
+                    self.split_calls, remat, self._get_scratch_slot)
+
+        if slots:
+            global_spotmap = {**global_spotmap, **slots}
+            index = ILIndex(commands)
+            with profiler.stage("liveness"):
+                stats.liveness_iters = 0
+                live_vars = self._get_live_vars(index, free_values, stats)
+
+        if self.arguments.regalloc == "linear":
+            g_bak = None
+            with profiler.stage("linear_scan"):
+                allocator = LinearScan(
+                    index, free_values, live_vars, self.alloc_registers)
+                spotmap, spilled_nodes = allocator.allocate(stats)
+        else:
+            # Generate conflict and preference graph
+            with profiler.stage("build_graph"):
+                g_bak = self._generate_graph(index, free_values, live_vars)
+            stats.add_graph(g_bak)
+
+            with profiler.stage("color"):
+                spotmap, spilled_nodes = self._color(g_bak, remat, stats)
+
+            # Search for an optimal coloring of small graphs, keeping the
+            # heuristic one if the search runs out of time
+            if (self.arguments.regalloc_exact and len(g_bak.nodes())
+                  <= self.arguments.regalloc_exact_max_nodes):
+                with profiler.stage("exact"):
+                    allocator = ExactAllocator(
+                        g_bak, self.alloc_registers, remat)
+                    exact = allocator.allocate(
+                        spotmap, self.arguments.regalloc_exact_budget / 1000)
+                if exact:
+                    spotmap, spilled_nodes = exact
+                    stats.add_exact_coloring(g_bak, spotmap, spilled_nodes)
+
+        # Rematerialize spilled constants: their uses read the literal
+        # directly, so the SET which defined them is not emitted.
+        skip = set()
+        for v in spilled_nodes:
+            if v in remat:
+                spotmap[v] = remat[v]
+                skip.add(index.def_sites[v][0])
+        stats.rematerialized = len(skip)
+
+        # Assign stack values to the spilled nodes
+        for v in spilled_nodes:
+            if v in remat:
+                continue
+            self.offset += v.ctype.size
+            # spotmap[v] = MemSpot(spots.RBP, -self.offset)
+
+        # Merge global spotmap into this spotmap
+        for v in global_spotmap:
+            spotmap[v] = global_spotmap[v]
+
+        if g_bak:
+            stats.add_moves(g_bak, spotmap)
+
+        # Choose the registers of a custom calling convention, if the
+        # allocator was free to place the arguments and return value
+        self._fix_convention(commands, spotmap)
+
+        # Generate assembly code
+        with profiler.stage("gen_asm"):
+            self._generate_asm(index, live_vars, spotmap, skip)
+
+    def _get_remat_spots(self, index, free_values, global_spotmap):
+        """Return the literal spots of the free values holding constants.
+
+        A free value is rematerializable if its only definition is a SET
+        from a literal or from another rematerializable value. If such a
+        value is spilled, its uses read the literal instead. SETs to a
+        boolean convert their argument, so they are not considered.
+        """
+        remat = {}
+        changed = True
+        while changed:
+            changed = False
+            for v in free_values:
+                sites = index.def_sites.get(v, [])
+                if v in remat or len(sites) != 1:
+                    continue
+
+                command = index.commands[sites[0]]
+                if (not isinstance(command, value_cmds.Set)
+                      or command.output.ctype.is_bool()):
+                    continue
+
+                spot = remat.get(command.arg, global_spotmap.get(command.arg))
+                if isinstance(spot, LiteralSpot):
+                    remat[v] = spot
+                    changed = True
+
+        return remat
+
+    def _color(self, g_bak, remat, stats):
+        """Color the given conflict/preference graph with registers.
 
-        # Generate conflict and preference graph
-        g_bak = self._generate_graph(commands, free_values, live_vars)
+        Runs simplification, coalescing, freezing, and spilling until the
+        graph is colored. Returns the spotmap for the graph and the list of
+        nodes that were spilled.
 
+        remat - Values which are cheap to rematerialize, and so are spilled
+        before any other node.
+        """
         spilled_nodes = []
+        coalesced = 0
+        frozen = 0
 
         while True:
             g = g_bak.copy()
+            stats.spill_rounds += 1
 
             # Remove all nodes that have been spilled for this iteration
             for n in spilled_nodes:
@@ -328,17 +780,22 @@ class ASMGen:
 
                 if not self._freeze(g):
                     break
+                frozen += 1
+
+            coalesced += sum(len(m) for m in merged_nodes.values())
 
             # If no nodes remain, we are done
             if not g.nodes():
                 break
             # If nodes do remain, spill one of them and retry
             else:
-                # Spill node with highest number of conflicts. This node
-                # will never be a merged node because we merge nodes
+                # Spill a rematerializable node if there is one, and
+                # otherwise the node with highest number of conflicts. This
+                # node will never be a merged node because we merge nodes
                 # conservatively, so any recently merged node can be
                 # simplified immediately.
-                n = max(g.nodes(), key=lambda n: len(g.confs(n)))
+                n = max(g.nodes(),
+                        key=lambda n: (n in remat, len(g.confs(n))))
                 spilled_nodes.append(n)
 
         # Move any remaining nodes from graph into removed_nodes
@@ -347,36 +804,13 @@ class ASMGen:
         while g.all_nodes():
             removed_nodes.append(g.pop(g.all_nodes()[0]))
 
+        stats.spills = len(spilled_nodes)
+        stats.coalesced_moves = coalesced
+        stats.frozen_moves = frozen
+
         # Pop values off the stack to generate spot assignments.
         spotmap = self._generate_spotmap(removed_nodes, merged_nodes, g_bak)
-
-        # Assign stack values to the spilled nodes
-        for v in spilled_nodes:
-            self.offset += v.ctype.size
-            # spotmap[v] = MemSpot(spots.RBP, -self.offset)
-
-        # Merge global spotmap into this spotmap
-        for v in global_spotmap:
-            spotmap[v] = global_spotmap[v]
-
-        if self.arguments.show_reg_alloc_perf:  # pragma: no cover
-            total_prefs = 0
-            matched_prefs = 0
-
-            for n1, n2 in itertools.combinations(g_bak.all_nodes(), 2):
-                if n2 in g_bak.prefs(n1):
-                    total_prefs += 1
-                    if spotmap[n1] == spotmap[n2]:
-                        matched_prefs += 1
-
-            print("total prefs", total_prefs)
-            print("matched prefs", matched_prefs)
-
-            print("total ILValues", len(g_bak.nodes()))
-            print("register ILValues", len(g_bak.nodes()) - len(spilled_nodes))
-
-        # Generate assembly code
-        self._generate_asm(commands, live_vars, spotmap)
+        return spotmap, spilled_nodes
 
     def _get_global_spotmap(self):
         """Generate global spotmap and add global values to ASM.
@@ -442,94 +876,81 @@ class ASMGen:
 
             return MemSpot(name)
 
-    def _get_free_values(self, commands, global_spotmap):
+    def _get_free_values(self, index, global_spotmap):
         """Generate list of free values.
 
         Returns a list of the free values, the variables which need
         allocation on the stack.
         """
-        free_values = []
-        for command in commands:
-            for value in command.inputs() + command.outputs():
-                if (value and value not in free_values
-                      and value not in global_spotmap):
-                    free_values.append(value)
-
-        return free_values
+        return [v for v in index.values if v not in global_spotmap]
 
-    def _get_live_vars(self, commands, free_values):
+    def _get_live_vars(self, index, free_values, stats):
         """Given a set of free ILValues, find when those ILValues are live.
 
+        Live sets are computed as bitsets of value ids from the IL index.
+
         free_values - list of ILValues for which to perform liveliness analysis
+        stats (RegAllocStats) - statistics object in which to record the
+        number of iterations
         returns - array mapping command indices to a tuple where first
         element is a list of variables live coming into the command and the
         second is a list of the variables live exiting the command
         """
-        # Preprocess all commands to get a mapping from labels to command
-        # number.
-        labels = {c.label_name(): i for i, c in enumerate(commands)
-                  if c.label_name()}
+        free = index.bits(free_values)
+        uses = [bits & free for bits in index.uses]
+        defs = [bits & free for bits in index.defs]
 
         # Last iteration of live variables
         prev_live_vars = None
 
         # This iteration of live variables
-        live_vars = [([], []) for i in range(len(commands))]
+        live_vars = [(0, 0)] * len(index.commands)
 
         while live_vars != prev_live_vars:
             prev_live_vars = live_vars[:]
+            stats.liveness_iters += 1
 
-            # List of currently live variables
-            cur_live = []
+            # Set of currently live variables
+            cur_live = 0
 
             # Iterate through commands in backwards order
-            for i, command in list(enumerate(commands))[::-1]:
+            for i in range(len(index.commands) - 1, -1, -1):
                 # If current command is a jump, add the live inputs of all
-                # possible targets to the current live list.
-                for label in command.targets():
-                    i2 = labels[label]
-                    for v in prev_live_vars[i2][0]:
-                        if v not in cur_live:
-                            cur_live.append(v)
+                # possible targets to the current live set.
+                for i2 in index.targets[i]:
+                    cur_live |= prev_live_vars[i2][0]
 
                 # Variables live on output from this command
-                out_live = cur_live[:]
-
-                # Add variables used in this command to current live variables
-                for v in command.inputs():
-                    if v in free_values and v not in cur_live:
-                        cur_live.append(v)
+                out_live = cur_live
 
-                # Remove variables defined in this command to live variables
-                for v in command.outputs():
-                    if v in free_values:
-                        if v in cur_live:
-                            cur_live.remove(v)
-                        else:
-                            # If variable is defined in command but was not
-                            # live, make it live on output from this command.
+                # If variable is defined in command but was not live, make it
+                # live on output from this command.
 
-                            # TODO: Deal with this more efficiently.
-                            # If the output is not live, then we don't actually
-                            # need to perform this computation.
-                            out_live.append(v)
+                # TODO: Deal with this more efficiently.
+                # If the output is not live, then we don't actually need to
+                # perform this computation.
+                out_live |= defs[i] & ~(cur_live | uses[i])
 
-                # Variables live on input from this command
-                in_live = cur_live[:]
+                # Remove variables defined in this command from live
+                # variables, then add the variables it uses. A variable both
+                # used and defined by the command stays live on input.
+                cur_live = (cur_live & ~defs[i]) | uses[i]
 
-                live_vars[i] = (in_live, out_live)
+                live_vars[i] = (cur_live, out_live)
 
-        return live_vars
+        return [(index.values_of(in_live), index.values_of(out_live))
+                for in_live, out_live in live_vars]
 
-    def _generate_graph(self, commands, free_values, live_vars):
+    def _generate_graph(self, index, free_values, live_vars):
         """Generate the conflict/preference graph.
 
         free_values - List of ILValues to include in the graph
         live_vars - Live range information from _get_live_vars
 
         """
+        free = set(free_values)
         g = NodeGraph(free_values)
-        for i, command in enumerate(commands):
+        for i in range(len(index.commands)):
             # Variables active during input
             for n1, n2 in itertools.combinations(live_vars[i][0], 2):
                 g.add_conflict(n1, n2)
@@ -539,21 +960,21 @@ class ASMGen:
                 g.add_conflict(n1, n2)
 
             # Relative conflict set of this command
-            for n1 in command.rel_spot_conf():
-                for n2 in command.rel_spot_conf()[n1]:
-                    if n1 in free_values and n2 in free_values:
+            for n1, confs in index.rel_spot_conf[i].items():
+                for n2 in confs:
+                    if n1 in free and n2 in free:
                         g.add_conflict(n1, n2)
 
             # Absolute conflict set of this command
-            for n in command.abs_spot_conf():
-                for s in command.abs_spot_conf()[n]:
-                    if n in free_values:
+            for n, confs in index.abs_spot_conf[i].items():
+                for s in confs:
+                    if n in free:
                         if s not in g.all_nodes():
                             g.add_dummy_node(s)
                         g.add_conflict(n, s)
 
             # Clobber set of this command
-            for s in command.clobber():
+            for s in index.clobber[i]:
                 if s not in g.all_nodes():
                     g.add_dummy_node(s)
 
@@ -564,15 +985,15 @@ class ASMGen:
                         g.add_conflict(n, s)
 
             # Form preferences based on rel_spot_pref
-            for v1 in command.rel_spot_pref():
-                for v2 in command.rel_spot_pref()[v1]:
+            for v1, prefs in index.rel_spot_pref[i].items():
+                for v2 in prefs:
                     if g.is_node(v1) and g.is_node(v2):
                         g.add_pref(v1, v2)
 
             # Form preferences based on abs_spot_pref
-            for v in command.abs_spot_pref():
-                for s in command.abs_spot_pref()[v]:
-                    if v in free_values:
+            for v, prefs in index.abs_spot_pref[i].items():
+                for s in prefs:
+                    if v in free:
                         if s not in g.all_nodes():
                             g.add_dummy_node(s)
                         g.add_pref(v, s)
@@ -744,8 +1165,11 @@ class ASMGen:
 
         return spotmap
 
-    def _generate_asm(self, commands, live_vars, spotmap):
-        """Generate assembly code."""
+    def _generate_asm(self, index, live_vars, spotmap, skip):
+        """Generate assembly code.
+
+        skip - Set of indices of commands to leave out.
+        """
 
         # This is kinda hacky...
         max_offset = max(spot.rbp_offset() for spot in spotmap.values())
@@ -760,7 +1184,10 @@ class ASMGen:
         # self.asm_code.add(asm_cmds.Sub(spots.RSP, offset_spot, 8))
 
         # Generate code for each command
-        for i, command in enumerate(commands):
+        for i, command in enumerate(index.commands):
+            if i in skip:
+                continue
+
             # self.asm_code.add(asm_cmds.Comment(type(command).__name__.upper()))
 
             def get_reg(pref=None, conf=None):
@@ -773,7 +1200,7 @@ class ASMGen:
                 bad_spots = set(spotmap[var] for var in bad_vars)
 
                 # Spot is free if it is where an output is stored.
-                for v in command.outputs():
+                for v in index.outputs[i]:
                     bad_spots.discard(spotmap[v])
 
                 # Spot is bad if it is listed as a conflicting spot.
@@ -785,4 +1212,12 @@ class ASMGen:
 
                 raise NotImplementedError("spill required for get_reg")
 
+            start = len(self.asm_code.lines)
             command.make_asm(spotmap, spotmap, get_reg, self.asm_code)
+
+            if isinstance(command, control_cmds.Call):
+                self.call_loads[command] = sum(
+                    isinstance(line, asm_cmds.Load)
+                    for line in self.asm_code.lines[start:])
+                self.default_call_loads[command] = command.default_loads(
+                    spotmap)
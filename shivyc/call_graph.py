@@ -0,0 +1,118 @@
+"""Call graph of the functions in one translation unit.
+
+The call graph is built from the IL code. A call is direct if the called
+function pointer is the address of a function defined in this translation
+unit; the callee of every other call is unknown. Interprocedural passes
+use the call graph to visit callees before their callers.
+
+"""
+
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+
+
+class CallGraph:
+    """Call graph of the functions defined in an ILCode object.
+
+    calls - Dictionary mapping each function name to a list of (Call,
+    callee) pairs, one for each call command in that function. The callee is
+    the name of the called function, or None if the call is not direct.
+    callers - Dictionary mapping each function name to the set of names of
+    functions which call it directly.
+    address_taken - Set of names of functions whose address is used other
+    than to call them directly, so they may be called indirectly.
+    """
+
+    def __init__(self, il_code, symbol_table):
+        """Build the call graph of the given IL code."""
+        self.calls = {}
+        self.callers = {func: set() for func in il_code.commands}
+        self.address_taken = set()
+
+        for func, commands in il_code.commands.items():
+            # Map values holding a function address to the function name
+            addresses = {}
+            for command in commands:
+                if (isinstance(command, value_cmds.AddrOf)
+                      and command.var.ctype.is_function()):
+                    name = symbol_table.names.get(command.var)
+                    if name in il_code.commands:
+                        addresses[command.output] = name
+
+            self.calls[func] = []
+            for command in commands:
+                is_call = isinstance(command, control_cmds.Call)
+                if is_call:
+                    callee = addresses.get(command.func)
+                    self.calls[func].append((command, callee))
+                    if callee:
+                        self.callers[callee].add(func)
+
+                for value in command.inputs():
+                    if value in addresses and not (
+                            is_call and value is command.func):
+                        self.address_taken.add(addresses[value])
+
+    def callees(self, func):
+        """Return the set of functions called directly from `func`."""
+        return {callee for _, callee in self.calls[func] if callee}
+
+    def has_unknown_calls(self, func):
+        """Return True iff `func` makes a call that is not direct."""
+        return any(not callee for _, callee in self.calls[func])
+
+    def sccs(self):
+        """Return the strongly connected components of the call graph.
+
+        Components are lists of function names, returned in bottom-up order:
+        every component comes after all components it calls into. This is
+        Tarjan's algorithm, written iteratively so deep call chains do not
+        hit the Python recursion limit.
+        """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in self.calls:
+            if root in index:
+                continue
+
+            work = [(root, iter(sorted(self.callees(root))))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                func, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self.callees(child)))))
+                        break
+                    elif child in on_stack:
+                        low[func] = min(low[func], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[func])
+
+                    if low[func] == index[func]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == func:
+                                break
+                        components.append(component)
+
+        return components
+
+    def is_recursive(self, component):
+        """Return True iff the given component contains a call cycle."""
+        return len(component) > 1 or component[0] in self.callees(component[0])
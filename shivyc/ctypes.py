@@ -1,10 +1,39 @@
-"""This module defines all of the C types recognized by the compiler."""
+"""This module defines all of the C types recognized by the compiler.
+
+C types are hash-consed. Constructing a pointer, array, or function type
+from the same parts always returns the same object, and each type keeps one
+copy per qualification, so identical types are usually identical objects.
+This makes most compatibility checks an identity test, and the remaining
+ones are cached.
+"""
 
 import copy
 
 import token_kinds as token_kinds
 
 
+# Canonical derived types, keyed by class and the parts they are built from
+_interned = {}
+
+# Result of the compatibility check for each pair of distinct types
+_compatible = {}
+
+
+class _InternedType(type):
+    """Metaclass which hash-conses the instances of a derived C type.
+
+    Classes using this metaclass define an `intern_key` static method which
+    maps the constructor arguments to a hashable key.
+    """
+
+    def __call__(cls, *args):
+        key = (cls,) + cls.intern_key(*args)
+        ctype = _interned.get(key)
+        if ctype is None:
+            ctype = _interned[key] = super().__call__(*args)
+        return ctype
+
+
 class CType:
     """Represents a C type, like `int` or `double` or a struct or union.
 
@@ -23,6 +52,10 @@ class CType:
         # function for the struct.
         self._orig = self
 
+        # Copies of this type with other qualifiers, keyed by _quals. This
+        # dictionary is shared by all the copies.
+        self._variants = {self._quals(): self}
+
     def weak_compat(self, other):
         """Check for weak compatibility with `other` ctype.
 
@@ -84,7 +117,14 @@ class CType:
 
     def compatible(self, other):
         """Check whether given `other` C type is compatible with self."""
-        return self.weak_compat(other) and self.const == other.const
+        if self is other:
+            return True
+
+        key = (self, other)
+        if key not in _compatible:
+            _compatible[key] = (self.weak_compat(other) and
+                                self.const == other.const)
+        return _compatible[key]
 
     def is_scalar(self):
         """Check whether this has scalar type."""
@@ -96,15 +136,26 @@ class CType:
 
     def make_const(self):
         """Return a const version of this type."""
-        const_self = copy.copy(self)
-        const_self.const = True
-        return const_self
+        return self._variant(const=True)
 
     def make_unqual(self):
         """Return an unqualified version of this type."""
-        unqual_self = copy.copy(self)
-        unqual_self.const = False
-        return unqual_self
+        return self._variant(const=False)
+
+    def _quals(self):
+        """Return a key describing the qualifiers of this type."""
+        return (self.const,)
+
+    def _variant(self, **quals):
+        """Return the copy of this type with the given qualifiers changed.
+
+        Each copy is created once and reused afterwards.
+        """
+        variant = copy.copy(self)
+        for name, value in quals.items():
+            setattr(variant, name, value)
+
+        return self._variants.setdefault(variant._quals(), variant)
 
 
 class IntegerCType(CType):
@@ -148,9 +199,11 @@ class IntegerCType(CType):
 
     def make_unsigned(self):
         """Return an unsigned version of this type."""
-        unsig_self = copy.copy(self)
-        unsig_self.signed = False
-        return unsig_self
+        return self._variant(signed=False)
+
+    def _quals(self):
+        """Return a key describing the qualifiers of this type."""
+        return (self.const, self.signed)
 
 
 class VoidCType(CType):
@@ -180,7 +233,7 @@ class VoidCType(CType):
         return True
 
 
-class PointerCType(CType):
+class PointerCType(CType, metaclass=_InternedType):
     """Represents a pointer C type.
 
     arg (CType) - Type pointed to.
@@ -192,6 +245,15 @@ class PointerCType(CType):
         self.arg = arg
         super().__init__(8, const)
 
+    @staticmethod
+    def intern_key(arg, const=False):
+        """Return the key identifying this pointer type."""
+        return arg, bool(const)
+
+    def _variant(self, const):
+        """Return the interned pointer type with the given qualifier."""
+        return PointerCType(self.arg, const)
+
     def weak_compat(self, other):
         """Return True iff other is a compatible type to self."""
         return other.is_pointer() and self.arg.compatible(other.arg)
@@ -209,7 +271,7 @@ class PointerCType(CType):
         return True
 
 
-class ArrayCType(CType):
+class ArrayCType(CType, metaclass=_InternedType):
     """Represents an array C type.
 
     el (CType) - Type of each element in array.
@@ -223,10 +285,16 @@ class ArrayCType(CType):
         self.n = n
         super().__init__((n or 1) * self.el.size)
 
+    @staticmethod
+    def intern_key(el, n):
+        """Return the key identifying this array type."""
+        return el, n
+
     def compatible(self, other):
         """Return True iff other is a compatible type to self."""
-        return (other.is_array() and self.el.compatible(other.el) and
-                (self.n is None or other.n is None or self.n == other.n))
+        return self is other or (
+            other.is_array() and self.el.compatible(other.el) and
+            (self.n is None or other.n is None or self.n == other.n))
 
     def is_complete(self):
         """Check if this is a complete type."""
@@ -244,7 +312,7 @@ class ArrayCType(CType):
         return True
 
 
-class FunctionCType(CType):
+class FunctionCType(CType, metaclass=_InternedType):
     """Represents a function C type.
 
     args (List(CType)) - List of the argument ctypes, from left to right, or
@@ -262,6 +330,11 @@ class FunctionCType(CType):
         self.no_info = no_info
         super().__init__(1)
 
+    @staticmethod
+    def intern_key(args, ret, no_info):
+        """Return the key identifying this function type."""
+        return tuple(args), ret, no_info
+
     def weak_compat(self, other):
         """Return True iff other is a compatible type to self."""
 
@@ -342,6 +415,12 @@ class _UnionStructCType(CType):
         """
         raise NotImplementedError
 
+    def _update_variants(self):
+        """Copy the members of this type into its qualified copies."""
+        for variant in self._variants.values():
+            variant.members = self.members
+            variant.size = self.size
+
 
 class StructCType(_UnionStructCType):
     """Represents a struct ctype."""
@@ -355,6 +434,7 @@ class StructCType(_UnionStructCType):
             cur_offset += ctype.size
 
         self.size = cur_offset
+        self._update_variants()
 
 
 class UnionCType(_UnionStructCType):
@@ -368,6 +448,7 @@ class UnionCType(_UnionStructCType):
         self.size = max([ctype.size for _, ctype in members], default=0)
         for member, ctype in members:
             self.offsets[member] = 0, ctype
+        self._update_variants()
 
 
 # These definitions are here to permit convenient creation of new integer,
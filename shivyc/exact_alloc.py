@@ -0,0 +1,156 @@
+"""Exact register allocation by branch and bound.
+
+This allocator is enabled with `-fregalloc-exact`. For functions whose
+conflict graph is small enough, it searches every coloring of the graph for
+one which first minimizes the number of spilled values and then the number
+of preference edges left unsatisfied, each of which costs a move.
+Spilling a rematerializable value costs only as much as a move, because
+its uses read a literal instead of memory. The search stops once its time budget is spent, in which case the result of the
+graph coloring allocator is kept.
+
+"""
+
+import time
+
+from spots import Spot
+
+
+class _OutOfTime(Exception):
+    """Raised when the search exceeds its time budget."""
+
+
+class ExactAllocator:
+    """Branch and bound search over the colorings of a NodeGraph.
+
+    A spill costs more than all preference edges together, so the cost of a
+    coloring orders colorings first by spills and then by unsatisfied
+    preference edges. Spilling a rematerializable node costs the same as
+    one unsatisfied preference edge. The search assigns the nodes in decreasing order of
+    conflict degree and prunes every partial coloring whose cost already
+    reaches the best complete one. Registers used by no assigned node and
+    by no pseudonode are interchangeable, so only the first of them is
+    tried.
+
+    g (NodeGraph) - Conflict and preference graph to color.
+    registers - List of registers to allocate, sorted preferred-first.
+    remat - Nodes which are cheap to rematerialize.
+    """
+
+    def __init__(self, g, registers, remat=()):
+        """Initialize the search for graph `g`."""
+        self.registers = registers
+        self.nodes = sorted(g.nodes(), key=lambda n: -len(g.confs(n)))
+        self.spill_cost = (sum(len(g.prefs(n)) for n in g.all_nodes())
+                           + 1)
+        self.spill_costs = {n: 1 if n in remat else self.spill_cost
+                            for n in self.nodes}
+
+        real = set(self.nodes)
+        self.confs = {n: [m for m in g.confs(n) if m in real]
+                      for n in self.nodes}
+        self.prefs = {n: [m for m in g.prefs(n) if m in real]
+                      for n in self.nodes}
+        self.fixed_confs = {n: {m for m in g.confs(n) if isinstance(m, Spot)}
+                            for n in self.nodes}
+        self.fixed_prefs = {n: [m for m in g.prefs(n) if isinstance(m, Spot)]
+                            for n in self.nodes}
+        self.precolored = {n for n in g.all_nodes() if isinstance(n, Spot)}
+
+    def cost(self, spotmap):
+        """Return the cost of the coloring given by `spotmap`."""
+        cost = 0
+        unsatisfied = 0
+        for n in self.nodes:
+            if n not in spotmap:
+                cost += self.spill_costs[n]
+            cost += sum(spotmap.get(n) != s for s in self.fixed_prefs[n])
+            unsatisfied += sum(n not in spotmap or m not in spotmap
+                               or spotmap[n] != spotmap[m]
+                               for m in self.prefs[n] if m is not n)
+
+        # Every preference edge between two nodes was counted twice
+        return cost + unsatisfied // 2
+
+    def allocate(self, spotmap, budget):
+        """Return a coloring at least as good as `spotmap`, or None.
+
+        spotmap - Coloring found by the heuristic allocator, used as the
+        initial bound.
+        budget (float) - Time budget of the search, in seconds.
+
+        Returns a (spotmap, spilled nodes) pair for the best coloring, or
+        None if the search ran out of time.
+        """
+        self.best_cost = self.cost(spotmap)
+        self.best = None
+        self.assigned = {}
+        self.deadline = time.perf_counter() + budget
+
+        try:
+            self._search(0, 0)
+        except _OutOfTime:
+            return None
+
+        if not self.best:
+            return spotmap, [n for n in self.nodes if n not in spotmap]
+
+        best = {n: reg for n, reg in self.best.items() if reg}
+        for spot in self.precolored:
+            best[spot] = spot
+        return best, [n for n in self.nodes if not self.best[n]]
+
+    def _search(self, i, cost):
+        """Assign nodes i onwards, given the cost of the nodes before it."""
+        if cost >= self.best_cost:
+            return
+        if i == len(self.nodes):
+            self.best_cost = cost
+            self.best = dict(self.assigned)
+            return
+        if time.perf_counter() > self.deadline:
+            raise _OutOfTime
+
+        n = self.nodes[i]
+        for reg in self._candidates(n):
+            self.assigned[n] = reg
+            self._search(i + 1, cost + self._added_cost(n, reg))
+        del self.assigned[n]
+
+    def _candidates(self, n):
+        """Return the registers to try for node `n`, best first.
+
+        The list ends with None, which stands for spilling the node.
+        """
+        bad = set(self.fixed_confs[n])
+        bad.update(self.assigned[m] for m in self.confs[n]
+                   if m in self.assigned)
+
+        used = set(self.assigned.values()) | self.precolored
+        preferred = self.fixed_prefs[n] + [self.assigned[m]
+                                           for m in self.prefs[n]
+                                           if self.assigned.get(m)]
+
+        candidates = []
+        fresh = False
+        for reg in preferred + self.registers:
+            if reg in bad or reg in candidates or not reg:
+                continue
+            if reg not in used:
+                if fresh:
+                    continue
+                fresh = True
+            candidates.append(reg)
+
+        return candidates + [None]
+
+    def _added_cost(self, n, reg):
+        """Return the cost of assigning `reg` to `n` after its neighbors."""
+        if not reg:
+            cost = self.spill_costs[n] + len(self.fixed_prefs[n])
+        else:
+            cost = sum(reg != s for s in self.fixed_prefs[n])
+
+        for m in self.prefs[n]:
+            if m in self.assigned and m is not n:
+                cost += not reg or self.assigned[m] != reg
+        return cost
@@ -1,5 +1,6 @@
 """Base ILCommand interface definition."""
 
+import copy
 import ctypes as ctypes
 from spots import LiteralSpot
 
@@ -7,6 +8,9 @@ from spots import LiteralSpot
 class ILCommand:
     """Base interface for all IL commands."""
 
+    # Names of the attributes which hold the outputs of this command
+    output_attrs = ("output",)
+
     def inputs(self):
         """Return list of ILValues used as input for this command."""
         raise NotImplementedError
@@ -115,6 +119,36 @@ class ILCommand:
         """Return list of any labels to which this command may jump."""
         return []
 
+    def rename(self, inputs, outputs):
+        """Replace the ILValues this command reads and writes.
+
+        inputs - Dictionary mapping each input ILValue to be replaced to its
+        replacement.
+        outputs - Dictionary mapping each output ILValue to be replaced to
+        its replacement.
+
+        Attributes named in `output_attrs` hold outputs, and every other
+        attribute holding an ILValue or list of ILValues holds inputs.
+        """
+        for attr, value in list(vars(self).items()):
+            mapping = outputs if attr in self.output_attrs else inputs
+            if isinstance(value, list):
+                setattr(self, attr, [mapping.get(v, v) for v in value])
+            elif not isinstance(value, dict):
+                setattr(self, attr, mapping.get(value, value))
+
+    def copy(self):
+        """Return a copy of this command.
+
+        Lists and dictionaries held by the command are copied as well, so
+        renaming the copy leaves this command unchanged.
+        """
+        new = copy.copy(self)
+        for attr, value in list(vars(new).items()):
+            if isinstance(value, (list, dict)):
+                setattr(new, attr, type(value)(value))
+        return new
+
     def make_asm(self, spotmap, home_spots, get_reg, asm_code):
         """Generate assembly code for this command.
 
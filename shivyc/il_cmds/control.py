@@ -92,17 +92,70 @@ class JumpNotZero(_GeneralJump):
     command = asm_cmds.JumpNZ
 
 
+class SubtrJumpNotZero(ILCommand):
+    """Subtracts arg2 from arg1, then jumps to a label if the difference is
+    not zero.
+
+    This is the decrement-and-branch which closes a loop counting down, and
+    uses the zero flag set by the subtraction rather than a comparison.
+    IL values output, arg1, arg2 must all have the same type.
+    """
+
+    def __init__(self, output, arg1, arg2, label): # noqa D102
+        self.output = output
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.label = label
+
+    def inputs(self): # noqa D102
+        return [self.arg1, self.arg2]
+
+    def outputs(self): # noqa D102
+        return [self.output]
+
+    def targets(self): # noqa D102
+        return [self.label]
+
+    def rel_spot_pref(self): # noqa D102
+        return {self.output: [self.arg1]}
+
+    def make_asm(self, spotmap, home_spots, get_reg, asm_code): # noqa D102
+        size = self.output.ctype.size
+        out_spot = spotmap[self.output]
+        arg1_spot = spotmap[self.arg1]
+        arg2_spot = spotmap[self.arg2]
+
+        temp = get_reg([out_spot, arg1_spot], [arg2_spot])
+        if temp != arg1_spot:
+            asm_code.add(asm_cmds.Load(temp, arg1_spot, size))
+        asm_code.add(asm_cmds.Sub(temp, arg2_spot, size))
+
+        # LOAD leaves the flags set by SUB unchanged.
+        if temp != out_spot:
+            asm_code.add(asm_cmds.Load(out_spot, temp, size))
+        asm_code.add(asm_cmds.JumpNZ(self.label))
+
+
 class Return(ILCommand):
     """RETURN - returns the given value from function.
 
     If arg is None, then returns from the function without putting any value
     in the return register. Today, only supports values that fit in one
     register.
+
+    ret_reg - Register in which to return the value. This is S0 unless the
+    function uses a custom calling convention, in which case the ASM
+    generator sets it to None during register allocation and chooses the
+    register afterwards.
+    after_jump - True if this is the return after a tail call which jumped
+    to its callee, so it is never reached. Set by Call.make_asm.
     """
 
     def __init__(self, arg=None): # noqa D102
         # arg must already be cast to return type
         self.arg = arg
+        self.ret_reg = spots.S0
+        self.after_jump = False
 
     def inputs(self): # noqa D102
         return [self.arg]
@@ -111,15 +164,18 @@ class Return(ILCommand):
         return []
 
     def clobber(self):  # noqa D102
-        return [spots.S0]
+        return [self.ret_reg] if self.ret_reg else []
 
     def abs_spot_pref(self):  # noqa D102
-        return {self.arg: [spots.S0]}
+        return {self.arg: [self.ret_reg]} if self.ret_reg else {}
 
     def make_asm(self, spotmap, home_spots, get_reg, asm_code): # noqa D102
-        if self.arg and spotmap[self.arg] != spots.S0:
+        if self.after_jump:
+            return
+
+        if self.arg and spotmap[self.arg] != self.ret_reg:
             size = self.arg.ctype.size
-            asm_code.add(asm_cmds.Load(spots.S0, spotmap[self.arg]))
+            asm_code.add(asm_cmds.Load(self.ret_reg, spotmap[self.arg]))
 
         asm_code.add(asm_cmds.Return())
 
@@ -132,6 +188,20 @@ class Call(ILCommand):
     parameter types the function expects.
     ret - If function has non-void return type, IL value to save the return
     value. Its type must match the function return value.
+
+    callee - Name of the called function if it is known to be a function
+    defined in this translation unit, or None. Set by the ASM generator.
+    callee_clobber - If not None, the set of registers the called function
+    may clobber, as computed by interprocedural register allocation. If
+    None, the call is assumed to clobber every register.
+    arg_regs, ret_reg - Registers in which to pass the arguments and receive
+    the return value. These are the default convention unless the callee
+    uses a custom calling convention.
+    tail - The Return command right after this call if the call is a tail
+    call, or None. Set by the optimizer. A direct tail call jumps to the
+    callee instead of calling it when the callee returns its value in the
+    register the caller returns its value in, so the callee returns
+    straight to the caller's caller.
     """
 
     arg_regs = [spots.S0, spots.S1, spots.S2, spots.S3,
@@ -139,12 +209,19 @@ class Call(ILCommand):
                 spots.S8, spots.S9, spots.SA, spots.SB,
                 spots.SC, spots.SD, spots.SE, spots.SF]
 
+    output_attrs = ("ret",)
+
     def __init__(self, func, args, ret): # noqa D102
         self.func = func
         self.args = args
         self.ret = ret
         self.void_return = self.func.ctype.arg.ret.is_void()
 
+        self.callee = None
+        self.callee_clobber = None
+        self.ret_reg = spots.S0
+        self.tail = None
+
         if len(self.args) > len(self.arg_regs):
             raise NotImplementedError("too many arguments")
 
@@ -155,15 +232,24 @@ class Call(ILCommand):
         return [] if self.void_return else [self.ret]
 
     def clobber(self): # noqa D102
-        # All caller-saved registers are clobbered by function call
-        return [spots.S0, spots.S1, spots.S2, spots.S3,
-                spots.S4, spots.S5, spots.S6, spots.S7,
-                spots.S8, spots.S9, spots.SA, spots.SB,
-                spots.SC, spots.SD, spots.SE, spots.SF]
+        # All caller-saved registers are clobbered by function call, unless
+        # we know exactly which registers the callee uses.
+        if self.callee_clobber is None:
+            return [spots.S0, spots.S1, spots.S2, spots.S3,
+                    spots.S4, spots.S5, spots.S6, spots.S7,
+                    spots.S8, spots.S9, spots.SA, spots.SB,
+                    spots.SC, spots.SD, spots.SE, spots.SF]
+
+        # The argument registers are overwritten before the call, and the
+        # return value comes back in S0.
+        clobber = set(self.callee_clobber)
+        clobber |= set(self.arg_regs[0:len(self.args)])
+        if not self.void_return:
+            clobber.add(self.ret_reg)
+        return [reg for reg in spots.registers if reg in clobber]
 
     def abs_spot_pref(self): # noqa D102
-        prefs = {} if self.void_return else {self.ret: [spots.S0]}
-        # prefs = {} if self.void_return else self.func
+        prefs = {} if self.void_return else {self.ret: [self.ret_reg]}
         for arg, reg in zip(self.args, self.arg_regs):
             prefs[arg] = [reg]
 
@@ -186,25 +272,95 @@ class Call(ILCommand):
         func_size = self.func.ctype.size
         ret_size = self.func.ctype.arg.ret.size
 
+        # Registers which hold an argument before or after the moves.
+        arg_spots = (self.arg_regs[0:len(self.args)] +
+                     [spotmap[arg] for arg in self.args])
+
         # Check if function pointer spot will be clobbered by moving the
         # arguments into the correct registers.
-        if spotmap[self.func] in self.arg_regs[0:len(self.args)]:
+        if (not self.callee and
+              spotmap[self.func] in self.arg_regs[0:len(self.args)]):
             # Get a register which isn't one of the unallowed registers.
-            # r = get_reg([], self.arg_regs[0:len(self.args)])
-            r = self.func
-            print("2", r)
+            r = get_reg([], arg_spots)
             asm_code.add(asm_cmds.Load(r, spotmap[self.func]))
             func_spot = r
 
-        for arg, reg in zip(self.args, self.arg_regs):
-            if spotmap[arg] == reg:
-                continue
-            print("2", spotmap[arg])
-            asm_code.add(asm_cmds.Load(reg, spotmap[arg]))
-        print("4", spotmap[self.func])
-        asm_code.add(asm_cmds.Call(func_spot))
-        # asm_code.add(asm_cmds.Call(func))
+        moves = [(reg, spotmap[arg])
+                 for arg, reg in zip(self.args, self.arg_regs)]
+        self._parallel_move(moves, get_reg, asm_code,
+                            arg_spots + [func_spot])
+
+        if self.tail:
+            self.tail.after_jump = bool(self.callee) and (
+                not self.tail.arg or self.tail.ret_reg == self.ret_reg)
+            if self.tail.after_jump:
+                asm_code.add(asm_cmds.Jump(self.callee))
+                return
+
+        if self.callee:
+            asm_code.add(asm_cmds.CallLabel(self.callee))
+        else:
+            asm_code.add(asm_cmds.Call(func_spot))
+
+
+        if not self.void_return and spotmap[self.ret] != self.ret_reg:
+            asm_code.add(asm_cmds.Load(spotmap[self.ret], self.ret_reg))
+
+    def default_loads(self, spotmap):
+        """Return the loads this call emits with the default convention.
+
+        This counts the loads make_asm would emit with the arguments passed
+        in the default argument registers and the value returned in S0,
+        keeping the spots the register allocator chose for each value.
+        """
+        moves = [(reg, spotmap[arg])
+                 for arg, reg in zip(self.args, Call.arg_regs)]
+        loads = self._count_moves(moves)
 
+        if (not self.callee and
+              spotmap[self.func] in Call.arg_regs[0:len(self.args)]):
+            loads += 1
 
+        # With the default convention both functions return in S0, so a
+        # direct tail call always jumps to the callee.
+        if self.callee and self.tail:
+            return loads
         if not self.void_return and spotmap[self.ret] != spots.S0:
-            asm_code.add(asm_cmds.Load(spotmap[self.ret], spots.S0))
+            loads += 1
+        return loads
+
+    def _count_moves(self, moves):
+        """Return the loads _parallel_move emits for the given moves."""
+        moves = [(dest, src) for dest, src in moves if dest != src]
+        loads = 0
+        while moves:
+            loads += 1
+            for i, (dest, src) in enumerate(moves):
+                if all(dest != other for _, other in moves):
+                    del moves[i]
+                    break
+            else:
+                # Breaking a cycle copies a source into a free register.
+                moves[0] = (moves[0][0], None)
+        return loads
+
+    def _parallel_move(self, moves, get_reg, asm_code, conf):
+        """Emit loads which perform all (dest, source) moves at once.
+
+        A load is only emitted once no other pending move still reads its
+        destination. If every pending move is blocked, the moves form a
+        cycle, which is broken by copying one source into a free register
+        not among the spots in `conf`.
+        """
+        moves = [(dest, src) for dest, src in moves if dest != src]
+        while moves:
+            for i, (dest, src) in enumerate(moves):
+                if all(dest != other for _, other in moves):
+                    asm_code.add(asm_cmds.Load(dest, src))
+                    del moves[i]
+                    break
+            else:
+                dest, src = moves[0]
+                r = get_reg([], conf)
+                asm_code.add(asm_cmds.Load(r, src))
+                moves[0] = (dest, r)
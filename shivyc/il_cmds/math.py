@@ -1,8 +1,12 @@
 """IL commands for mathematical operations."""
 
+import functools
+
 import asm_cmds as asm_cmds
+import runtime as runtime
 import spots as spots
 from il_cmds.base import ILCommand
+from spots import HexLiteralSpot
 
 
 class _AddMult(ILCommand):
@@ -110,9 +114,180 @@ class Mult(_AddMult):
 
     IL values output, arg1, arg2 must all have the same type. No type
     conversion or promotion is done here.
+
+    KCPSM3 has no multiply instruction. A multiplication by a literal is
+    done with the shifts and adds of _get_mult_steps if they take fewer
+    cycles than a call, and any other multiplication calls the __mul8
+    runtime routine. Every value is held in one 8-bit register, so the
+    product is taken modulo 256.
     """
     comm = True
-    Inst = asm_cmds.Imul
+
+    def clobber(self):  # noqa D102
+        if self._get_literal_factor():
+            return []
+        return runtime.mult_clobber()
+
+    def abs_spot_pref(self):  # noqa D102
+        if self._get_literal_factor():
+            return {}
+        return {self.output: [spots.S0],
+                self.arg1: [spots.S0],
+                self.arg2: [spots.S1]}
+
+    def make_asm(self, spotmap, home_spots, get_reg, asm_code):  # noqa D102
+        factor = self._get_literal_factor()
+        if factor:
+            value, multiplier = factor
+            self._make_shift_add(
+                spotmap, get_reg, asm_code, value, multiplier)
+            return
+
+        size = self.output.ctype.size
+        arg1_spot = spotmap[self.arg1]
+        arg2_spot = spotmap[self.arg2]
+
+        # Multiplication is commutative, so the operands are swapped when
+        # either is in the register of the other.
+        if arg2_spot == spots.S0 or arg1_spot == spots.S1:
+            arg1_spot, arg2_spot = arg2_spot, arg1_spot
+
+        if arg1_spot != spots.S0:
+            asm_code.add(asm_cmds.Load(spots.S0, arg1_spot, size))
+        if arg2_spot != spots.S1:
+            asm_code.add(asm_cmds.Load(spots.S1, arg2_spot, size))
+
+        asm_code.add(asm_cmds.CallLabel(runtime.MULT_ROUTINE))
+        asm_code.add_routine(runtime.MULT_ROUTINE)
+
+        if spotmap[self.output] != spots.S0:
+            asm_code.add(asm_cmds.Load(spotmap[self.output], spots.S0, size))
+
+    def _get_literal_factor(self):
+        """Return the (value, multiplier) of a multiplication by a literal.
+
+        The multiplier is reduced modulo 256. Returns None if neither
+        argument is a literal, or if calling the runtime routine is faster
+        than the shifts and adds.
+        """
+        for value, literal in ((self.arg1, self.arg2),
+                               (self.arg2, self.arg1)):
+            val = getattr(getattr(literal, "literal", None), "val", None)
+            if isinstance(val, int):
+                multiplier = val % 256
+                if not multiplier:
+                    return value, multiplier
+                cycles, _ = _get_mult_steps(multiplier)
+                call = 2 * 3 + runtime.mult_cycles(multiplier)
+                if cycles <= call:
+                    return value, multiplier
+        return None
+
+    def _make_shift_add(self, spotmap, get_reg, asm_code, value,
+                        multiplier):
+        """Make the ASM multiplying `value` by a literal multiplier."""
+        size = self.output.ctype.size
+        out_spot = spotmap[self.output]
+        value_spot = spotmap[value]
+
+        if not multiplier:
+            asm_code.add(asm_cmds.Load(out_spot, HexLiteralSpot(0), size))
+            return
+
+        _, steps = _get_mult_steps(multiplier)
+        if any(step in ("add", "sub") for step in steps):
+            acc = get_reg([out_spot], [value_spot])
+        else:
+            acc = get_reg([out_spot, value_spot])
+        if "save" in steps:
+            saved = get_reg([], [acc, value_spot])
+        else:
+            saved = None
+        _add_mult_steps(asm_code, steps, acc, value_spot, saved, size)
+
+        if acc != out_spot:
+            asm_code.add(asm_cmds.Load(out_spot, acc, size))
+
+
+def _add_mult_steps(asm_code, steps, acc, value_spot, saved, size):
+    """Add the ASM of the steps from _get_mult_steps.
+
+    acc - Register to hold the product.
+    value_spot - Spot of the value multiplied. This may be acc only if
+    the steps read it just to load it.
+    saved - Second register for the save step, or None if it is unused.
+    """
+    insts = {"add": asm_cmds.Add, "sub": asm_cmds.Sub,
+             "add_saved": asm_cmds.Add, "sub_saved": asm_cmds.Sub}
+    for step in steps:
+        if step == "load":
+            if acc != value_spot:
+                asm_code.add(asm_cmds.Load(acc, value_spot, size))
+        elif step == "zero":
+            asm_code.add(asm_cmds.Load(acc, HexLiteralSpot(0), size))
+        elif step == "shift":
+            asm_code.add(asm_cmds.Sl0(acc, None, size, size))
+        elif step == "save":
+            asm_code.add(asm_cmds.Load(saved, acc, size))
+        elif step in ("add", "sub"):
+            asm_code.add(insts[step](acc, value_spot, size))
+        else:
+            asm_code.add(insts[step](acc, saved, size))
+
+
+def _get_mult_steps(multiplier):
+    """Return the fastest shifts and adds multiplying a value by a literal.
+
+    multiplier - Multiplier from 1 to 255.
+
+    Returns a pair of the clock cycles taken and the list of steps, each of
+    which is one instruction:
+
+        load - load the value into the accumulator
+        zero - load zero into the accumulator
+        shift - shift the accumulator left one bit
+        add, sub - add the value to or subtract it from the accumulator
+        save - copy the accumulator into a second register
+        add_saved, sub_saved - add the saved copy to or subtract it from
+        the accumulator
+
+    Products are taken modulo 256, so a multiplier m may also be computed
+    as the negative of 256 - m, which starts from zero minus the value.
+    """
+    steps = _get_chain(multiplier)
+    negated = {"load": ["zero", "sub"], "add": ["sub"], "sub": ["add"]}
+    negative = [new for step in _get_chain(256 - multiplier)
+                for new in negated.get(step, [step])]
+    if len(negative) < len(steps):
+        steps = negative
+    return 2 * len(steps), steps
+
+
+@functools.lru_cache(maxsize=None)
+def _get_chain(multiplier):
+    """Return the fewest steps multiplying a value by a positive multiplier.
+
+    The search covers every signed-digit form of the multiplier evaluated
+    from its top digit down, as x * 10 = ((x << 2) + x) << 1, which
+    includes the canonical signed-digit form, as well as products of such
+    forms with factors 2^i + 1 and 2^i - 1, as x * 45 = (x * 5) * 9. The
+    steps are those of _get_mult_steps.
+    """
+    if multiplier == 1:
+        options = [["load"]]
+    elif multiplier % 2 == 0:
+        options = [_get_chain(multiplier // 2) + ["shift"]]
+    else:
+        options = [_get_chain(multiplier // 2) + ["shift", "add"],
+                   _get_chain(multiplier // 2 + 1) + ["shift", "sub"]]
+
+    for i in range(2, 8):
+        for factor, step in ((2 ** i + 1, "add_saved"),
+                             (2 ** i - 1, "sub_saved")):
+            if factor < multiplier and multiplier % factor == 0:
+                options.append(_get_chain(multiplier // factor)
+                               + ["save"] + ["shift"] * i + [step])
+    return min(options, key=len)
 
 
 class _BitShiftCmd(ILCommand):
@@ -190,12 +365,18 @@ class LBitShift(_BitShiftCmd):
 
 
 class _DivMod(ILCommand):
-    """Base class for ILCommand Div and Mod."""
+    """Base class for ILCommand Div and Mod.
 
-    # Register which contains the value we want after the x86 div or idiv
-    # command is executed. For the Div IL command, this is spots.S0,
-    # and for the Mod IL command, this is spots.S3.
-    return_reg = None
+    KCPSM3 has no divide instruction. A division by a literal is done with
+    the steps of _get_div_plan if they take fewer cycles than a call, and
+    any other division calls the __udiv8 or __div8 runtime routine, which
+    produces both the quotient and the remainder. Every value is held in
+    one 8-bit register, so values are divided as 8-bit values.
+    """
+
+    # Whether this command computes the remainder rather than the quotient.
+    # Override this value in subclasses.
+    remainder = None
 
     def __init__(self, output, arg1, arg2):
         self.output = output
@@ -209,57 +390,232 @@ class _DivMod(ILCommand):
         return [self.output]
 
     def clobber(self):  # noqa D102
-        return [spots.S0, spots.S3]
-
-    def abs_spot_conf(self): # noqa D102
-        return {self.arg2: [spots.S3, spots.S0]}
-
-    def abs_spot_pref(self): # noqa D102
-        return {self.output: [self.return_reg],
-                self.arg1: [spots.S0]}
-
-    def make_asm(self, spotmap, home_spots, get_reg, asm_code): # noqa D102
-        ctype = self.arg1.ctype
-        size = ctype.size
-
-        output_spot = spotmap[self.output]
+        if self._get_literal_divisor():
+            return []
+        return runtime.div_clobber(self.arg1.ctype.signed)
+
+    def abs_spot_pref(self):  # noqa D102
+        if self._get_literal_divisor():
+            return {}
+        return {self.output: [self._get_result_reg()],
+                self.arg1: [spots.S0],
+                self.arg2: [spots.S1]}
+
+    def make_asm(self, spotmap, home_spots, get_reg, asm_code):  # noqa D102
+        literal = self._get_literal_divisor()
+        if literal:
+            divisor, plan = literal
+            self._make_literal(spotmap, get_reg, asm_code, divisor, plan)
+            return
+
+        size = self.arg1.ctype.size
         arg1_spot = spotmap[self.arg1]
         arg2_spot = spotmap[self.arg2]
 
-        # Move first operand into S0 if we can do so without clobbering
-        # other argument
-        moved_to_rax = False
-        if spotmap[self.arg1] != spots.S0 and spotmap[self.arg2] != spots.S0:
-            moved_to_rax = True
-            asm_code.add(asm_cmds.Load(spots.S0, arg1_spot, size))
-
-        # If the divisor is a literal or in a bad register, we must move it
-        # to a register.
-        if (self._is_imm(spotmap[self.arg2]) or
-             spotmap[self.arg2] in [spots.S0, spots.S3]):
-            r = get_reg([], [spots.S0, spots.S3])
-            asm_code.add(asm_cmds.Load(r, arg2_spot, size))
-            arg2_final_spot = r
-        else:
-            arg2_final_spot = arg2_spot
-
-        # If we did not move to S0 above, do so here.
-        if not moved_to_rax and arg1_spot != self.return_reg:
+        # Move the dividend into S0 and the divisor into S1 without
+        # overwriting either first.
+        if arg2_spot == spots.S0:
+            if arg1_spot == spots.S1:
+                temp = get_reg([], [spots.S0, spots.S1])
+                asm_code.add(asm_cmds.Load(temp, arg1_spot, size))
+                arg1_spot = temp
+            asm_code.add(asm_cmds.Load(spots.S1, arg2_spot, size))
+            arg2_spot = spots.S1
+        if arg1_spot != spots.S0:
             asm_code.add(asm_cmds.Load(spots.S0, arg1_spot, size))
-
-        if ctype.signed:
-            # if ctype.size == 4:
-            #     asm_code.add(asm_cmds.Cdq())
-            # elif ctype.size == 8:
-            #     asm_code.add(asm_cmds.Cqo())
-            asm_code.add(asm_cmds.Idiv(arg2_final_spot, None, size))
+        if arg2_spot != spots.S1:
+            asm_code.add(asm_cmds.Load(spots.S1, arg2_spot, size))
+
+        routine = runtime.div_routine(self.arg1.ctype.signed)
+        asm_code.add(asm_cmds.CallLabel(routine))
+        asm_code.add_routine(routine)
+
+        result = self._get_result_reg()
+        if spotmap[self.output] != result:
+            asm_code.add(asm_cmds.Load(spotmap[self.output], result, size))
+
+    def _get_result_reg(self):
+        """Return the register the divide routine leaves the result in."""
+        if self.remainder:
+            return runtime.div_remainder()
+        return spots.S0
+
+    def _get_literal_divisor(self):
+        """Return the (divisor, plan) of a division by a literal.
+
+        The divisor is the value of the literal as an 8-bit value of the
+        type of the command, and the plan is from _get_div_plan. Returns
+        None if the divisor is not a literal, if it is zero or -128, if the
+        dividend is also a literal, or if calling the runtime routine is
+        faster than the plan.
+        """
+        val = getattr(getattr(self.arg2, "literal", None), "val", None)
+        if (not isinstance(val, int)
+              or getattr(self.arg1, "literal", None) is not None):
+            return None
+
+        signed = self.arg1.ctype.signed
+        divisor = (val + 128) % 256 - 128 if signed else val % 256
+        if divisor in (0, -128):
+            return None
+
+        plan = _get_div_plan(abs(divisor), signed, self.remainder)
+        cycles = plan[0]
+        if signed and plan[1] != "shift":
+            cycles += 2 * 9
+        if signed and divisor < 0 and not self.remainder:
+            cycles += 2 * 2
+
+        call = 2 * 3 + runtime.div_cycles(signed)
+        if cycles <= call:
+            return divisor, plan
+        return None
+
+    def _make_literal(self, spotmap, get_reg, asm_code, divisor, plan):
+        """Make the ASM dividing the dividend by a literal divisor."""
+        size = self.arg1.ctype.size
+        value_spot = spotmap[self.arg1]
+        out_spot = spotmap[self.output]
+
+        signed = self.arg1.ctype.signed
+        sign_bit = HexLiteralSpot(128)
+        if signed and plan[1] == "shift":
+            result = self._make_signed_shift(
+                get_reg, asm_code, value_spot, out_spot, plan[2])
+        elif signed:
+            # Divide the magnitude of the dividend, then give the result
+            # the sign of the dividend.
+            magnitude = get_reg([], [value_spot])
+            asm_code.add(asm_cmds.Load(magnitude, value_spot, size))
+            positive = asm_code.get_label()
+            asm_code.add(asm_cmds.Compare(magnitude, sign_bit, size))
+            asm_code.add(asm_cmds.JumpC(positive))
+            _add_negate(asm_code, magnitude, size)
+            asm_code.add(asm_cmds.Label(positive))
+
+            result = self._make_unsigned(
+                get_reg, asm_code, magnitude, [value_spot, magnitude],
+                [out_spot], plan)
+
+            done = asm_code.get_label()
+            asm_code.add(asm_cmds.Compare(value_spot, sign_bit, size))
+            asm_code.add(asm_cmds.JumpC(done))
+            _add_negate(asm_code, result, size)
+            asm_code.add(asm_cmds.Label(done))
         else:
-            # zero out S3 register
-            asm_code.add(asm_cmds.Xor(spots.S3, spots.S3))
-            asm_code.add(asm_cmds.Div(arg2_final_spot, None, size))
-
-        if spotmap[self.output] != self.return_reg:
-            asm_code.add(asm_cmds.Load(output_spot, self.return_reg, size))
+            result = self._make_unsigned(
+                get_reg, asm_code, value_spot, [], [out_spot], plan)
+
+        # A quotient by a negative divisor is negated, but the remainder
+        # keeps the sign of the dividend.
+        if divisor < 0 and not self.remainder:
+            _add_negate(asm_code, result, size)
+
+        if result != out_spot:
+            asm_code.add(asm_cmds.Load(out_spot, result, size))
+
+    def _make_signed_shift(self, get_reg, asm_code, value_spot, out_spot,
+                           shift):
+        """Make the ASM dividing a signed value by a power of two.
+
+        A negative dividend is first increased by the divisor minus one, so
+        the arithmetic right shift rounds the quotient toward zero as C
+        does. Returns the register holding the result.
+        """
+        size = self.arg1.ctype.size
+        acc = get_reg([out_spot], [value_spot])
+        asm_code.add(asm_cmds.Load(acc, value_spot, size))
+
+        positive = asm_code.get_label()
+        asm_code.add(asm_cmds.Compare(acc, HexLiteralSpot(128), size))
+        asm_code.add(asm_cmds.JumpC(positive))
+        asm_code.add(asm_cmds.Add(acc, HexLiteralSpot((1 << shift) - 1), size))
+        asm_code.add(asm_cmds.Label(positive))
+
+        if not self.remainder:
+            for _ in range(shift):
+                asm_code.add(asm_cmds.Srx(acc, None, size, size))
+            return acc
+
+        # The remainder is the dividend minus the quotient times the divisor.
+        mask = HexLiteralSpot(256 - (1 << shift))
+        asm_code.add(asm_cmds.And(acc, mask, size))
+        result = get_reg([out_spot], [value_spot, acc])
+        asm_code.add(asm_cmds.Load(result, value_spot, size))
+        asm_code.add(asm_cmds.Sub(result, acc, size))
+        return result
+
+    def _make_unsigned(self, get_reg, asm_code, value_spot, keep, pref,
+                       plan):
+        """Make the ASM dividing an unsigned value by a literal.
+
+        keep - Spots which must not be overwritten.
+        pref - Spots preferred for the result.
+
+        Returns the register holding the result.
+        """
+        size = self.arg1.ctype.size
+        kind, args = plan[1], plan[2:]
+
+        if kind == "shift":
+            shift, = args
+            acc = get_reg(pref + [value_spot], keep)
+            if acc != value_spot:
+                asm_code.add(asm_cmds.Load(acc, value_spot, size))
+            if self.remainder:
+                mask = HexLiteralSpot((1 << shift) - 1)
+                asm_code.add(asm_cmds.And(acc, mask, size))
+            else:
+                for _ in range(shift):
+                    asm_code.add(asm_cmds.Sr0(acc, None, size, size))
+            return acc
+
+        if kind == "subtract":
+            bits, divisor = args
+            rem = get_reg(pref + [value_spot], keep)
+            if rem != value_spot:
+                asm_code.add(asm_cmds.Load(rem, value_spot, size))
+            if not self.remainder:
+                quotient = get_reg(pref, keep + [rem])
+                asm_code.add(asm_cmds.Load(quotient, HexLiteralSpot(0), size))
+
+            for bit in reversed(range(bits)):
+                skip = asm_code.get_label()
+                part = HexLiteralSpot(divisor << bit)
+                asm_code.add(asm_cmds.Compare(rem, part, size))
+                asm_code.add(asm_cmds.JumpC(skip))
+                asm_code.add(asm_cmds.Sub(rem, part, size))
+                if not self.remainder:
+                    asm_code.add(
+                        asm_cmds.Add(quotient, HexLiteralSpot(1 << bit), size))
+                asm_code.add(asm_cmds.Label(skip))
+            return rem if self.remainder else quotient
+
+        # Multiply by the reciprocal and keep the high byte of the product.
+        multiplier, shift, divisor = args
+        acc = get_reg(pref, keep + [value_spot])
+        asm_code.add(asm_cmds.Load(acc, HexLiteralSpot(0), size))
+        for bit in range(multiplier.bit_length()):
+            if multiplier >> bit & 1:
+                asm_code.add(asm_cmds.Add(acc, value_spot, size))
+                asm_code.add(asm_cmds.Sra(acc, None, size, size))
+            else:
+                asm_code.add(asm_cmds.Sr0(acc, None, size, size))
+        for _ in range(shift):
+            asm_code.add(asm_cmds.Sr0(acc, None, size, size))
+        if not self.remainder:
+            return acc
+
+        # The remainder is the dividend minus the quotient times the divisor.
+        _, steps = _get_mult_steps(divisor)
+        product = get_reg([], keep + [value_spot, acc])
+        saved = None
+        if "save" in steps:
+            saved = get_reg([], keep + [value_spot, acc, product])
+        _add_mult_steps(asm_code, steps, product, acc, saved, size)
+        asm_code.add(asm_cmds.Load(acc, value_spot, size))
+        asm_code.add(asm_cmds.Sub(acc, product, size))
+        return acc
 
 
 class Div(_DivMod):
@@ -270,7 +626,7 @@ class Div(_DivMod):
 
     """
 
-    return_reg = spots.S0
+    remainder = False
 
 
 class Mod(_DivMod):
@@ -281,7 +637,86 @@ class Mod(_DivMod):
 
     """
 
-    return_reg = spots.S3
+    remainder = True
+
+
+def _add_negate(asm_code, reg, size):
+    """Add the ASM negating the value in a register."""
+    asm_code.add(asm_cmds.Xor(reg, HexLiteralSpot(255), size))
+    asm_code.add(asm_cmds.Add(reg, HexLiteralSpot(1), size))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_div_plan(divisor, signed, remainder):
+    """Return the fastest way to divide a value by a positive literal.
+
+    signed - Whether the value is signed. A signed value is divided by its
+    magnitude, from 0 to 128, unless the divisor is a power of two.
+    remainder - Whether the remainder rather than the quotient is needed.
+
+    Returns a tuple of the clock cycles taken, the kind of plan, and its
+    arguments, which is one of
+
+        ("shift", n) - for a divisor of 2^n, shift right n bits for the
+        quotient, or keep the low n bits for the remainder
+        ("subtract", n, divisor) - subtract the divisor times each power of
+        two from 2^(n-1) down to 1 which fits from the dividend, as a
+        restoring division unrolled over the n bits the quotient may have
+        ("reciprocal", m, n, divisor) - multiply by m, keeping only the
+        bits above those of m, and shift right n more bits for the
+        quotient, then multiply it by the divisor and subtract for the
+        remainder
+    """
+    if not divisor & divisor - 1:
+        shift = divisor.bit_length() - 1
+        if signed:
+            words = 4 + (3 if remainder else shift)
+        else:
+            words = 2 if remainder else 1 + shift
+        return 2 * words, "shift", shift
+
+    largest = 128 if signed else 255
+    bits = (largest // divisor).bit_length()
+    words = 1 + 3 * bits if remainder else 2 + 4 * bits
+    options = [(2 * words, "subtract", bits, divisor)]
+
+    reciprocal = _get_reciprocal(divisor, largest)
+    if reciprocal:
+        multiplier, shift = reciprocal
+        words = (1 + multiplier.bit_length() + bin(multiplier).count("1")
+                 + shift)
+        if remainder:
+            words += len(_get_mult_steps(divisor)[1]) + 2
+        options.append((2 * words, "reciprocal", multiplier, shift, divisor))
+    return min(options)
+
+
+def _get_reciprocal(divisor, largest):
+    """Return the (multiplier, shift) for dividing by a reciprocal.
+
+    For each dividend from 0 to `largest`, the quotient is the product of
+    the dividend and the multiplier, shifted right by the bits of the
+    multiplier plus the shift. The multiplier is odd and fits in 8 bits.
+    Returns the pair with the fewest instructions, or None if there is
+    none.
+    """
+    best = None
+    for total in range(8, 17):
+        multiplier = -(-(1 << total) // divisor)
+        while not multiplier & 1:
+            multiplier >>= 1
+            total -= 1
+        shift = total - multiplier.bit_length()
+        if multiplier > 255 or shift < 0:
+            continue
+        if any(x * multiplier >> total != x // divisor
+               for x in range(largest + 1)):
+            continue
+        words = (multiplier.bit_length() + bin(multiplier).count("1")
+                 + shift)
+        if not best or words < best[0]:
+            best = (words, multiplier, shift)
+    return best[1:] if best else None
 
 
 class _NegNot(ILCommand):
@@ -70,6 +70,13 @@ class LoadArg(ILCommand):
 
     in order to load the first function argument into the variable a and
     the second function argument into the variable b.
+
+    If the function uses a custom calling convention, the ASM generator sets
+    arg_reg to None before register allocation and picks the argument
+    register afterwards, from wherever the allocator placed the output.
+    While arg_reg is None, `params` lists the outputs of the function's
+    other LoadArg commands, because all arguments arrive at once and so
+    must be placed in distinct registers.
     """
     arg_regs = [spots.S0, spots.S1, spots.S2, spots.S3,
                 spots.S4, spots.S5, spots.S6, spots.S7,
@@ -78,7 +85,9 @@ class LoadArg(ILCommand):
 
     def __init__(self, output, arg_num):
         self.output = output
+        self.arg_num = arg_num
         self.arg_reg = self.arg_regs[arg_num]
+        self.params = []
 
     def inputs(self):
         return []
@@ -87,10 +96,13 @@ class LoadArg(ILCommand):
         return [self.output]
 
     def clobber(self):
-        return [self.arg_reg]
+        return [self.arg_reg] if self.arg_reg else []
+
+    def rel_spot_conf(self):
+        return {} if self.arg_reg else {self.output: self.params}
 
     def abs_spot_pref(self):
-        return {self.output: [self.arg_reg]}
+        return {self.output: [self.arg_reg]} if self.arg_reg else {}
 
     def make_asm(self, spotmap, home_spots, get_reg, asm_code):
         if spotmap[self.output] == self.arg_reg:
@@ -220,6 +232,65 @@ class AddrOf(ILCommand):
             asm_code.add(asm_cmds.Load(spotmap[self.output], r))
 
 
+class Store(ILCommand):
+    """Stores an IL value to the scratchpad.
+
+    The ASM generator inserts this command when it splits the live range of
+    `arg`, so the value need not stay in a register. `slot` is an IL value
+    which the ASM generator places in a ScratchSpot.
+    """
+
+    output_attrs = ("slot",)
+
+    def __init__(self, slot, arg):  # noqa D102
+        self.slot = slot
+        self.arg = arg
+
+    def inputs(self):  # noqa D102
+        return [self.arg]
+
+    def outputs(self):  # noqa D102
+        return [self.slot]
+
+    def make_asm(self, spotmap, home_spots, get_reg, asm_code):  # noqa D102
+        arg_spot = spotmap[self.arg]
+        if not isinstance(arg_spot, RegSpot):
+            r = get_reg()
+            asm_code.add(asm_cmds.Load(r, arg_spot))
+            arg_spot = r
+
+        asm_code.add(asm_cmds.Store(arg_spot, spotmap[self.slot]))
+
+
+class Fetch(ILCommand):
+    """Fetches an IL value back from the scratchpad.
+
+    This is the counterpart of the Store command, and reloads `output` from
+    the slot it was stored to.
+    """
+
+    def __init__(self, output, slot):  # noqa D102
+        self.output = output
+        self.slot = slot
+
+    def inputs(self):  # noqa D102
+        return [self.slot]
+
+    def outputs(self):  # noqa D102
+        return [self.output]
+
+    def make_asm(self, spotmap, home_spots, get_reg, asm_code):  # noqa D102
+        output_spot = spotmap[self.output]
+        if isinstance(output_spot, RegSpot):
+            r = output_spot
+        else:
+            r = get_reg()
+
+        asm_code.add(asm_cmds.Fetch(r, spotmap[self.slot]))
+        if r != output_spot:
+            asm_code.add(asm_cmds.Load(output_spot, r))
+
+
 class ReadAt(_ValueCmd):
     """Reads value at given address.
 
@@ -408,6 +479,8 @@ class AddrRel(_RelCommand):
     For further documentation, see SetRel.
 
     """
+    output_attrs = ("output", "val")
+
     def __init__(self, output, base, chunk=0, count=None):  # noqa D102
         super().__init__(output, base, chunk, count)
         self.output = output
@@ -440,6 +513,8 @@ class ReadRel(_RelCommand):
 
     """
 
+    output_attrs = ("output", "val")
+
     def __init__(self, output, base, chunk=0, count=None):  # noqa D102
         super().__init__(output, base, chunk, count)
         self.output = output
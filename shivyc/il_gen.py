@@ -15,6 +15,9 @@ class ILCode:
     that function.
     cur_func (str) - Name of the function current commands are for
     label_num (int) - Unique identifier returned by get_label
+    inline_hints - Dictionary mapping function name to the inlining hint
+    given in its declaration, one of "inline", "always_inline", and
+    "noinline"
     """
     def __init__(self):
         """Initialize IL code."""
@@ -26,6 +29,7 @@ class ILCode:
         self.static_inits = {}
         self.literals = {}
         self.string_literals = {}
+        self.inline_hints = {}
 
     def copy(self):
         """Make copy of this object.
@@ -42,6 +46,7 @@ class ILCode:
         self.static_inits = self.static_inits.copy()
         self.literals = self.literals.copy()
         self.string_literals = self.string_literals.copy()
+        new.inline_hints = self.inline_hints.copy()
         return new
 
     def start_func(self, func):
@@ -148,6 +153,11 @@ class SymbolTable:
 
     This object stores variable names, types, typedefs, and maintains
     information on the variable linkages and storage durations.
+
+    Each namespace is a flat dictionary mapping a name to the stack of its
+    bindings, innermost scope last, so a lookup does not depend on how
+    deeply scopes are nested. Each scope records the names it binds, so
+    ending a scope only touches the names declared in that scope.
     """
     Tables = namedtuple('Tables', ['vars', 'structs'])
 
@@ -167,10 +177,14 @@ class SymbolTable:
     def __init__(self):
         """Initialize symbol table.
 
-        `tables` is a list of namedtuples of dictionaries. Each dictionary
-        in the namedtuple is the symbol table for a different namespace.
+        `vars` and `structs` map each name in that namespace to the stack of
+        its bindings. `tables` is a list with one namedtuple of dictionaries
+        per open scope. Each dictionary in the namedtuple maps the names
+        bound in that scope to their binding, for a different namespace.
 
         """
+        self.vars = {}
+        self.structs = {}
         self.tables = []
 
         # Store variable linkages
@@ -200,7 +214,25 @@ class SymbolTable:
 
     def end_scope(self):
         """End the most recently started scope."""
-        self.tables.pop()
+        table = self.tables.pop()
+        for names, bindings in ((self.vars, table.vars),
+                                (self.structs, table.structs)):
+            for name in bindings:
+                names[name].pop()
+                if not names[name]:
+                    del names[name]
+
+    def _bind(self, names, bindings, name, value):
+        """Bind name to value in the innermost scope.
+
+        names - Namespace dictionary, either self.vars or self.structs.
+        bindings - Dictionary of the same namespace in the innermost scope.
+        """
+        if name in bindings:
+            names[name][-1] = value
+        else:
+            names.setdefault(name, []).append(value)
+        bindings[name] = value
 
     def _lookup_raw(self, name):
         """Look up the identifier or ctype with the given name.
@@ -209,9 +241,9 @@ class SymbolTable:
 
         name (str) - Identifier name to search for.
         """
-        for table, _ in self.tables[::-1]:
-            if name in table:
-                return table[name]
+        stack = self.vars.get(name)
+        if stack:
+            return stack[-1]
 
     def lookup_variable(self, identifier):
         """Look up the given identifier.
@@ -274,7 +306,7 @@ class SymbolTable:
             # completed an object type)
             var.ctype = ctype
 
-        self.tables[-1].vars[name] = var
+        self._bind(self.vars, self.tables[-1].vars, name, var)
 
         # Set this variable's linkage if it has one
         if linkage:
@@ -297,8 +329,8 @@ class SymbolTable:
 
         If not found, returns None.
         """
-        for _, structs in self.tables[::-1]:
-            if tag in structs: return structs[tag]
+        stack = self.structs.get(tag)
+        if stack: return stack[-1]
 
     def add_struct_union(self, tag, ctype):
         """Add struct or union to the symbol table and return it.
@@ -309,7 +341,7 @@ class SymbolTable:
         returns it.
         """
         if tag not in self.tables[-1].structs:
-            self.tables[-1].structs[tag] = ctype
+            self._bind(self.structs, self.tables[-1].structs, tag, ctype)
 
         return self.tables[-1].structs[tag]
 
@@ -328,7 +360,7 @@ class SymbolTable:
             else:
                 return
 
-        self.tables[-1].vars[name] = ctype
+        self._bind(self.vars, self.tables[-1].vars, name, ctype)
 
     def lookup_typedef(self, identifier):
         """Look up a typedef from the symbol table.
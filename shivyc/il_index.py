@@ -0,0 +1,95 @@
+"""Def/use index of the IL commands of one function.
+
+The ASM generator queries each IL command for its inputs, outputs, and
+register constraints many times over: while finding the free values, on
+every iteration of liveness analysis, while building the conflict graph,
+and while generating ASM. Those methods build a fresh list or dictionary on
+every call, so the backend instead builds an ILIndex once per function and
+reads the tables it holds.
+
+An ILIndex must be built after the calling conventions of the function and
+its calls are set, because the register constraints depend on them.
+
+"""
+
+
+class ILIndex:
+    """Def/use tables of a list of IL commands.
+
+    commands - List of the indexed IL commands.
+    values - List of the ILValues used or defined by the commands, in order
+    of first appearance. The position of a value in this list is its id.
+    ids - Dictionary mapping each ILValue in `values` to its id.
+
+    Each of the following is a list with one entry per command, holding the
+    result of the IL command method of the same name: inputs, outputs,
+    clobber, rel_spot_conf, abs_spot_conf, rel_spot_pref, abs_spot_pref,
+    references.
+
+    uses, defs - Lists with one entry per command, holding a bitset of the
+    ids of the values that command uses or defines.
+    targets - List with one entry per command, holding the indices of the
+    commands that command may jump to.
+    use_sites, def_sites - Dictionaries mapping each ILValue to the list of
+    indices of the commands which use or define it.
+    """
+
+    def __init__(self, commands):
+        """Build the index of the given IL commands."""
+        self.commands = commands
+        self.values = []
+        self.ids = {}
+
+        self.inputs = [command.inputs() for command in commands]
+        self.outputs = [command.outputs() for command in commands]
+        self.clobber = [command.clobber() for command in commands]
+        self.rel_spot_conf = [command.rel_spot_conf() for command in commands]
+        self.abs_spot_conf = [command.abs_spot_conf() for command in commands]
+        self.rel_spot_pref = [command.rel_spot_pref() for command in commands]
+        self.abs_spot_pref = [command.abs_spot_pref() for command in commands]
+        self.references = [command.references() for command in commands]
+
+        self.uses = []
+        self.defs = []
+        self.use_sites = {}
+        self.def_sites = {}
+        for i in range(len(commands)):
+            for v in self.inputs[i] + self.outputs[i]:
+                if v and v not in self.ids:
+                    self.ids[v] = len(self.values)
+                    self.values.append(v)
+
+            self.uses.append(self._add_sites(i, self.inputs[i],
+                                             self.use_sites))
+            self.defs.append(self._add_sites(i, self.outputs[i],
+                                             self.def_sites))
+
+        labels = {command.label_name(): i for i, command in enumerate(commands)
+                  if command.label_name()}
+        self.targets = [[labels[label] for label in command.targets()]
+                        for command in commands]
+
+    def _add_sites(self, i, values, sites):
+        """Record command `i` as a site of each value and return their bits."""
+        bits = 0
+        for v in values:
+            if v:
+                bits |= 1 << self.ids[v]
+                sites.setdefault(v, []).append(i)
+        return bits
+
+    def bits(self, values):
+        """Return the bitset of the ids of the given indexed values."""
+        bits = 0
+        for v in values:
+            bits |= 1 << self.ids[v]
+        return bits
+
+    def values_of(self, bits):
+        """Return the list of values whose ids are in the bitset, by id."""
+        values = []
+        while bits:
+            low = bits & -bits
+            values.append(self.values[low.bit_length() - 1])
+            bits ^= low
+        return values
@@ -12,6 +12,32 @@ from tokens import Token
 from token_kinds import symbol_kinds, keyword_kinds
 
 
+def _make_symbol_trie(kinds):
+    """Return a trie matching the text representations of the given kinds.
+
+    Each trie node is a dictionary mapping a character to the next node.
+    The None key of a node, if present, maps to the token kind whose
+    representation ends at that node.
+    """
+    trie = {}
+    for kind in kinds:
+        node = trie
+        for c in kind.text_repr:
+            node = node.setdefault(c, {})
+        node[None] = kind
+    return trie
+
+
+# Trie of all symbol kinds, used by match_symbol_kind_at
+_symbol_trie = _make_symbol_trie(symbol_kinds)
+
+# Mapping from keyword text to keyword kind, used by match_keyword_kind
+_keyword_table = {kind.text_repr: kind for kind in keyword_kinds}
+
+# Pattern matched by identifier names
+_identifier_re = re.compile(r"[_a-zA-Z][_a-zA-Z0-9]*$")
+
+
 class Tagged:
     """Class representing tagged characters.
 
@@ -259,17 +285,15 @@ def match_symbol_kind_at(content, start):
     is found.
 
     """
-    for symbol_kind in symbol_kinds:
-        try:
-            for i, c in enumerate(symbol_kind.text_repr):
-                if content[start + i].c != c:
-                    break
-            else:
-                return symbol_kind
-        except IndexError:
-            pass
+    node = _symbol_trie
+    match = None
+    for i in range(start, len(content)):
+        node = node.get(content[i].c)
+        if node is None:
+            break
+        match = node.get(None, match)
 
-    return None
+    return match
 
 
 def match_include_command(tokens):
@@ -429,11 +453,7 @@ def match_keyword_kind(token_repr):
     returns (TokenKind, or None) - Keyword token kind that matched.
 
     """
-    token_str = chunk_to_str(token_repr)
-    for keyword_kind in keyword_kinds:
-        if keyword_kind.text_repr == token_str:
-            return keyword_kind
-    return None
+    return _keyword_table.get(chunk_to_str(token_repr))
 
 
 def match_number_string(token_repr):
@@ -455,7 +475,7 @@ def match_identifier_name(token_repr):
 
     """
     token_str = chunk_to_str(token_repr)
-    if re.match(r"[_a-zA-Z][_a-zA-Z0-9]*$", token_str):
+    if _identifier_re.match(token_str):
         return token_str
     else:
         return None
@@ -0,0 +1,133 @@
+"""Linear scan register allocator.
+
+This allocator is selected with `-fregalloc=linear`. It allocates in a
+single pass over the live intervals of the free values, so it runs in
+O(n log n) time rather than building and coloring the conflict graph. It
+uses more registers and emits more moves than the graph coloring allocator,
+so it is intended for fast development builds.
+
+"""
+
+import heapq
+
+from spots import RegSpot
+
+
+class LinearScan:
+    """Linear scan register allocator for one function.
+
+    A live interval spans every program point at which a value is live. The
+    point before command i is 2*i and the point after it is 2*i + 1. Two
+    values whose intervals overlap never share a register. Each value also
+    avoids the registers it has an absolute conflict with, the registers
+    clobbered by commands it is live across, and the registers of values it
+    has a relative conflict with.
+
+    index (ILIndex) - Index of the IL commands of the function.
+    free_values - List of the ILValues to allocate registers to.
+    live_vars - Live range information from ASMGen._get_live_vars.
+    registers - List of registers to allocate, sorted preferred-first.
+    """
+
+    def __init__(self, index, free_values, live_vars, registers):
+        """Compute the live intervals and constraints of the free values."""
+        self.index = index
+        self.free_values = free_values
+        self.registers = registers
+
+        free = set(free_values)
+        self.start = {}
+        self.end = {}
+        for i, (in_live, out_live) in enumerate(live_vars):
+            for point, values in ((2 * i, in_live), (2 * i + 1, out_live)):
+                for v in values:
+                    self.start.setdefault(v, point)
+                    self.end[v] = point
+
+        # Values which appear in no live set still need a register at the
+        # command which uses or defines them.
+        for v in free_values:
+            if v not in self.start:
+                sites = (index.def_sites.get(v, []) +
+                         index.use_sites.get(v, []))
+                self.start[v] = self.end[v] = 2 * min(sites) + 1
+
+        self.forbidden = {v: set() for v in free_values}
+        self.rel_confs = {v: [] for v in free_values}
+        self.abs_prefs = {v: [] for v in free_values}
+        self.rel_prefs = {v: [] for v in free_values}
+
+        for i, (in_live, out_live) in enumerate(live_vars):
+            clobber = index.clobber[i]
+            if clobber:
+                for v in set(in_live) & set(out_live):
+                    self.forbidden[v].update(clobber)
+
+            for n, spots in index.abs_spot_conf[i].items():
+                if n in free:
+                    self.forbidden[n].update(spots)
+
+            for n1, confs in index.rel_spot_conf[i].items():
+                for n2 in confs:
+                    if n1 in free and n2 in free:
+                        self.rel_confs[n1].append(n2)
+                        self.rel_confs[n2].append(n1)
+
+            for v, spots in index.abs_spot_pref[i].items():
+                if v in free:
+                    self.abs_prefs[v] += spots
+
+            for v1, prefs in index.rel_spot_pref[i].items():
+                for v2 in prefs:
+                    if v1 in free and v2 in free:
+                        self.rel_prefs[v1].append(v2)
+                        self.rel_prefs[v2].append(v1)
+
+    def allocate(self, stats):
+        """Assign registers to the free values.
+
+        Returns the spotmap and the list of values which could not be given
+        a register.
+
+        stats (RegAllocStats) - Statistics object to fill in.
+        """
+        order = sorted(self.free_values, key=lambda v: (
+            self.start[v], self.index.ids[v]))
+
+        spotmap = {}
+        spilled = []
+        active = []
+        used = set()
+        for v in order:
+            # Free the registers of intervals which ended before this one
+            while active and active[0][0] < self.start[v]:
+                _, _, expired = heapq.heappop(active)
+                used.discard(spotmap[expired])
+
+            reg = self._choose(v, used, spotmap)
+            if reg:
+                spotmap[v] = reg
+                used.add(reg)
+                heapq.heappush(active, (self.end[v], self.index.ids[v], v))
+            else:
+                spilled.append(v)
+
+        stats.nodes = len(self.free_values)
+        stats.spills = len(spilled)
+        return spotmap, spilled
+
+    def _choose(self, v, used, spotmap):
+        """Return the best register available to `v`, or None if none is.
+
+        Registers in the absolute preferences of `v` come first, then the
+        registers of values it has a relative preference with.
+        """
+        bad = used | self.forbidden[v]
+        bad.update(spotmap[n] for n in self.rel_confs[v] if n in spotmap)
+
+        prefs = self.abs_prefs[v] + [spotmap[n] for n in self.rel_prefs[v]
+                                     if n in spotmap]
+        for reg in prefs + self.registers:
+            if isinstance(reg, RegSpot) and reg not in bad:
+                return reg
+        return None
@@ -0,0 +1,189 @@
+"""Live range splitting around calls and loops.
+
+A value live across a call which clobbers every register conflicts with
+all of them, so the register allocator must spill it for its whole
+lifetime. Likewise, a value which is live through a loop but not used in
+it holds a register for every iteration. Before register allocation, the
+ASM generator splits such live ranges: the value is stored to a scratchpad
+slot before the call or loop and fetched back after it, so only the cold
+segment in between pays for memory traffic.
+
+"""
+
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+from il_gen import ILValue
+
+
+class LiveRangeSplitter:
+    """Splits the live ranges of the free values of one function.
+
+    index (ILIndex) - Index of the IL commands of the function.
+    free_values - List of the ILValues which need registers.
+    live_vars - Live range information from ASMGen._get_live_vars.
+    registers - List of registers used for allocation.
+    """
+
+    def __init__(self, index, free_values, live_vars, registers):
+        """Initialize the splitter."""
+        self.index = index
+        self.free = set(free_values)
+        self.live_vars = live_vars
+        self.registers = set(registers)
+
+        # Mapping from each split value to the slot holding it
+        self.slots = {}
+
+        # Commands to insert before and after each command index
+        self.before = {}
+        self.after = {}
+
+    def split(self, split_calls, remat, get_slot):
+        """Split live ranges and return the new list of commands.
+
+        split_calls - Set of Call commands around which values may be
+        stored, because the callee cannot re-enter this function.
+        remat - Values which are rematerialized when spilled, and so are
+        never split.
+        get_slot - Function returning a new ScratchSpot, or None if the
+        scratchpad is full.
+
+        Returns the new command list and a dictionary mapping each slot IL
+        value to its ScratchSpot.
+        """
+        commands = self.index.commands
+        self.remat = remat
+        self.get_slot = get_slot
+        spots = {}
+
+        # Values split around a whole loop need no split inside it
+        loop_split = {}
+        for header, end in self._loops():
+            for v in self._split_loop(header, end, spots, loop_split):
+                loop_split.setdefault(v, []).append((header, end))
+
+        for i, command in enumerate(commands):
+            if command not in split_calls or not self._clobbers_all(i):
+                continue
+
+            in_live, out_live = self.live_vars[i]
+            out_live = set(out_live)
+            for v in [v for v in in_live if v in out_live]:
+                if v in self.index.outputs[i] or any(
+                        header <= i <= end
+                        for header, end in loop_split.get(v, [])):
+                    continue
+                slot = self._get_slot(v, spots)
+                if slot:
+                    self.before.setdefault(i, []).append(
+                        value_cmds.Store(slot, v))
+                    self.after.setdefault(i, []).append(
+                        value_cmds.Fetch(v, slot))
+
+        new_commands = []
+        for i, command in enumerate(commands):
+            new_commands += self.before.get(i, [])
+            new_commands.append(command)
+            new_commands += self.after.get(i, [])
+
+        return new_commands, spots
+
+    def _get_slot(self, v, spots):
+        """Return the slot IL value for `v`, or None if it can't be split."""
+        if v not in self.free or v in self.remat:
+            return None
+
+        if v not in self.slots:
+            spot = self.get_slot()
+            if not spot:
+                return None
+            self.slots[v] = ILValue(v.ctype)
+            spots[self.slots[v]] = spot
+
+        return self.slots[v]
+
+    def _clobbers_all(self, i):
+        """Return True iff command i clobbers every allocated register."""
+        return self.registers <= set(self.index.clobber[i])
+
+    def _loops(self):
+        """Return the (header, end) command indices of each loop.
+
+        A loop is found from each jump backwards to a label. The loop spans
+        the commands from the label to the last jump back to it.
+        """
+        loops = {}
+        for i, targets in enumerate(self.index.targets):
+            for header in targets:
+                if header <= i:
+                    loops[header] = max(loops.get(header, i), i)
+        return sorted(loops.items())
+
+    def _falls_through(self, i):
+        """Return True iff command i may continue to command i + 1."""
+        return not isinstance(self.index.commands[i],
+                              (control_cmds.Jump, control_cmds.Return))
+
+    def _split_loop(self, header, end, spots, loop_split):
+        """Split the values live through the given loop but unused in it.
+
+        The loop is only split if it is entered only by falling into its
+        header and each exit target is reached only from inside the loop,
+        so the stores and fetches can be placed on the loop edges. Splitting
+        is worthwhile if there are more live values than registers at some
+        point in the loop, or if the loop makes a call which clobbers every
+        register. Values already split around an enclosing loop are
+        skipped. Returns the list of values split.
+        """
+        body = range(header, end + 1)
+
+        exits = set()
+        for i in body:
+            exits |= {t for t in self.index.targets[i] if t not in body}
+        if self._falls_through(end) and end + 1 < len(self.index.commands):
+            exits.add(end + 1)
+
+        for i, targets in enumerate(self.index.targets):
+            if i in body:
+                continue
+            if any(t in body and t != header for t in targets):
+                return []
+            if header in targets or exits & set(targets):
+                return []
+        for t in exits:
+            if t - 1 not in body and self._falls_through(t - 1):
+                return []
+
+        pressure = max(len(self.live_vars[i][0]) for i in body)
+        has_call = any(isinstance(self.index.commands[i], control_cmds.Call)
+                       and self._clobbers_all(i) for i in body)
+        if pressure <= len(self.registers) and not has_call:
+            return []
+
+        used = set()
+        for i in body:
+            used.update(self.index.inputs[i])
+            used.update(self.index.outputs[i])
+
+        split = []
+        for v in self.live_vars[header][0]:
+            if v in used or any(h <= header and end <= e
+                                for h, e in loop_split.get(v, [])):
+                continue
+            slot = self._get_slot(v, spots)
+            if not slot:
+                continue
+
+            split.append(v)
+            self.before.setdefault(header, []).append(
+                value_cmds.Store(slot, v))
+            for t in exits:
+                if v not in self.live_vars[t][0]:
+                    continue
+                fetch = value_cmds.Fetch(v, slot)
+                if self.index.commands[t].label_name():
+                    self.after.setdefault(t, []).append(fetch)
+                else:
+                    self.before.setdefault(t, []).append(fetch)
+
+        return split
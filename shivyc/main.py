@@ -9,10 +9,13 @@ import sys
 import lexer as lexer
 import preproc as preproc
 
+from alloc_stats import alloc_stats
 from errors import error_collector, CompilerError
+from profiler import profiler
 from parser.parser import parse
 from il_gen import ILCode, SymbolTable, Context
 from asm_gen import ASMCode, ASMGen
+from opt.optimizer import optimize
 
 
 def main():
@@ -24,13 +27,30 @@ def main():
         return 1
 
     arguments = get_arguments()
+    profiler.enable(arguments.time_passes, bool(arguments.trace_file))
 
     objs = []
     for file in arguments.files:
-        objs.append(process_file(file, arguments))
+        with profiler.stage("compile"):
+            objs.append(process_file(file, arguments))
+        alloc_stats.end_file(file)
+
+    # The trace and statistics are written first, so an error writing them
+    # is shown.
+    if arguments.trace_file:
+        profiler.write_trace(arguments.trace_file)
+    if arguments.reg_alloc_stats:
+        alloc_stats.write(arguments.reg_alloc_stats)
 
     error_collector.show()
-    if any(not obj for obj in objs):
+    if arguments.show_reg_alloc_perf:
+        alloc_stats.show()
+    alloc_stats.clear()
+    if arguments.time_passes:
+        profiler.show()
+    profiler.clear()
+
+    if any(not obj for obj in objs) or not error_collector.ok():
         return 1
     
     return 0
@@ -49,52 +69,63 @@ def process_file(file, args):
 
 def process_c_file(file, args):
     """Compile a C file into an object file and return the object file name."""
-    code = read_file(file)
+    with profiler.stage("read"):
+        code = read_file(file)
     if not error_collector.ok():
         return None
 
-    token_list = lexer.tokenize(code, file)
+    with profiler.stage("lexer"):
+        token_list = lexer.tokenize(code, file)
     if not error_collector.ok():
         return None
 
-    token_list = preproc.process(token_list, file)
+    with profiler.stage("preproc"):
+        token_list = preproc.process(token_list, file)
     if not error_collector.ok():
         return None
 
     # If parse() can salvage the input into a parse tree, it may emit an
     # ast_root even when there are errors saved to the error_collector. In this
     # case, we still want to continue the compiler stages.
-    ast_root = parse(token_list)
+    with profiler.stage("parse"):
+        ast_root = parse(token_list)
     if not ast_root:
         return None
 
-    il_code = ILCode()
-    symbol_table = SymbolTable()
-    ast_root.make_il(il_code, symbol_table, Context())
+    with profiler.stage("il_gen"):
+        il_code = ILCode()
+        symbol_table = SymbolTable()
+        ast_root.make_il(il_code, symbol_table, Context())
     if not error_collector.ok():
         return None
 
-    asm_code = ASMCode()
-    ASMGen(il_code, symbol_table, asm_code, args).make_asm()
-    asm_source = asm_code.full_code()
+    with profiler.stage("opt"):
+        optimize(il_code, symbol_table, args)
+
+    with profiler.stage("asm_gen"):
+        asm_code = ASMCode()
+        ASMGen(il_code, symbol_table, asm_code, args).make_asm()
+        asm_source = asm_code.full_code()
     if not error_collector.ok():
         return None
 
     asm_file = file[:-2] + ".asm"
 
-    write_asm(asm_source, asm_file)
+    with profiler.stage("write"):
+        write_asm(asm_source, asm_file)
     if not error_collector.ok():
         return None
 
     return asm_file
 
 
-def get_arguments():
+def get_arguments(argv=None):
     """Get the command-line arguments.
 
     This function sets up the argument parser. Returns a tuple containing
     an object storing the argument values and a list of the file names
-    provided on command line.
+    provided on command line. If `argv` is given, it is parsed instead of
+    sys.argv; this is used by tools that drive the compiler in-process.
     """
     desc = """Compile, assemble, and link C files. Option flags starting
     with `-z` are primarily for debugging or diagnostic purposes."""
@@ -109,7 +140,135 @@ def get_arguments():
                         help="display register allocator performance info",
                         dest="show_reg_alloc_perf", action="store_true")
 
-    return parser.parse_args()
+    # File name to which to save register allocator statistics as JSON
+    parser.add_argument("-z-reg-alloc-stats", metavar="FILE",
+                        help="save per-function register allocator "
+                             "statistics to FILE as JSON",
+                        dest="reg_alloc_stats", default=None)
+
+    # Register allocator to use
+    parser.add_argument("-fregalloc", choices=["graph", "linear"],
+                        help="register allocator: graph coloring (default) "
+                             "or a faster linear scan which produces "
+                             "larger code",
+                        dest="regalloc", default="graph")
+
+    # Boolean flag for exact register allocation of small functions
+    parser.add_argument("-fregalloc-exact",
+                        help="search for a register allocation with the "
+                             "fewest spills and moves in small functions",
+                        dest="regalloc_exact", action="store_true")
+
+    # Largest conflict graph allocated exactly
+    parser.add_argument("-fregalloc-exact-max-nodes", metavar="N", type=int,
+                        help="only allocate functions with at most N values "
+                             "exactly (default 24)",
+                        dest="regalloc_exact_max_nodes", default=24)
+
+    # Time budget of each exact allocation
+    parser.add_argument("-fregalloc-exact-budget", metavar="MS", type=int,
+                        help="give up on exact allocation of a function "
+                             "after MS milliseconds (default 200)",
+                        dest="regalloc_exact_budget", default=200)
+
+    # Boolean flag for live range splitting
+    parser.add_argument("-fsplit-live-ranges",
+                        help="store values live across calls and loops "
+                             "which do not use them to the scratchpad, "
+                             "instead of keeping them in registers",
+                        dest="split_live_ranges", action="store_true")
+
+    # Boolean flag for rewriting functions into SSA form
+    parser.add_argument("-fssa",
+                        help="rewrite functions into SSA form before "
+                             "register allocation, so each assignment to a "
+                             "variable gets its own live range",
+                        dest="ssa", action="store_true")
+
+    # Boolean flag for global value numbering
+    parser.add_argument("-fgvn",
+                        help="reuse the results of computations repeated "
+                             "in the same function",
+                        dest="gvn", action="store_true")
+
+    # Boolean flag for loop-invariant code motion
+    parser.add_argument("-flicm",
+                        help="move computations which do not change in a "
+                             "loop to before the loop",
+                        dest="licm", action="store_true")
+
+    # Boolean flag for induction variable strength reduction
+    parser.add_argument("-fivopts",
+                        help="replace multiplications by loop counters with "
+                             "additions, and remove counters used only to "
+                             "end their loop",
+                        dest="ivopts", action="store_true")
+
+    # Boolean flag for loop rotation
+    parser.add_argument("-frotate-loops",
+                        help="test the condition of a loop once before it "
+                             "and then at the bottom of each iteration, "
+                             "so each iteration takes one jump",
+                        dest="rotate_loops", action="store_true")
+
+    # Boolean flag for tail calls
+    parser.add_argument("-foptimize-sibling-calls",
+                        help="jump to a function called right before "
+                             "returning, and turn tail recursion into loops",
+                        dest="tail_calls", action="store_true")
+
+    # Boolean flag for function inlining
+    parser.add_argument("-finline-functions",
+                        help="replace calls with copies of the called "
+                             "function where this saves stack levels or "
+                             "fits within the ROM size",
+                        dest="inline_functions", action="store_true")
+
+    # Boolean flag for loop unrolling
+    parser.add_argument("-funroll-loops",
+                        help="copy the bodies of loops with a known number "
+                             "of iterations, as far as the program stays "
+                             "within the ROM size",
+                        dest="unroll_loops", action="store_true")
+
+    # Size of the program ROM
+    parser.add_argument("-mrom-size", metavar="WORDS", type=int,
+                        help="limit optimizations which grow the code to "
+                             "a program of WORDS instructions (default 1024)",
+                        dest="rom_size", default=1024)
+
+    # Boolean flag for interprocedural register allocation
+    parser.add_argument("-fipa-ra",
+                        help="allocate registers bottom-up over the call "
+                             "graph, so calls only clobber the registers "
+                             "their callee uses",
+                        dest="ipa_ra", action="store_true")
+
+    # Boolean flag for custom calling conventions
+    parser.add_argument("-fipa-cc",
+                        help="choose argument and return registers of "
+                             "internal functions from their register "
+                             "allocation",
+                        dest="ipa_cc", action="store_true")
+
+    # Boolean flag for treating every function other than main as internal
+    parser.add_argument("-fwhole-program",
+                        help="assume no function other than main is called "
+                             "from outside the file being compiled",
+                        dest="whole_program", action="store_true")
+
+    # Boolean flag for whether to print a timing report of compiler stages
+    parser.add_argument("-z-time-passes",
+                        help="display time, call counts, and allocations "
+                             "of each compiler stage",
+                        dest="time_passes", action="store_true")
+
+    # File name to which to save a Chrome trace of compiler stages
+    parser.add_argument("-z-trace", metavar="FILE",
+                        help="save a Chrome trace of compiler stages to FILE",
+                        dest="trace_file", default=None)
+
+    return parser.parse_args(argv)
 
 
 def read_file(file):
@@ -0,0 +1 @@
+"""Package for the IL optimization passes."""
@@ -0,0 +1,259 @@
+"""Control flow graph of the IL commands of one function.
+
+The IL of a function is a flat list of commands in which control flows from
+each command to the next unless the command jumps. The optimization passes
+instead work on a CFG of basic blocks, which records the predecessors and
+successors of each block along with its dominators. The blocks keep their
+layout order, so the CFG can be flattened back into a command list.
+
+"""
+
+import il_cmds.control as control_cmds
+from asm_gen import ASMCode
+
+
+class BasicBlock:
+    """A maximal run of IL commands which is entered only at its start.
+
+    commands - List of the IL commands in this block. If the block may be
+    jumped to, its first command is a Label.
+    preds, succs - Lists of the predecessor and successor blocks.
+    """
+
+    def __init__(self, commands):
+        """Initialize a block holding the given commands."""
+        self.commands = commands
+        self.preds = []
+        self.succs = []
+
+    def label(self):
+        """Return the name of the label starting this block, or None."""
+        if self.commands:
+            return self.commands[0].label_name()
+
+    def jump(self):
+        """Return the command ending this block if it jumps, or None."""
+        if self.commands and (self.commands[-1].targets() or
+                              isinstance(self.commands[-1],
+                                         control_cmds.Return)):
+            return self.commands[-1]
+
+    def falls_through(self):
+        """Return True iff control may continue past the end of the block."""
+        return not (self.commands and
+                    isinstance(self.commands[-1],
+                               (control_cmds.Jump, control_cmds.Return)))
+
+    def __repr__(self):  # pragma: no cover
+        return f"<block {self.label() or id(self) % 1000:03}>"
+
+
+class CFG:
+    """Control flow graph of one function.
+
+    blocks - List of the basic blocks, in layout order. The first block is
+    the entry block, which no block jumps to.
+    idom - Dictionary mapping each block reachable from the entry to its
+    immediate dominator. The entry block maps to itself.
+    order - List of the reachable blocks in reverse postorder.
+    """
+
+    def __init__(self, commands):
+        """Build the CFG of the given command list.
+
+        Blocks unreachable from the entry are dropped, because no pass
+        needs to preserve them.
+        """
+        self.blocks = []
+        cur = []
+        for command in commands:
+            if command.label_name() and cur:
+                self.blocks.append(BasicBlock(cur))
+                cur = []
+            cur.append(command)
+            if command.targets() or isinstance(
+                    command, (control_cmds.Jump, control_cmds.Return)):
+                self.blocks.append(BasicBlock(cur))
+                cur = []
+        if cur:
+            self.blocks.append(BasicBlock(cur))
+
+        # The entry block must not have predecessors, so a Phi is never
+        # needed there.
+        if not self.blocks or self.blocks[0].label():
+            self.blocks.insert(0, BasicBlock([]))
+
+        self.update()
+
+    def update(self):
+        """Recompute the edges and dominators after a change to the blocks.
+
+        Passes call this after adding blocks, removing blocks, or changing
+        the jumps which end them.
+        """
+        labels = {b.label(): b for b in self.blocks if b.label()}
+        for b in self.blocks:
+            b.preds = []
+            b.succs = []
+
+        for i, b in enumerate(self.blocks):
+            if b.falls_through() and i + 1 < len(self.blocks):
+                self._add_edge(b, self.blocks[i + 1])
+            jump = b.jump()
+            if jump:
+                for label in jump.targets():
+                    self._add_edge(b, labels[label])
+
+        self._compute_order()
+        reachable = set(self.order)
+        if len(reachable) != len(self.blocks):
+            self.blocks = [b for b in self.blocks if b in reachable]
+            for b in self.blocks:
+                b.preds = [p for p in b.preds if p in reachable]
+
+        self._compute_dominators()
+
+    def commands(self):
+        """Return the flat list of the commands of every block."""
+        return [command for b in self.blocks for command in b.commands]
+
+    def dominates(self, a, b):
+        """Return True iff block `a` dominates block `b`."""
+        while b is not a:
+            if self.idom[b] is b:
+                return False
+            b = self.idom[b]
+        return True
+
+    def dom_children(self):
+        """Return a dictionary mapping each block to its children.
+
+        The children of a block are the blocks it immediately dominates,
+        in reverse postorder.
+        """
+        children = {b: [] for b in self.order}
+        for b in self.order[1:]:
+            children[self.idom[b]].append(b)
+        return children
+
+    def frontiers(self):
+        """Return a dictionary mapping each block to its dominance frontier.
+
+        This is the algorithm of Cooper, Harvey, and Kennedy, which walks
+        up the dominator tree from the predecessors of each join block.
+        """
+        frontiers = {b: set() for b in self.order}
+        for b in self.order:
+            if len(b.preds) < 2:
+                continue
+            for p in b.preds:
+                runner = p
+                while runner is not self.idom[b]:
+                    frontiers[runner].add(b)
+                    runner = self.idom[runner]
+        return frontiers
+
+    def loops(self):
+        """Return the natural loops of the function, innermost first.
+
+        Each loop is a (header, body) pair, where body is the set of blocks
+        in the loop, including the header. Back edges to the same header
+        are merged into one loop.
+        """
+        bodies = {}
+        for b in self.order:
+            for s in b.succs:
+                if self.dominates(s, b):
+                    body = bodies.setdefault(s, {s})
+                    work = [b]
+                    while work:
+                        n = work.pop()
+                        if n not in body:
+                            body.add(n)
+                            work += n.preds
+
+        return sorted(bodies.items(), key=lambda loop: len(loop[1]))
+
+    def split_edge(self, pred, succ):
+        """Insert an empty block on the edge from `pred` to `succ`.
+
+        If the edge falls through, the new block is placed between the two
+        blocks. Otherwise, the jump ending `pred` is redirected to a new
+        label which starts the block, and the block jumps on to `succ`.
+        Returns the new block. The caller must call update() afterwards.
+        """
+        i = self.blocks.index(pred)
+        jump = pred.jump()
+        if (pred.falls_through() and i + 1 < len(self.blocks)
+              and self.blocks[i + 1] is succ
+              and not (jump and succ.label() in jump.targets())):
+            block = BasicBlock([])
+            self.blocks.insert(i + 1, block)
+            return block
+
+        label = ASMCode.get_label()
+        block = BasicBlock([control_cmds.Label(label),
+                            control_cmds.Jump(succ.label())])
+        jump.label = label
+
+        # Place the block after a block which does not fall through, so no
+        # existing path runs into it.
+        for j in range(i, len(self.blocks)):
+            if not self.blocks[j].falls_through():
+                self.blocks.insert(j + 1, block)
+                break
+        return block
+
+    def _add_edge(self, pred, succ):
+        """Add an edge from `pred` to `succ`, unless it already exists."""
+        if succ not in pred.succs:
+            pred.succs.append(succ)
+            succ.preds.append(pred)
+
+    def _compute_order(self):
+        """Compute the reverse postorder of the reachable blocks."""
+        post = []
+        visited = {self.blocks[0]}
+        stack = [(self.blocks[0], iter(self.blocks[0].succs))]
+        while stack:
+            b, succs = stack[-1]
+            for s in succs:
+                if s not in visited:
+                    visited.add(s)
+                    stack.append((s, iter(s.succs)))
+                    break
+            else:
+                stack.pop()
+                post.append(b)
+
+        self.order = post[::-1]
+
+    def _compute_dominators(self):
+        """Compute the immediate dominator of each reachable block.
+
+        This is the iterative algorithm of Cooper, Harvey, and Kennedy over
+        the reverse postorder.
+        """
+        number = {b: i for i, b in enumerate(self.order)}
+        entry = self.order[0]
+        self.idom = {entry: entry}
+
+        def intersect(a, b):
+            while a is not b:
+                while number[a] > number[b]:
+                    a = self.idom[a]
+                while number[b] > number[a]:
+                    b = self.idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for b in self.order[1:]:
+                new_idom = None
+                for p in b.preds:
+                    if p in self.idom:
+                        new_idom = p if not new_idom else intersect(p, new_idom)
+                if self.idom.get(b) is not new_idom:
+                    self.idom[b] = new_idom
+                    changed = True
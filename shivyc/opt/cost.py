@@ -0,0 +1,62 @@
+"""Estimates of the size of the code generated for IL commands.
+
+KCPSM3 holds at most 1024 instructions in its program ROM, so passes which
+grow the code, like loop unrolling and inlining, weigh the instructions
+they add against the space left. The estimates here count the instructions
+the ASM generator typically emits for each command, before register
+allocation adds any moves or spills. Every KCPSM3 instruction is one word
+of ROM and takes two clock cycles.
+"""
+
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+
+
+# Clock cycles taken by each instruction
+CYCLES_PER_WORD = 2
+
+# Estimated instructions of each IL command class
+_WORDS = {
+    control_cmds.Label: 0,
+    control_cmds.Jump: 1,
+    control_cmds.JumpZero: 2,
+    control_cmds.JumpNotZero: 2,
+    control_cmds.SubtrJumpNotZero: 2,
+    control_cmds.Return: 2,
+    value_cmds.Set: 1,
+    math_cmds.Add: 1,
+    math_cmds.Subtr: 1,
+    math_cmds.Mult: 4,
+    math_cmds.Div: 5,
+    math_cmds.Mod: 5,
+    math_cmds.LBitShift: 3,
+    math_cmds.RBitShift: 3,
+}
+
+# Comparisons, each of which loads 1, compares, jumps over loading 0, and
+# loads 0
+_COMPARES = (compare_cmds.NotEqualCmp, compare_cmds.EqualCmp,
+             compare_cmds.LessCmp, compare_cmds.GreaterCmp,
+             compare_cmds.LessOrEqCmp, compare_cmds.GreaterOrEqCmp)
+
+
+def command_words(command):
+    """Return the estimated number of instructions for an IL command."""
+    if isinstance(command, _COMPARES):
+        return 4
+    if isinstance(command, control_cmds.Call):
+        return 1 + len(command.args)
+    return _WORDS.get(type(command), 2)
+
+
+def code_words(commands):
+    """Return the estimated number of instructions for a list of commands."""
+    return sum(command_words(command) for command in commands)
+
+
+def program_words(il_code):
+    """Return the estimated number of instructions for a whole program."""
+    return sum(code_words(commands)
+               for commands in il_code.commands.values())
@@ -0,0 +1,60 @@
+"""Dead code elimination on SSA form.
+
+The optimization passes leave behind commands whose results are no longer
+used, such as the address computation of an eliminated load. In SSA form
+each value has one definition, so the commands needed by the rest of the
+function are found by following the definitions of their inputs.
+
+"""
+
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+from opt.ssa import Phi
+
+
+# IL commands which have no effect other than setting their outputs
+PURE = (math_cmds.Add, math_cmds.Subtr, math_cmds.Mult,
+        math_cmds.RBitShift, math_cmds.LBitShift,
+        math_cmds.Div, math_cmds.Mod, math_cmds.Neg, math_cmds.Not,
+        compare_cmds.NotEqualCmp, compare_cmds.EqualCmp,
+        compare_cmds.LessCmp, compare_cmds.GreaterCmp,
+        compare_cmds.LessOrEqCmp, compare_cmds.GreaterOrEqCmp,
+        value_cmds.Set, value_cmds.AddrOf, value_cmds.AddrRel,
+        value_cmds.ReadRel, value_cmds.ReadAt, Phi)
+
+# IL commands which may write to memory other than through their outputs
+WRITES_MEMORY = (value_cmds.SetAt, value_cmds.SetRel, control_cmds.Call)
+
+
+def remove_dead(cfg, values):
+    """Remove the pure commands whose outputs are never used.
+
+    values - Set of the values in SSA form. A command is only removed if
+    all of its outputs are in this set, because any other value may be
+    read through memory.
+
+    Commands are marked live starting from those with other effects, so a
+    cycle of commands which only use each other, such as a loop counter
+    which no longer controls its loop, is removed as well.
+    """
+    defs = {}
+    for b in cfg.order:
+        for command in b.commands:
+            for v in command.outputs():
+                defs[v] = command
+
+    live = set()
+    work = [command for b in cfg.order for command in b.commands
+            if not isinstance(command, PURE)
+            or any(v not in values for v in command.outputs())]
+    while work:
+        command = work.pop()
+        if command in live:
+            continue
+        live.add(command)
+        work += [defs[v] for v in command.inputs() if v in defs]
+
+    for b in cfg.order:
+        b.commands = [command for command in b.commands if command in live]
@@ -0,0 +1,256 @@
+"""Global value numbering and common subexpression elimination.
+
+This pass is enabled with `-fgvn`. Array indexing and member access
+generate the same address arithmetic and loads for every occurrence of an
+expression, so for example `buf[i] = buf[i] + 1` computes the address of
+`buf[i]` twice. This pass finds commands which compute a value already
+computed by a command dominating them, and replaces the outputs of the
+later commands with the earlier result.
+
+"""
+
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+from il_gen import IntegerLiteral
+from opt.dce import WRITES_MEMORY, remove_dead
+from opt.ssa import Phi
+
+
+class ValueNumbering:
+    """Dominator-based value numbering of a function in SSA form.
+
+    The commands are visited in a walk over the dominator tree. Each pure
+    command is hashed by its class, its output type, and the value numbers
+    of its operands, and the hash table is scoped so that a command only
+    reuses the result of a command in a block dominating it.
+
+    A value which is not in SSA form, such as a static variable or an
+    automatic variable whose address is taken, may change at any write to
+    memory. Such values, and the results of loads, are numbered together
+    with a memory version which changes at every command which may write to
+    memory and at the start of every block with several predecessors.
+
+    A call clobbers every register, so a value reused after a call would
+    have to be saved to the scratchpad around it, which usually costs more
+    than computing the value again. Results are therefore only reused
+    between commands with no call between them. Like memory versions, this
+    is tracked along the dominator tree, and a block with several
+    predecessors in a function with calls starts afresh.
+
+    cfg (CFG) - Control flow graph of the function, in SSA form.
+    values - Set of the values in SSA form, from to_ssa.
+    """
+
+    # Commands numbered by their class and operands
+    binary = (math_cmds.Add, math_cmds.Subtr, math_cmds.Mult,
+              math_cmds.RBitShift, math_cmds.LBitShift,
+              math_cmds.Div, math_cmds.Mod,
+              compare_cmds.NotEqualCmp, compare_cmds.EqualCmp,
+              compare_cmds.LessCmp, compare_cmds.GreaterCmp,
+              compare_cmds.LessOrEqCmp, compare_cmds.GreaterOrEqCmp)
+    unary = (math_cmds.Neg, math_cmds.Not, value_cmds.Set)
+
+    # Commands whose operands may be swapped
+    commutative = (math_cmds.Add, math_cmds.Mult,
+                   compare_cmds.NotEqualCmp, compare_cmds.EqualCmp)
+
+    def __init__(self, cfg, values):
+        """Initialize value numbering of the given function."""
+        self.cfg = cfg
+        self.values = values
+
+        # Mapping from each hashed operand or command to its value number
+        self.numbers = {}
+
+        # Mapping from each command hash to the value holding its result
+        # and the call count at which it was computed
+        self.avail = {}
+
+        # Mapping from each eliminated value to the value replacing it
+        self.replace = {}
+
+        # Current memory version
+        self.mem = 0
+
+        # Number of calls passed so far, and whether the function has any
+        self.calls = 0
+        self.has_calls = any(isinstance(command, control_cmds.Call)
+                             for b in cfg.order for command in b.commands)
+
+    def run(self):
+        """Number the values of the function and eliminate redundancies.
+
+        Returns the number of commands eliminated.
+        """
+        children = self.cfg.dom_children()
+        mem_out = {}
+        calls_out = {}
+        eliminated = 0
+
+        # The walk is iterative, like the renaming walk of to_ssa. A None
+        # entry on the work list restores the hashes changed by the block
+        # before it.
+        work = [self.cfg.order[0]]
+        added = []
+        while work:
+            b = work.pop()
+            if b is None:
+                for key, old in reversed(added.pop()):
+                    if old:
+                        self.avail[key] = old
+                    else:
+                        del self.avail[key]
+                continue
+
+            if len(b.preds) == 1:
+                self.mem = mem_out[b.preds[0]]
+                self.calls = calls_out[b.preds[0]]
+            else:
+                self._write_memory()
+                if self.has_calls:
+                    self.calls += 1
+
+            keys = []
+            commands = []
+            for command in b.commands:
+                command.rename(self.replace, {})
+                if self._eliminate(command, keys):
+                    eliminated += 1
+                else:
+                    commands.append(command)
+            b.commands = commands
+            mem_out[b] = self.mem
+            calls_out[b] = self.calls
+
+            added.append(keys)
+            work.append(None)
+            work += reversed(children[b])
+
+        self._remove_trivial_phis()
+        for b in self.cfg.order:
+            for command in b.commands:
+                command.rename(self.replace, {})
+
+        remove_dead(self.cfg, self.values)
+        return eliminated
+
+    def _eliminate(self, command, keys):
+        """Number the command, and return True if it is redundant.
+
+        keys - List to which to add each hash changed by this command and
+        its previous entry in the table, or None if it had none.
+        """
+        if isinstance(command, WRITES_MEMORY):
+            self._write_memory()
+            if isinstance(command, control_cmds.Call):
+                self.calls += 1
+            return False
+        if any(v not in self.values for v in command.outputs() if v):
+            self._write_memory()
+            return False
+
+        # A SET between compatible types is a copy, so its output is
+        # replaced with its argument.
+        if (isinstance(command, value_cmds.Set)
+              and command.arg in self.values
+              and command.output.ctype.weak_compat(command.arg.ctype)):
+            self.replace[command.output] = command.arg
+            return True
+
+        key = self._key(command)
+        if not key:
+            return False
+        if key in self.avail:
+            value, calls = self.avail[key]
+            if calls == self.calls:
+                self.replace[command.output] = value
+                return True
+            keys.append((key, self.avail[key]))
+        else:
+            keys.append((key, None))
+
+        self.avail[key] = (command.output, self.calls)
+        return False
+
+    def _key(self, command):
+        """Return the hash of the value computed by the command, or None.
+
+        Constants and the addresses of variables are not reused, because
+        loading them costs no more than copying them from another register.
+        """
+        if isinstance(command, self.binary):
+            args = [self._number(command.arg1), self._number(command.arg2)]
+            if isinstance(command, self.commutative):
+                args.sort()
+        elif isinstance(command, self.unary):
+            if self._is_literal(command.arg):
+                return None
+            args = [self._number(command.arg)]
+        elif isinstance(command, (value_cmds.AddrRel, value_cmds.ReadRel)):
+            if isinstance(command, value_cmds.AddrRel):
+                base = ("addr", command.base)
+            else:
+                base = ("mem", command.base, self.mem)
+            count = self._number(command.count) if command.count else None
+            args = [self._number(base), command.chunk, count]
+        elif isinstance(command, value_cmds.ReadAt):
+            args = [self._number(command.addr), self.mem]
+        else:
+            return None
+
+        return (type(command), command.output.ctype, *args)
+
+    def _number(self, operand):
+        """Return the value number of an IL value or other operand."""
+        if operand in self.values:
+            key = operand
+        elif self._is_literal(operand):
+            key = ("lit", operand.literal.val, operand.ctype)
+        elif hasattr(operand, "ctype"):
+            key = ("mem", operand, self.mem)
+        else:
+            key = operand
+        return self.numbers.setdefault(key, len(self.numbers))
+
+    def _is_literal(self, v):
+        """Return True iff `v` is an integer literal IL value."""
+        return isinstance(getattr(v, "literal", None), IntegerLiteral)
+
+    def _write_memory(self):
+        """Start a new memory version."""
+        self.mem = len(self.numbers)
+        self.numbers[("version", self.mem)] = self.mem
+
+    def _remove_trivial_phis(self):
+        """Replace each Phi whose sources are all one value by that value.
+
+        Once copies are propagated, a Phi may select between a value and
+        itself, such as for a variable assigned in a loop only a copy of
+        its value before the loop.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for b in self.cfg.order:
+                for command in b.commands:
+                    if not isinstance(command, Phi):
+                        continue
+                    sources = {self._find(v) for v in command.inputs()}
+                    sources.discard(command.output)
+                    if len(sources) == 1:
+                        self.replace[command.output] = sources.pop()
+                        changed = True
+                b.commands = [command for command in b.commands
+                              if not isinstance(command, Phi)
+                              or command.output not in self.replace]
+
+        for v in self.replace:
+            self.replace[v] = self._find(v)
+
+    def _find(self, v):
+        """Return the value finally replacing `v`."""
+        while v in self.replace:
+            v = self.replace[v]
+        return v
@@ -0,0 +1,248 @@
+"""Function inlining.
+
+This pass is enabled with `-finline-functions`. A call passes its arguments
+in registers, runs CALL and RETURN, and holds one of the 31 levels of the
+KCPSM3 hardware call stack while the callee runs. Inlining replaces a call
+with a copy of the body of the callee, which removes all three costs but
+adds the body to the ROM once for each call inlined.
+
+Functions are visited bottom-up over the call graph, so a callee has had
+its own calls inlined before it is copied into its callers. A call is
+inlined if
+
+    the callee is declared __attribute__((always_inline)),
+    the copy is no larger than the call it replaces,
+    it is the last call to a static function, which is then removed, or
+    the callee is small or declared inline, and the copy fits in the ROM
+    left over.
+
+If the deepest chain of calls still needs more levels than the hardware
+call stack has, calls along it are then inlined while they fit in the ROM.
+Calls to functions declared __attribute__((noinline)), and calls within a
+recursive cycle, are never inlined.
+
+"""
+
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+from asm_gen import ASMCode
+from call_graph import CallGraph
+from il_gen import ILValue
+from opt.cost import code_words, command_words, program_words
+
+
+# Levels of the KCPSM3 hardware call stack
+STACK_DEPTH = 31
+
+# Largest callee, in words of ROM, inlined without an inline hint
+MAX_SMALL = 12
+
+
+class Inliner:
+    """Inlining of the calls between the functions of a program.
+
+    il_code (ILCode) - IL code of the program, not in SSA form.
+    symbol_table (SymbolTable) - Symbol table of the program.
+    rom_size - Number of words of program ROM available.
+    """
+
+    def __init__(self, il_code, symbol_table, rom_size):
+        """Initialize inlining in the given program."""
+        self.il_code = il_code
+        self.symbol_table = symbol_table
+        self.spare = rom_size - program_words(il_code)
+
+        graph = CallGraph(il_code, symbol_table)
+        self.recursive = {func for component in graph.sccs()
+                          if graph.is_recursive(component)
+                          for func in component}
+
+        # Functions which may be removed once no call to them remains
+        internal = self.symbol_table.linkages[self.symbol_table.INTERNAL]
+        self.removable = {func for func in il_code.commands
+                          if func in internal
+                          and func not in graph.address_taken}
+
+    def run(self):
+        """Inline the calls of every function in the program.
+
+        Returns the number of calls inlined.
+        """
+        inlined = 0
+        graph = CallGraph(self.il_code, self.symbol_table)
+        for component in graph.sccs():
+            for func in component:
+                for call, callee in graph.calls[func]:
+                    if self._should_inline(func, call, callee):
+                        inlined += 1
+
+        inlined += self._shorten_deepest_path()
+
+        # Remove the static functions no longer called.
+        graph = CallGraph(self.il_code, self.symbol_table)
+        for func in self.removable:
+            if not graph.callers[func]:
+                self.spare += code_words(self.il_code.commands[func])
+                del self.il_code.commands[func]
+        return inlined
+
+    def _should_inline(self, func, call, callee):
+        """Inline the given call if the heuristics allow it.
+
+        Returns True if the call was inlined.
+        """
+        if not self._can_inline(func, call, callee):
+            return False
+
+        body = self._copy_body(call, callee)
+        growth = code_words(body) - command_words(call)
+        if self._is_last_call(callee):
+            growth -= code_words(self.il_code.commands[callee])
+
+        hint = self.il_code.inline_hints.get(callee)
+        small = (hint == "inline" or
+                 code_words(self.il_code.commands[callee]) <= MAX_SMALL)
+        if (hint == "always_inline" or growth <= 0
+              or (small and growth <= self.spare)):
+            self._inline(func, call, body)
+            self.spare -= growth
+            return True
+        return False
+
+    def _can_inline(self, func, call, callee):
+        """Return True iff the call may be replaced by the callee's body."""
+        if (not callee or callee == func or callee in self.recursive
+              or self.il_code.inline_hints.get(callee) == "noinline"):
+            return False
+
+        # A call to a function without a prototype may pass fewer arguments
+        # than the function loads.
+        return all(command.arg_num < len(call.args)
+                   for command in self.il_code.commands[callee]
+                   if isinstance(command, value_cmds.LoadArg))
+
+    def _is_last_call(self, callee):
+        """Return True iff the callee is removed when one call is inlined."""
+        if callee not in self.removable:
+            return False
+        graph = CallGraph(self.il_code, self.symbol_table)
+        return sum(c == callee for calls in graph.calls.values()
+                   for _, c in calls) == 1
+
+    def _copy_body(self, call, callee):
+        """Return a copy of the callee's commands to replace the call.
+
+        Each local value of the callee is replaced by a new value and each
+        label by a new label. Arguments are copied into the parameters, and
+        each return copies the returned value into the output of the call
+        and jumps past the end of the body.
+        """
+        values = {}
+        labels = {}
+        end = ASMCode.get_label()
+
+        body = []
+        for command in self.il_code.commands[callee]:
+            for v in command.inputs() + command.outputs():
+                if v and v not in values and self._is_local(v):
+                    values[v] = ILValue(v.ctype)
+
+            if isinstance(command, value_cmds.LoadArg):
+                body.append(value_cmds.Set(
+                    values[command.output], call.args[command.arg_num]))
+            elif isinstance(command, control_cmds.Return):
+                if command.arg and not call.void_return:
+                    body.append(value_cmds.Set(
+                        call.ret, values.get(command.arg, command.arg)))
+                body.append(control_cmds.Jump(end))
+            else:
+                copy = command.copy()
+                copy.rename(values, values)
+                if copy.label_name() or copy.targets():
+                    copy.label = labels.setdefault(
+                        copy.label, ASMCode.get_label())
+                body.append(copy)
+
+        if isinstance(body[-1], control_cmds.Jump) and body[-1].label == end:
+            body.pop()
+        body.append(control_cmds.Label(end))
+        return body
+
+    def _inline(self, func, call, body):
+        """Replace the call in the given function with the body."""
+        commands = self.il_code.commands[func]
+        i = commands.index(call)
+        commands[i:i + 1] = body
+
+    def _is_local(self, v):
+        """Return True iff `v` is a value local to one function."""
+        if v in self.symbol_table.storage:
+            return (self.symbol_table.storage[v]
+                    == self.symbol_table.AUTOMATIC)
+        return (v not in self.il_code.literals
+                and v not in self.il_code.string_literals)
+
+    def _shorten_deepest_path(self):
+        """Inline calls until the deepest chain of calls fits the stack.
+
+        Each step inlines the call with the least growth on the deepest
+        chain. Returns the number of calls inlined.
+        """
+        inlined = 0
+        while True:
+            path = self._get_deepest_path()
+            if len(path) <= STACK_DEPTH:
+                return inlined
+
+            best = None
+            for func, call, callee in path:
+                if not self._can_inline(func, call, callee):
+                    continue
+                body = self._copy_body(call, callee)
+                growth = code_words(body) - command_words(call)
+                if growth <= self.spare and (not best or growth < best[0]):
+                    best = (growth, func, call, body)
+            if not best:
+                return inlined
+
+            growth, func, call, body = best
+            self._inline(func, call, body)
+            self.spare -= growth
+            inlined += 1
+
+    def _get_deepest_path(self):
+        """Return the deepest chain of calls in the program.
+
+        The chain is a list of (caller, Call, callee) triples, starting
+        from a function no other function calls. Calls within a recursive
+        cycle have no bounded depth, and are not followed.
+        """
+        graph = CallGraph(self.il_code, self.symbol_table)
+
+        # Maps each function to the levels of call stack it uses, including
+        # the return address of the call to it, and to its deepest call.
+        depth = {}
+        deepest = {}
+        for component in graph.sccs():
+            for func in component:
+                depth[func], deepest[func] = 1, None
+                for call, callee in graph.calls[func]:
+                    if callee in component:
+                        continue
+                    d = 1 + (depth[callee] if callee else 1)
+                    if d > depth[func]:
+                        depth[func], deepest[func] = d, (call, callee)
+
+        roots = [func for func in graph.calls if not graph.callers[func]]
+        if not roots:
+            return []
+
+        func = max(roots, key=lambda f: depth[f])
+        path = []
+        while deepest[func]:
+            call, callee = deepest[func]
+            path.append((func, call, callee))
+            if not callee:
+                break
+            func = callee
+        return path
@@ -0,0 +1,461 @@
+"""Induction variable strength reduction.
+
+This pass is enabled with `-fivopts`. A loop such as
+
+    for (i = 0; i < n; i++) sum += a[i];
+
+scales its counter on every iteration to find the address of `a[i]`, and
+PicoBlaze has neither a multiplier nor scaled addressing. This pass finds
+the values of each loop which are affine functions of a loop counter, and
+gives each scaled one its own variable, which is advanced by a constant at
+the end of every iteration in place of the multiplication. If the counter
+is then used only by the exit test of the loop, the test is rewritten in
+terms of one of the new variables, so the counter is removed entirely.
+
+Every value is held in one 8-bit register, so the new variables wrap
+around modulo 256 just as the products they replace do. An exit test is
+only rewritten when the new variable cannot wrap around in the loop.
+
+"""
+
+import ctypes
+import il_cmds.compare as compare_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+from il_gen import ILValue, IntegerLiteral
+from opt.dce import remove_dead
+from opt.ssa import Phi, get_preheader, split_edge
+
+
+class _IV:
+    """An induction variable, of value `scale * phi + base + offset`.
+
+    phi - Output of the Phi of the loop counter this value is derived from.
+    scale, offset - Python integers.
+    base - IL value which does not change in the loop, or None.
+    """
+
+    def __init__(self, phi, scale, base=None, offset=0):  # noqa D102
+        self.phi = phi
+        self.scale = scale
+        self.base = base
+        self.offset = offset
+
+
+class StrengthReduction:
+    """Strength reduction of the loops of a function in SSA form.
+
+    A counter of a loop is a Phi in the loop header whose value from every
+    latch is its own value plus or minus a literal. The values derived
+    from a counter by additions of invariant values or literals, by
+    multiplications and left shifts by literals, and by widening SETs are
+    its induction variables. A relative read or write whose count is an
+    induction variable has the scaled count as an induction variable too.
+
+    An induction variable with a scale other than that of its counter, and
+    a use other than computing another induction variable, is replaced by
+    a new Phi in the loop header. The new Phi starts at the value of the
+    induction variable for the initial counter, computed in the preheader,
+    and is advanced by its scale times the step of the counter at the end
+    of each latch.
+
+    cfg (CFG) - Control flow graph of the function, in SSA form.
+    values - Set of the values in SSA form, from to_ssa. The new values
+    are added to it.
+    il_code (ILCode) - IL code of the program, for registering literals.
+    """
+
+    # Comparisons which still hold when both operands are scaled by a
+    # positive number and shifted by the same amount
+    ordered = (compare_cmds.LessCmp, compare_cmds.GreaterCmp,
+               compare_cmds.LessOrEqCmp, compare_cmds.GreaterOrEqCmp)
+    equality = (compare_cmds.EqualCmp, compare_cmds.NotEqualCmp)
+
+    # Relative commands, whose address is `&base + chunk * count`
+    relative = (value_cmds.ReadRel, value_cmds.SetRel, value_cmds.AddrRel)
+
+    def __init__(self, cfg, values, il_code):
+        """Initialize strength reduction of the given function."""
+        self.cfg = cfg
+        self.values = values
+        self.il_code = il_code
+
+    def run(self):
+        """Reduce the induction variables of every loop.
+
+        Returns the number of induction variables reduced.
+        """
+        reduced = 0
+        done = set()
+        while True:
+            # Splitting edges changes the bodies of the enclosing loops, so
+            # the loops are found again after each one.
+            loops = [loop for loop in self.cfg.loops() if loop[0] not in done]
+            if not loops:
+                break
+
+            header, body = loops[0]
+            done.add(header)
+            reduced += self._reduce_loop(header, body)
+
+        remove_dead(self.cfg, self.values)
+        return reduced
+
+    def _reduce_loop(self, header, body):
+        """Reduce the induction variables of one loop.
+
+        Returns the number of induction variables reduced.
+        """
+        self.defs = {v: command for b in self.cfg.order
+                     for command in b.commands for v in command.outputs()}
+        latches = [p for p in header.preds if p in body]
+        commands = [command for b in self.cfg.order if b in body
+                    for command in b.commands]
+        defined = {v for command in commands for v in command.outputs()}
+
+        counters = {}
+        for command in header.commands:
+            if isinstance(command, Phi) and command.output in self.values:
+                step = self._get_step(command, latches)
+                if step:
+                    counters[command.output] = (command, step)
+        if not counters:
+            return 0
+
+        ivs = {v: _IV(v, 1) for v in counters}
+        derived = set()
+        for command in commands:
+            iv = self._derive(command, ivs, defined)
+            if iv:
+                ivs[command.output] = iv
+                derived.add(command)
+
+        # Find the induction variables to replace, which are those with a
+        # use other than deriving another induction variable. The scaled
+        # count of a relative command is given a value of its own.
+        reduce = {}
+        counts = {}
+        for command in commands:
+            if command in derived:
+                continue
+            if (isinstance(command, self.relative) and command.chunk != 1
+                  and command.count in ivs and not ivs[command.count].base):
+                count = ivs[command.count]
+                counts[command] = _IV(count.phi,
+                                      count.scale * command.chunk, None,
+                                      count.offset * command.chunk)
+                continue
+            for v in command.inputs():
+                if v in ivs and ivs[v].scale != 1 and v not in counters:
+                    reduce[v] = ivs[v]
+        if not reduce and not counts:
+            return 0
+
+        pre = get_preheader(self.cfg, header, body)
+        if not pre:
+            return 0
+        latches = [self._get_latch_block(l, header, body) for l in latches]
+
+        # List of the new Phis, with the induction variables they hold
+        phis = []
+        new = {}
+        for v, iv in reduce.items():
+            new[v] = self._add_phi(v.ctype, iv, counters, header, pre,
+                                   latches)
+            phis.append((new[v], iv))
+        for command, iv in counts.items():
+            command.count = self._add_phi(command.count.ctype, iv, counters,
+                                          header, pre, latches)
+            command.chunk = 1
+            phis.append((command.count, iv))
+
+        for b in body:
+            for command in b.commands:
+                command.rename(new, {})
+
+        self._replace_test(counters, ivs, phis, derived, defined, body, pre)
+        return len(reduce) + len(counts)
+
+    def _get_step(self, phi, latches):
+        """Return the step of the counter with the given Phi, or None."""
+        nexts = {phi.sources[l] for l in latches}
+        if len(nexts) != 1:
+            return None
+
+        # The value from the latches is usually a copy of the sum into the
+        # variable, as for `i = i + 1`.
+        inc = self.defs.get(self._resolve(nexts.pop()))
+        if isinstance(inc, math_cmds.Add):
+            if inc.arg1 is phi.output and self._literal(inc.arg2):
+                return self._literal(inc.arg2)
+            if inc.arg2 is phi.output and self._literal(inc.arg1):
+                return self._literal(inc.arg1)
+        elif isinstance(inc, math_cmds.Subtr):
+            if inc.arg1 is phi.output and self._literal(inc.arg2):
+                return -self._literal(inc.arg2)
+        return None
+
+    def _derive(self, command, ivs, defined):
+        """Return the induction variable computed by the command, or None.
+
+        ivs - Dictionary mapping each value known to be an induction
+        variable to its _IV.
+        defined - Set of the values defined in the loop.
+        """
+        if any(v not in self.values for v in command.outputs()):
+            return None
+
+        if isinstance(command, value_cmds.Set):
+            arg = ivs.get(command.arg)
+            out = command.output.ctype
+            if (arg and (out.is_integral() or out.is_pointer())
+                  and out.size >= command.arg.ctype.size):
+                return arg
+
+        elif isinstance(command, (math_cmds.Add, math_cmds.Subtr)):
+            if command.arg1 in ivs:
+                iv, other = ivs[command.arg1], command.arg2
+            elif command.arg2 in ivs and isinstance(command, math_cmds.Add):
+                iv, other = ivs[command.arg2], command.arg1
+            else:
+                return None
+
+            sign = -1 if isinstance(command, math_cmds.Subtr) else 1
+            lit = self._literal(other)
+            if lit is not None:
+                return _IV(iv.phi, iv.scale, iv.base, iv.offset + sign * lit)
+            if (sign == 1 and not iv.base and other not in defined
+                  and other in self.values):
+                return _IV(iv.phi, iv.scale, other, iv.offset)
+
+        elif isinstance(command, (math_cmds.Mult, math_cmds.LBitShift)):
+            if command.arg1 in ivs:
+                iv, factor = ivs[command.arg1], self._literal(command.arg2)
+            elif command.arg2 in ivs and isinstance(command, math_cmds.Mult):
+                iv, factor = ivs[command.arg2], self._literal(command.arg1)
+            else:
+                return None
+
+            if factor is None or iv.base:
+                return None
+            if isinstance(command, math_cmds.LBitShift):
+                factor = 1 << factor
+            return _IV(iv.phi, iv.scale * factor, None, iv.offset * factor)
+
+        return None
+
+    def _get_latch_block(self, latch, header, body):
+        """Return the block at the end of which to advance the new Phis.
+
+        The new Phis are used only in the loop, so they may be advanced at
+        the end of a latch which may also leave the loop, as in a rotated
+        loop. If the latch may continue to another block in the loop, an
+        empty block is inserted on its edge to the header instead.
+        """
+        if all(s is header or s not in body for s in latch.succs):
+            return latch
+        return split_edge(self.cfg, latch, header)
+
+    def _add_phi(self, ctype, iv, counters, header, pre, latches):
+        """Add a Phi to the header holding the value of an induction variable.
+
+        Returns the output of the new Phi.
+        """
+        phi_cmd, step = counters[iv.phi]
+        init = phi_cmd.sources[pre]
+
+        arith = ctypes.longint if ctype.is_pointer() else ctype
+        inc = (iv.scale * step + 128) % 256 - 128
+
+        output = self._new_value(ctype)
+        sources = {pre: self._compute(ctype, iv, init, pre)}
+        for latch in latches:
+            nxt = self._new_value(ctype)
+            if inc > 0:
+                self._insert(latch, math_cmds.Add(
+                    nxt, output, self._new_literal(arith, inc)))
+            else:
+                self._insert(latch, math_cmds.Subtr(
+                    nxt, output, self._new_literal(arith, -inc)))
+            sources[latch] = nxt
+
+        header.commands.insert(1 if header.label() else 0,
+                               Phi(output, sources))
+        return output
+
+    def _compute(self, ctype, iv, value, block):
+        """Compute the induction variable for the counter `value` in a block.
+
+        The commands are added at the end of the block. Returns the IL value
+        holding the result.
+        """
+        lit = self._literal_value(value)
+        if lit is not None and not iv.base:
+            return self._new_literal(
+                ctype, self._wrap(ctype, iv.scale * lit + iv.offset))
+
+        arith = ctypes.longint if ctype.is_pointer() else ctype
+        result = value
+        if value.ctype is not arith:
+            result = self._new_value(arith)
+            self._insert(block, value_cmds.Set(result, value))
+        if iv.scale != 1:
+            product = self._new_value(arith)
+            self._insert(block, math_cmds.Mult(
+                product, result, self._new_literal(arith, iv.scale)))
+            result = product
+        if iv.base:
+            total = self._new_value(ctype)
+            self._insert(block, math_cmds.Add(total, iv.base, result))
+            result = total
+        if iv.offset:
+            total = self._new_value(ctype)
+            self._insert(block, math_cmds.Add(
+                total, result, self._new_literal(arith, iv.offset)))
+            result = total
+        if result.ctype is not ctype:
+            total = self._new_value(ctype)
+            self._insert(block, value_cmds.Set(total, result))
+            result = total
+        return result
+
+    def _replace_test(self, counters, ivs, phis, derived, defined, body,
+                      pre):
+        """Rewrite the exit test of each counter in terms of a new Phi.
+
+        This is linear function test replacement. It is done only when the
+        test is the only use of the counter left in the loop other than
+        advancing it, so the counter can then be removed.
+
+        The new Phi must not wrap around between its initial value and the
+        new bound, or the test would no longer end the loop after the same
+        number of iterations. This is checked when the initial counter and
+        the bound are literals. If the bound is not a literal, the test is
+        only rewritten when the new Phi is the counter plus an offset.
+        """
+        for phi, (phi_cmd, step) in counters.items():
+            family = {v for v, iv in ivs.items() if iv.phi is phi}
+            replaced = [(v, iv) for v, iv in phis if iv.phi is phi]
+            if not replaced:
+                continue
+
+            tests = []
+            other_uses = False
+            for b in self.cfg.order:
+                for command in b.commands:
+                    uses = family & set(command.inputs())
+                    if not uses or command in derived or command is phi_cmd:
+                        continue
+                    if (b in body and len(uses) == 1
+                          and isinstance(command, self.ordered + self.equality)
+                          and self._is_counter(ivs[next(iter(uses))])):
+                        tests.append(command)
+                    else:
+                        other_uses = True
+            if other_uses or len(tests) != 1:
+                continue
+
+            # The test may check the counter of the next iteration, as in a
+            # rotated loop, so the bound is adjusted by the difference.
+            test = tests[0]
+            counter = test.arg1 if test.arg1 in family else test.arg2
+            bound = test.arg2 if test.arg1 is counter else test.arg1
+            v, iv = replaced[0]
+            if isinstance(test, self.ordered) and not (
+                    iv.scale > 0 and (v.ctype.is_pointer() or
+                                      v.ctype.signed == phi.ctype.signed)):
+                continue
+
+            diff = ivs[counter].offset
+            shifted = _IV(phi, iv.scale, iv.base,
+                          iv.offset - iv.scale * diff)
+
+            lit = self._literal(bound)
+            if lit is None:
+                if (iv.scale != 1 or bound not in self.values
+                      or bound in defined):
+                    continue
+            elif iv.base or not self._in_range(
+                    v.ctype, self._literal_value(phi_cmd.sources[pre]),
+                    lit, iv, shifted, step):
+                continue
+
+            new_bound = self._compute(v.ctype, shifted, bound, pre)
+            if test.arg1 is counter:
+                test.arg1, test.arg2 = v, new_bound
+            else:
+                test.arg1, test.arg2 = new_bound, v
+
+    def _in_range(self, ctype, init, bound, iv, shifted, step):
+        """Return True iff the new Phi of `iv` cannot wrap around.
+
+        init, bound - Literal values of the counter at the start of the
+        loop and of the bound it is tested against, or None.
+        shifted - The induction variable computed for the bound.
+
+        The Phi runs from its initial value towards the new bound, and may
+        pass the bound by up to one step before the test ends the loop.
+        """
+        if init is None:
+            return False
+        start = iv.scale * init + iv.offset
+        end = shifted.scale * bound + shifted.offset
+        inc = abs(iv.scale * step)
+        last = end + inc if end >= start else end - inc
+        return all(self._wrap(ctype, val) == val for val in (start, last))
+
+    def _wrap(self, ctype, val):
+        """Return `val` as the 8-bit value of type `ctype` it wraps to."""
+        if ctype.is_pointer() or not ctype.signed:
+            return val % 256
+        return (val + 128) % 256 - 128
+
+    def _is_counter(self, iv):
+        """Return True iff the induction variable is its counter plus a
+        literal."""
+        return iv.scale == 1 and not iv.base
+
+    def _resolve(self, v):
+        """Return the value of which `v` is a copy, or `v` itself."""
+        command = self.defs.get(v)
+        while (isinstance(command, value_cmds.Set) and
+               command.output.ctype.weak_compat(command.arg.ctype)):
+            v = command.arg
+            command = self.defs.get(v)
+        return v
+
+    def _insert(self, block, command):
+        """Insert a command at the end of a block, before its jump."""
+        i = len(block.commands) - 1 if block.jump() else len(block.commands)
+        block.commands.insert(i, command)
+
+    def _new_value(self, ctype):
+        """Return a new IL value in SSA form of the given type."""
+        value = ILValue(ctype)
+        self.values.add(value)
+        return value
+
+    def _new_literal(self, ctype, val):
+        """Return a new literal IL value."""
+        value = ILValue(ctype)
+        self.il_code.register_literal_var(value, str(val))
+        return value
+
+    def _literal_value(self, v):
+        """Return the integer value of `v` if it is a converted literal.
+
+        Conversions between integers wrap the value around to the 8 bits
+        of the new type.
+        """
+        command = self.defs.get(v)
+        if (isinstance(command, value_cmds.Set) and v.ctype.is_integral()
+              and not v.ctype.is_bool()):
+            lit = self._literal_value(command.arg)
+            return None if lit is None else self._wrap(v.ctype, lit)
+        return self._literal(v)
+
+    def _literal(self, v):
+        """Return the integer value of a literal IL value, or None."""
+        literal = getattr(v, "literal", None)
+        if isinstance(literal, IntegerLiteral):
+            return literal.val
@@ -0,0 +1,221 @@
+"""Loop-invariant code motion.
+
+This pass is enabled with `-flicm`. The IL of a while or for loop evaluates
+its condition and body as they appear in the source, so a computation whose
+operands do not change in the loop, such as `limit * 4` or the address of
+a struct member, is repeated on every iteration. This pass moves such
+commands into a preheader block, which runs once before the loop.
+
+"""
+
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+import spots
+from il_gen import IntegerLiteral
+from opt.dce import PURE, WRITES_MEMORY
+from opt.ssa import Phi, get_preheader
+
+
+class LoopInvariantMotion:
+    """Hoisting of the loop-invariant commands of a function in SSA form.
+
+    Loops are visited innermost first, so a command hoisted out of an inner
+    loop into its preheader may be hoisted again out of the enclosing loop.
+
+    A pure command is invariant in a loop if each of its operands is a
+    literal, a value defined outside the loop, or the output of another
+    invariant command. Loads, and operands which are not in SSA form, are
+    invariant only if no command in the loop may write to memory.
+
+    Each hoisted value which is still used in the loop holds a register
+    for the whole loop, so commands are only hoisted while the most values
+    live at once in the loop, together with the hoisted values, leave
+    `reserved` registers free for the temporaries of the ASM commands. In
+    a loop containing a call, which clobbers every register, a hoisted
+    value would be saved to the scratchpad around the call on every
+    iteration, so only commands more expensive than that are hoisted.
+
+    cfg (CFG) - Control flow graph of the function, in SSA form.
+    values - Set of the values in SSA form, from to_ssa.
+    """
+
+    # Number of registers kept free for temporaries
+    reserved = 2
+
+    # Commands which read memory
+    loads = (value_cmds.ReadAt, value_cmds.ReadRel)
+
+    # Commands hoisted out of loops containing calls
+    expensive = (math_cmds.Mult, math_cmds.Div, math_cmds.Mod)
+
+    # Commands which are only hoisted from blocks run on every entry to the
+    # loop, so a division by zero is never moved onto a path without one
+    guarded = (math_cmds.Div, math_cmds.Mod)
+
+    def __init__(self, cfg, values):
+        """Initialize code motion in the given function."""
+        self.cfg = cfg
+        self.values = values
+
+    def run(self):
+        """Hoist the invariant commands out of every loop.
+
+        Returns the number of commands hoisted.
+        """
+        hoisted = 0
+        done = set()
+        while True:
+            # Adding a preheader changes the bodies of the enclosing loops,
+            # so the loops are found again after each one.
+            loops = [loop for loop in self.cfg.loops() if loop[0] not in done]
+            if not loops:
+                return hoisted
+
+            header, body = loops[0]
+            done.add(header)
+            hoisted += self._hoist_loop(header, body)
+
+    def _hoist_loop(self, header, body):
+        """Hoist the invariant commands of one loop into its preheader.
+
+        Returns the number of commands hoisted.
+        """
+        if len([p for p in header.preds if p not in body]) != 1:
+            return 0
+
+        commands = [command for b in self.cfg.order if b in body
+                    for command in b.commands]
+        defined = {v for command in commands for v in command.outputs()}
+        writes = any(self._writes_memory(command) for command in commands)
+        calls = any(isinstance(command, control_cmds.Call)
+                    for command in commands)
+        exits = [b for b in body if any(s not in body for s in b.succs)]
+
+        uses = {}
+        for command in commands:
+            for v in command.inputs():
+                uses.setdefault(v, []).append(command)
+
+        limit = len(spots.registers) - self.reserved
+        pressure = self._max_pressure(body)
+
+        hoist = []
+        hoisted = set()
+        for b in self.cfg.order:
+            if b not in body:
+                continue
+            for command in b.commands:
+                if not self._is_invariant(command, defined, hoisted, writes):
+                    continue
+                if calls and not isinstance(command, self.expensive):
+                    continue
+                if (isinstance(command, self.guarded) and
+                        not all(self.cfg.dominates(b, e) for e in exits)):
+                    continue
+
+                # Values used only by hoisted commands no longer occupy a
+                # register in the loop.
+                held = {v for c in hoist + [command] for v in c.outputs()
+                        if any(u is not command and u not in hoist
+                               for u in uses.get(v, []))}
+                if pressure + len(held) > limit:
+                    continue
+
+                hoist.append(command)
+                hoisted.update(command.outputs())
+
+        if not hoist:
+            return 0
+
+        for b in body:
+            b.commands = [command for command in b.commands
+                          if command not in hoist]
+        pre = get_preheader(self.cfg, header, body)
+        jump = pre.jump()
+        i = len(pre.commands) - 1 if jump else len(pre.commands)
+        pre.commands[i:i] = hoist
+        return len(hoist)
+
+    def _is_invariant(self, command, defined, hoisted, writes):
+        """Return True iff the command may be hoisted out of its loop.
+
+        defined - Set of the values defined in the loop.
+        hoisted - Set of the values defined by hoisted commands.
+        writes - Whether the loop may write to memory.
+        """
+        if not isinstance(command, PURE) or isinstance(command, Phi):
+            return False
+        if any(v not in self.values for v in command.outputs()):
+            return False
+
+        # Constants and addresses of variables cost no more to load in the
+        # loop than to keep in a register.
+        if isinstance(command, value_cmds.AddrOf):
+            return False
+        if (isinstance(command, value_cmds.Set)
+              and self._is_literal(command.arg)):
+            return False
+        if isinstance(command, self.loads) and writes:
+            return False
+
+        for v in command.inputs():
+            if isinstance(command, value_cmds.AddrRel) and v is command.base:
+                continue
+            if self._is_literal(v):
+                continue
+            if v in self.values:
+                if v in defined and v not in hoisted:
+                    return False
+            elif writes:
+                return False
+        return True
+
+    def _writes_memory(self, command):
+        """Return True iff the command may change a value not in SSA form."""
+        return (isinstance(command, WRITES_MEMORY) or
+                any(v not in self.values for v in command.outputs() if v))
+
+    def _is_literal(self, v):
+        """Return True iff `v` is an integer literal IL value."""
+        return isinstance(getattr(v, "literal", None), IntegerLiteral)
+
+    def _max_pressure(self, body):
+        """Return the most values in SSA form live at once in the loop."""
+        live_in = {b: set() for b in self.cfg.order}
+        changed = True
+        while changed:
+            changed = False
+            for b in reversed(self.cfg.order):
+                live = self._live_out(b, live_in)
+                for command in reversed(b.commands):
+                    live.difference_update(command.outputs())
+                    if not isinstance(command, Phi):
+                        live.update(v for v in command.inputs()
+                                    if v in self.values)
+                if live != live_in[b]:
+                    live_in[b] = live
+                    changed = True
+
+        pressure = 0
+        for b in body:
+            live = self._live_out(b, live_in)
+            pressure = max(pressure, len(live))
+            for command in reversed(b.commands):
+                live.difference_update(command.outputs())
+                if not isinstance(command, Phi):
+                    live.update(v for v in command.inputs()
+                                if v in self.values)
+                pressure = max(pressure, len(live))
+        return pressure
+
+    def _live_out(self, b, live_in):
+        """Return the set of values live at the end of block b."""
+        live = set()
+        for s in b.succs:
+            live |= live_in[s]
+            for command in s.commands:
+                if (isinstance(command, Phi)
+                      and command.sources[b] in self.values):
+                    live.add(command.sources[b])
+        return live
@@ -0,0 +1,103 @@
+"""Driver for the IL optimization passes.
+
+The optimizer runs between IL generation and ASM generation. Inlining and
+loop unrolling run first, over the whole program, because both weigh the
+code they add against the ROM left. Then each function is converted into
+SSA form, rewritten by each enabled pass in turn, and converted back out of
+SSA form. Tail calls are marked last, so calls made tail calls by the other
+passes are found too.
+
+"""
+
+from opt.cfg import CFG
+from opt.gvn import ValueNumbering
+from opt.inline import Inliner
+from opt.ivopts import StrengthReduction
+from opt.licm import LoopInvariantMotion
+from opt.rotate import rotate_loops, fuse_down_counters
+from opt.unroll import unroll_loops
+from opt.ssa import ssa_values, to_ssa, from_ssa
+from opt.tailcall import remove_tail_recursion, mark_tail_calls
+from profiler import profiler
+
+
+def optimize(il_code, symbol_table, arguments):
+    """Run the optimization passes enabled by `arguments` on `il_code`."""
+    passes = []
+    if arguments.gvn:
+        passes.append(("gvn", _gvn))
+    if arguments.licm:
+        passes.append(("licm", _licm))
+    if arguments.ivopts:
+        passes.append(("ivopts", _ivopts))
+
+    if arguments.tail_calls:
+        with profiler.stage("tailcall"):
+            removed = remove_tail_recursion(il_code, symbol_table)
+            profiler.set_value("tail_recursion_removed", removed)
+
+    if arguments.inline_functions:
+        with profiler.stage("inline"):
+            inliner = Inliner(il_code, symbol_table, arguments.rom_size)
+            profiler.set_value("calls_inlined", inliner.run())
+
+    if arguments.unroll_loops:
+        with profiler.stage("unroll"):
+            unrolled = unroll_loops(il_code, symbol_table, arguments.rom_size)
+            profiler.set_value("loops_unrolled", unrolled)
+
+    if arguments.ssa or arguments.rotate_loops or passes:
+        for func, commands in il_code.commands.items():
+            _optimize_function(func, commands, il_code, symbol_table,
+                               arguments, passes)
+
+    if arguments.tail_calls:
+        for func, commands in il_code.commands.items():
+            with profiler.stage("tailcall", func):
+                marked = mark_tail_calls(commands, symbol_table)
+                profiler.set_value("tail_calls", marked)
+
+
+def _optimize_function(func, commands, il_code, symbol_table, arguments,
+                       passes):
+    """Run the enabled passes over one function in SSA form."""
+    cfg = CFG(commands)
+    if arguments.rotate_loops:
+        with profiler.stage("rotate", func):
+            rotated = rotate_loops(cfg)
+            profiler.set_value("loops_rotated", rotated)
+            commands = cfg.commands()
+
+    with profiler.stage("ssa", func):
+        values = to_ssa(cfg, ssa_values(commands, il_code, symbol_table))
+
+    for name, run in passes:
+        with profiler.stage(name, func):
+            run(cfg, values, il_code)
+
+    with profiler.stage("ssa", func):
+        from_ssa(cfg)
+
+    if arguments.rotate_loops:
+        with profiler.stage("rotate", func):
+            fuse_down_counters(cfg)
+
+    il_code.commands[func] = cfg.commands()
+
+
+def _gvn(cfg, values, il_code):
+    """Run global value numbering on a function in SSA form."""
+    eliminated = ValueNumbering(cfg, values).run()
+    profiler.set_value("gvn_eliminated", eliminated)
+
+
+def _licm(cfg, values, il_code):
+    """Hoist the loop-invariant commands of a function in SSA form."""
+    hoisted = LoopInvariantMotion(cfg, values).run()
+    profiler.set_value("licm_hoisted", hoisted)
+
+
+def _ivopts(cfg, values, il_code):
+    """Reduce the strength of the induction variables of a function."""
+    reduced = StrengthReduction(cfg, values, il_code).run()
+    profiler.set_value("ivopts_reduced", reduced)
@@ -0,0 +1,160 @@
+"""Loop rotation.
+
+This pass is enabled with `-frotate-loops`. The IL of a while or for loop
+tests its condition at the top, and ends each iteration with an
+unconditional jump back to the test, so every iteration runs two jumps. A
+rotated loop instead tests the condition once before entering the loop,
+and again at the bottom of each iteration with a single conditional jump
+back to the start of the body:
+
+    LABEL1:                          cond
+      cond                           JUMP Z LABEL3
+      JUMP Z LABEL3              LABEL4:
+      body              --->         body
+      JUMP LABEL1                    cond
+    LABEL3:                          JUMP NZ LABEL4
+                                 LABEL3:
+
+Rotation runs before a function is put into SSA form, where the condition
+can be copied without renaming its values. Once the function is out of SSA
+form, a bottom test which checks whether a counter decremented just before
+it reached zero is merged with the decrement, so the loop closes with
+SUB and JUMP NZ.
+
+"""
+
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+from asm_gen import ASMCode
+from il_gen import IntegerLiteral
+from opt.cfg import BasicBlock
+
+
+# Most commands in the condition of a loop which is rotated, because the
+# condition is copied to the bottom of the loop
+MAX_CONDITION = 8
+
+
+def rotate_loops(cfg):
+    """Rotate the loops of a function which is not in SSA form.
+
+    A loop is rotated if its header is a single block ending with a jump out
+    of the loop, and the loop has a single latch ending with a jump back to
+    the header. Returns the number of loops rotated.
+    """
+    rotated = 0
+    done = set()
+    while True:
+        loops = [loop for loop in cfg.loops() if loop[0] not in done]
+        if not loops:
+            return rotated
+
+        header, body = loops[0]
+        done.add(header)
+        if _rotate_loop(cfg, header, body):
+            rotated += 1
+            cfg.update()
+
+
+def _rotate_loop(cfg, header, body):
+    """Rotate one loop, and return True if it was rotated."""
+    exit_jump = header.jump()
+    if (not isinstance(exit_jump, (control_cmds.JumpZero,
+                                   control_cmds.JumpNotZero))
+          or not header.label()
+          or len(header.commands) - 2 > MAX_CONDITION):
+        return False
+
+    latches = [p for p in header.preds if p in body]
+    start = [s for s in header.succs if s in body]
+    if (len(latches) != 1 or len(start) != 1 or latches[0] is header
+          or not isinstance(latches[0].jump(), control_cmds.Jump)
+          or start[0].label() == exit_jump.label):
+        return False
+    latch, start = latches[0], start[0]
+    exit_label = exit_jump.label
+
+    if not start.label():
+        start.commands.insert(0, control_cmds.Label(ASMCode.get_label()))
+
+    if isinstance(exit_jump, control_cmds.JumpZero):
+        back = control_cmds.JumpNotZero(exit_jump.cond, start.label())
+    else:
+        back = control_cmds.JumpZero(exit_jump.cond, start.label())
+    latch.commands[-1:] = ([command.copy()
+                            for command in header.commands[1:-1]] + [back])
+
+    # The latch now falls through when the loop ends, so it must be
+    # followed by the block after the loop.
+    i = cfg.blocks.index(latch)
+    if (i + 1 == len(cfg.blocks)
+          or cfg.blocks[i + 1].label() != exit_label):
+        cfg.blocks.insert(i + 1, BasicBlock([control_cmds.Jump(exit_label)]))
+    return True
+
+
+def fuse_down_counters(cfg):
+    """Merge each zero test of a decremented counter with the decrement.
+
+    This looks for a block ending with
+
+        x = y - n
+        c = x != 0
+        JUMP NZ c
+
+    where `c` is used only by the jump, possibly with a copy of `x` into the
+    value tested, and replaces these commands with a SubtrJumpNotZero. The
+    function must not be in SSA form.
+    """
+    uses = {}
+    for b in cfg.blocks:
+        for command in b.commands:
+            for v in command.inputs():
+                uses[v] = uses.get(v, 0) + 1
+
+    for b in cfg.blocks:
+        commands = b.commands
+        if len(commands) < 3:
+            continue
+        jump, test = commands[-1], commands[-2]
+        if (not isinstance(jump, control_cmds.JumpNotZero)
+              or not _is_zero_test(test)
+              or test.output is not jump.cond or uses[test.output] != 1):
+            continue
+
+        output = diff = test.arg1
+        i = len(commands) - 3
+        copy = commands[i]
+        if (isinstance(copy, value_cmds.Set) and i > 0
+              and copy.output is output
+              and copy.output.ctype.weak_compat(copy.arg.ctype)
+              and uses[copy.arg] == 1):
+            diff = copy.arg
+            i -= 1
+
+        sub = commands[i]
+        if (not isinstance(sub, math_cmds.Subtr) or sub.output is not diff
+              or not _is_literal(sub.arg2)):
+            continue
+
+        b.commands[i:] = [control_cmds.SubtrJumpNotZero(
+            output, sub.arg1, sub.arg2, jump.label)]
+
+
+def _is_zero_test(command):
+    """Return True iff the command is true exactly when arg1 is not zero."""
+    if not isinstance(command, (compare_cmds.NotEqualCmp,
+                                compare_cmds.GreaterCmp)):
+        return False
+    if not _is_literal(command.arg2) or command.arg2.literal.val != 0:
+        return False
+    return (isinstance(command, compare_cmds.NotEqualCmp)
+            or (command.arg1.ctype.is_integral()
+                and not command.arg1.ctype.signed))
+
+
+def _is_literal(v):
+    """Return True iff `v` is an integer literal IL value."""
+    return isinstance(getattr(v, "literal", None), IntegerLiteral)
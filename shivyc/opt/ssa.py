@@ -0,0 +1,385 @@
+"""Construction and destruction of static single assignment form.
+
+In SSA form, every ILValue is the output of exactly one IL command, so the
+optimization passes can find the definition of each value directly rather
+than rediscovering reaching definitions. Where several definitions of a
+variable reach a join in the control flow, a Phi command at the start of
+the join block selects among them.
+
+SSA form is built with the algorithm of Cytron et al.: Phi commands are
+placed on the iterated dominance frontiers of the blocks which define each
+variable, and the uses are then renamed in a walk over the dominator tree.
+It is destroyed by replacing each Phi with a SET in every predecessor
+block. These SETs carry the relative spot preferences which let the
+register allocator coalesce the copies away, so converting a function into
+and back out of SSA form mostly just splits each variable into independent
+live ranges.
+
+"""
+
+import il_cmds.value as value_cmds
+from il_cmds.base import ILCommand
+from il_gen import ILValue
+
+
+class Phi(ILCommand):
+    """PHI - selects the value of a variable at a join in control flow.
+
+    output - IL value set by this command.
+    sources - Dictionary mapping each predecessor block of the block this
+    command is in to the IL value `output` takes when control arrives from
+    that predecessor.
+
+    Phi commands exist only while a function is in SSA form, and so are
+    never converted to ASM.
+    """
+
+    def __init__(self, output, sources):  # noqa D102
+        self.output = output
+        self.sources = sources
+
+    def inputs(self):  # noqa D102
+        return list(self.sources.values())
+
+    def outputs(self):  # noqa D102
+        return [self.output]
+
+    def rename(self, inputs, outputs):  # noqa D102
+        self.output = outputs.get(self.output, self.output)
+        self.sources = {b: inputs.get(v, v) for b, v in self.sources.items()}
+
+
+def ssa_values(commands, il_code, symbol_table):
+    """Return the set of variables of a function which may be renamed.
+
+    A variable may be renamed if it is an automatic variable or temporary
+    of scalar type whose address is never taken. Boolean variables are
+    excluded, because SETs to a boolean convert their argument and so could
+    not be used as plain copies on leaving SSA form.
+    """
+    referenced = set()
+    values = set()
+    for command in commands:
+        for refs in command.references().values():
+            referenced.update(refs)
+        values.update(command.inputs())
+        values.update(command.outputs())
+
+    automatic = symbol_table.AUTOMATIC
+    return {v for v in values
+            if v and v not in referenced
+            and v not in il_code.literals
+            and v not in il_code.string_literals
+            and symbol_table.storage.get(v, automatic) == automatic
+            and v.ctype.is_scalar() and not v.ctype.is_bool()}
+
+
+def to_ssa(cfg, values):
+    """Convert the function with the given CFG into SSA form.
+
+    values - Set of the variables to rename, from ssa_values.
+
+    Every definition of a variable in `values` outputs a new ILValue. A use
+    which no definition reaches keeps the original variable. Phi commands
+    are placed only for variables which are live into some block, and those
+    whose output is never used are removed afterwards.
+
+    Returns the set of the values in SSA form, which are the variables in
+    `values` and every new ILValue.
+    """
+    def_blocks = {v: set() for v in values}
+    exposed = set()
+    for b in cfg.order:
+        defined = set()
+        for command in b.commands:
+            exposed.update(v for v in command.inputs()
+                           if v in values and v not in defined)
+            for v in command.outputs():
+                if v in values:
+                    defined.add(v)
+                    def_blocks[v].add(b)
+
+    frontiers = cfg.frontiers()
+    phis = {}
+    for v in exposed:
+        work = list(def_blocks[v])
+        has_phi = set()
+        while work:
+            b = work.pop()
+            for f in frontiers[b]:
+                if f in has_phi:
+                    continue
+                has_phi.add(f)
+                work.append(f)
+
+                phi = Phi(v, {p: v for p in f.preds})
+                phis[phi] = v
+                f.commands.insert(1 if f.label() else 0, phi)
+
+    versions = _rename(cfg, values, phis)
+    _remove_dead_phis(cfg)
+    return values | versions
+
+
+def _rename(cfg, values, phis):
+    """Give each definition of the given values a new ILValue.
+
+    phis - Dictionary mapping each inserted Phi to its variable.
+
+    Returns the set of the new ILValues.
+    """
+    stacks = {v: [v] for v in values}
+    versions = set()
+    children = cfg.dom_children()
+
+    # The walk over the dominator tree is iterative, so deeply nested code
+    # does not hit the Python recursion limit. A None entry on the work list
+    # pops the versions pushed by the block before it.
+    work = [cfg.order[0]]
+    pushed = []
+    while work:
+        b = work.pop()
+        if b is None:
+            for v in pushed.pop():
+                stacks[v].pop()
+            continue
+
+        defined = []
+        for command in b.commands:
+            var = phis.get(command)
+            if var:
+                inputs = {}
+                outputs = {var: ILValue(var.ctype)}
+            else:
+                inputs = {v: stacks[v][-1]
+                          for v in command.inputs() if v in values}
+                outputs = {v: ILValue(v.ctype)
+                           for v in command.outputs() if v in values}
+            command.rename(inputs, outputs)
+
+            for v, new in outputs.items():
+                stacks[v].append(new)
+                versions.add(new)
+                defined.append(v)
+
+        for s in b.succs:
+            for command in s.commands:
+                var = phis.get(command)
+                if var:
+                    command.sources[b] = stacks[var][-1]
+
+        pushed.append(defined)
+        work.append(None)
+        work += reversed(children[b])
+
+    return versions
+
+
+def _remove_dead_phis(cfg):
+    """Remove the Phi commands whose outputs are never used.
+
+    A Phi is live if some other command uses its output, or if a live Phi
+    does.
+    """
+    phis = {}
+    used = set()
+    for b in cfg.order:
+        for command in b.commands:
+            if isinstance(command, Phi):
+                phis[command.output] = command
+            else:
+                used.update(command.inputs())
+
+    work = [v for v in used if v in phis]
+    while work:
+        for v in phis[work.pop()].inputs():
+            if v in phis and v not in used:
+                used.add(v)
+                work.append(v)
+
+    for b in cfg.order:
+        b.commands = [command for command in b.commands
+                      if not isinstance(command, Phi)
+                      or command.output in used]
+
+
+def split_edge(cfg, pred, succ):
+    """Insert an empty block on an edge of a function in SSA form.
+
+    The Phis of `succ` take the values they took from `pred` from the new
+    block instead. Returns the new block.
+    """
+    block = cfg.split_edge(pred, succ)
+    for command in succ.commands:
+        if isinstance(command, Phi):
+            command.sources[block] = command.sources.pop(pred)
+    cfg.update()
+    return block
+
+
+def get_preheader(cfg, header, body):
+    """Return the block which runs just before the loop with given header.
+
+    body - Set of the blocks in the loop.
+
+    If the only predecessor of the header outside the loop leads only to
+    the header, it is the preheader. Otherwise, an empty block is inserted
+    on its edge to the header. Returns None if the loop is entered from
+    several blocks.
+    """
+    entries = [p for p in header.preds if p not in body]
+    if len(entries) != 1:
+        return None
+    if entries[0].succs == [header]:
+        return entries[0]
+    return split_edge(cfg, entries[0], header)
+
+
+def from_ssa(cfg):
+    """Convert the function with the given CFG out of SSA form.
+
+    The outputs and sources of the Phis are first grouped into classes of
+    values which are never live at the same time, and each class is
+    renamed to a single variable; for a function which was not changed in
+    SSA form, this merges the versions of each variable which flow into
+    one another, while versions which do not stay separate. A Phi whose
+    values could not all join one class is instead replaced by a SET from
+    a new temporary at its position, and a SET to that temporary from the
+    matching source at the end of each predecessor. The register allocator
+    may still coalesce these SETs through their relative spot preferences.
+
+    The temporary of each Phi is live only from the end of a predecessor
+    to the start of the Phi's block, so the SETs to it are correct before
+    the branch ending a predecessor even if the edge is critical.
+    """
+    phis = [command for b in cfg.order for command in b.commands
+            if isinstance(command, Phi)]
+
+    # A literal cannot be renamed, so each literal source is first copied
+    # into a new value at the end of its predecessor.
+    for phi in phis:
+        for p, v in phi.sources.items():
+            if getattr(v, "literal", None):
+                temp = ILValue(v.ctype)
+                _insert_copy(p, value_cmds.Set(temp, v))
+                phi.sources[p] = temp
+
+    interfere = _get_interference(cfg, phis)
+
+    # Mapping from each value in a class to the set of values in its class
+    classes = {}
+    copied = set()
+    for phi in phis:
+        merged = set(classes.get(phi.output, {phi.output}))
+        for v in phi.sources.values():
+            merged |= classes.get(v, {v})
+
+        if any(interfere.get(v, set()) & merged for v in merged):
+            copied.add(phi)
+        else:
+            for v in merged:
+                classes[v] = merged
+
+    # Each class is renamed to the first of its values in the function
+    renames = {}
+    for b in cfg.order:
+        for command in b.commands:
+            for v in command.inputs() + command.outputs():
+                if v in classes and v not in renames:
+                    for member in classes[v]:
+                        renames[member] = v
+
+    for b in cfg.order:
+        for command in b.commands:
+            command.rename(renames, renames)
+
+    for b in cfg.order:
+        for i, command in enumerate(b.commands):
+            if command in copied:
+                temp = ILValue(command.output.ctype)
+                for p, v in command.sources.items():
+                    _insert_copy(p, value_cmds.Set(temp, v))
+                b.commands[i] = value_cmds.Set(command.output, temp)
+        b.commands = [command for command in b.commands
+                      if not isinstance(command, Phi)]
+
+
+def _insert_copy(b, copy):
+    """Insert a SET at the end of block b, before its jump."""
+    if b.jump():
+        b.commands.insert(len(b.commands) - 1, copy)
+    else:
+        b.commands.append(copy)
+
+
+def _get_interference(cfg, phis):
+    """Return the interference relation of the values used by Phis.
+
+    In SSA form, two values interfere exactly if one is live at the
+    definition of the other. Returns a dictionary mapping each value of a
+    Phi to the set of values of Phis it interferes with.
+    """
+    resources = set()
+    for phi in phis:
+        resources.add(phi.output)
+        resources.update(phi.sources.values())
+
+    outputs = {b: [command.output for command in b.commands
+                   if isinstance(command, Phi)] for b in cfg.order}
+    live_in = {b: set() for b in cfg.order}
+    live_out = {b: set() for b in cfg.order}
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(cfg.order):
+            live = set()
+            for s in b.succs:
+                for command in s.commands:
+                    if isinstance(command, Phi):
+                        live.add(command.sources[b])
+                live |= live_in[s]
+            live_out[b] = live
+
+            live = _live_after_phis(b, live, lambda d, live: None)
+            live.difference_update(outputs[b])
+            if live != live_in[b]:
+                live_in[b] = live
+                changed = True
+
+    interfere = {}
+
+    def add(d, live):
+        if d not in resources:
+            return
+        for w in live & resources:
+            if w is not d:
+                interfere.setdefault(d, set()).add(w)
+                interfere.setdefault(w, set()).add(d)
+
+    for b in cfg.order:
+        live = _live_after_phis(b, live_out[b], add)
+
+        # The Phis of a block all define their outputs at its start
+        live.update(outputs[b])
+        for d in outputs[b]:
+            add(d, live)
+
+    return interfere
+
+
+def _live_after_phis(b, live_out, on_def):
+    """Return the set of values live just after the Phis of block b.
+
+    live_out - Set of the values live at the end of the block.
+    on_def - Function called with each value defined by a command other
+    than a Phi, and the set of values live just after that command.
+    """
+    live = set(live_out)
+    for command in reversed(b.commands):
+        if isinstance(command, Phi):
+            break
+        for d in command.outputs():
+            on_def(d, live)
+        live.difference_update(command.outputs())
+        live.update(v for v in command.inputs() if v)
+    return live
@@ -0,0 +1,155 @@
+"""Tail calls.
+
+This pass is enabled with `-foptimize-sibling-calls`. A call whose value
+is returned right away, as in `return f(x);`, is a tail call. The caller
+has nothing left to do once the callee returns, so the caller may jump to
+the callee instead of calling it:
+
+    CALL f                   JUMP f
+    RETURN          --->
+
+The callee then returns straight to the caller's caller, which saves the
+CALL and RETURN and a level of the hardware call stack, so a chain of tail
+calls runs in constant stack depth.
+
+A tail call of a function to itself is first turned into a loop, which
+assigns the arguments to the parameters and jumps back to the start of
+the function, before any other pass runs. The remaining tail calls are
+marked after all other passes, since inlining and unrolling may create
+new ones, and Call.make_asm chooses whether to jump once the registers of
+the calling conventions are known.
+
+"""
+
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+from asm_gen import ASMCode
+from call_graph import CallGraph
+from il_gen import ILValue
+
+
+def remove_tail_recursion(il_code, symbol_table):
+    """Turn the tail calls of each function to itself into loops.
+
+    Returns the number of calls turned into loops.
+    """
+    removed = 0
+    graph = CallGraph(il_code, symbol_table)
+    for func, commands in il_code.commands.items():
+        calls = [call for call, callee in graph.calls[func]
+                 if callee == func
+                 and _get_return(call, commands, symbol_table)]
+        if not calls:
+            continue
+
+        params = {command.arg_num: command.output for command in commands
+                  if isinstance(command, value_cmds.LoadArg)}
+        if any(len(call.args) < len(params) for call in calls):
+            continue
+
+        # The loop starts right after the parameters are loaded.
+        start = ASMCode.get_label()
+        i = 0
+        while isinstance(commands[i], value_cmds.LoadArg):
+            i += 1
+        commands.insert(i, control_cmds.Label(start))
+
+        for call in calls:
+            i = commands.index(call)
+            commands[i:i + 1] = _assign_params(call, params) + [
+                control_cmds.Jump(start)]
+            removed += 1
+    return removed
+
+
+def mark_tail_calls(commands, symbol_table):
+    """Mark the tail calls in the given function.
+
+    Each call followed, possibly through labels, jumps, and a copy of its
+    value, by a return of its value is followed by a copy of that return
+    instead, and is marked as a tail call. Returns the number of calls
+    marked.
+    """
+    marked = 0
+    for command in list(commands):
+        if (not isinstance(command, control_cmds.Call)
+              or command not in commands):
+            continue
+
+        command.tail = None
+        ret = _get_return(command, commands, symbol_table)
+        if not ret:
+            continue
+
+        # The commands after the new return up to the next label are never
+        # run, so they are removed.
+        i = commands.index(command)
+        if commands[i + 1] is not ret:
+            ret = control_cmds.Return(command.ret if ret.arg else None)
+            end = i + 1
+            while end < len(commands) and not commands[end].label_name():
+                end += 1
+            commands[i + 1:end] = [ret]
+        command.tail = ret
+        marked += 1
+    return marked
+
+
+def _get_return(call, commands, symbol_table):
+    """Return the Return command which returns the value of the call.
+
+    This follows the commands run after the call through labels, jumps,
+    and copies of the value into automatic variables which do not change
+    its type. Returns None if some other command runs first.
+    """
+    labels = {command.label_name(): i for i, command in enumerate(commands)
+              if command.label_name()}
+
+    value = call.ret
+    i = commands.index(call) + 1
+    seen = set()
+    while i < len(commands) and i not in seen:
+        seen.add(i)
+        command = commands[i]
+        if isinstance(command, control_cmds.Label):
+            i += 1
+        elif isinstance(command, control_cmds.Jump):
+            i = labels[command.label]
+        elif (isinstance(command, value_cmds.Set) and command.arg is value
+              and not call.void_return
+              and command.output.ctype.weak_compat(value.ctype)
+              and symbol_table.storage.get(command.output,
+                                           symbol_table.AUTOMATIC)
+              == symbol_table.AUTOMATIC):
+            value = command.output
+            i += 1
+        elif isinstance(command, control_cmds.Return):
+            if not command.arg or command.arg is value:
+                return command
+            return None
+        else:
+            return None
+    return None
+
+
+def _assign_params(call, params):
+    """Return commands assigning the arguments of a call to the parameters.
+
+    params - Dictionary mapping each argument number to the value its
+    parameter is loaded into.
+
+    Every argument is read before any parameter is assigned, so arguments
+    which read other parameters are first copied into new values.
+    """
+    copies = []
+    sets = []
+    for num, param in sorted(params.items()):
+        arg = call.args[num]
+        if arg is param:
+            continue
+        if arg in params.values():
+            copy = ILValue(arg.ctype)
+            copies.append(value_cmds.Set(copy, arg))
+            arg = copy
+        sets.append(value_cmds.Set(param, arg))
+    return copies + sets
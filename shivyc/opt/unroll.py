@@ -0,0 +1,357 @@
+"""Loop unrolling within a program-wide ROM budget.
+
+This pass is enabled with `-funroll-loops`. Each iteration of a loop runs
+its exit test and a jump back to the test, which in a small loop such as
+one copying four bytes can take as long as the body. Unrolling copies the
+body so that fewer iterations are needed, but every copy takes space in
+the 1024-word program ROM, so the loops of the whole program compete for
+the ROM left over, set with `-mrom-size`.
+
+Only innermost loops with a known trip count are unrolled. A loop's trip
+count is known if it is tested at the top by comparing a counter to a
+literal, the counter is advanced by a literal once per iteration, and the
+value of the counter on entry is a literal assigned in the code leading to
+the loop. Such a loop is either unrolled fully, which removes the loop,
+or partially by a factor of 2, 4, or 8, which runs the remainder of the
+iterations before the loop and then tests once per group of iterations.
+Each choice is rated by the clock cycles it saves per word of ROM it
+costs, and choices are taken from the best down while they fit.
+
+Unrolling runs before the functions are put into SSA form, so the copies
+of a body need only fresh labels.
+
+"""
+
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+from asm_gen import ASMCode
+from il_gen import IntegerLiteral
+from opt.cfg import BasicBlock, CFG
+from opt.cost import CYCLES_PER_WORD, code_words, program_words
+from opt.ssa import ssa_values
+
+
+# Most iterations of a loop which is unrolled fully
+MAX_FULL = 16
+
+# Factors by which a loop may be unrolled partially
+FACTORS = (2, 4, 8)
+
+# Most iterations simulated when computing a trip count
+MAX_TRIP = 256
+
+# Functions evaluating each comparison
+_COMPARE = {
+    compare_cmds.LessCmp: lambda a, b: a < b,
+    compare_cmds.GreaterCmp: lambda a, b: a > b,
+    compare_cmds.LessOrEqCmp: lambda a, b: a <= b,
+    compare_cmds.GreaterOrEqCmp: lambda a, b: a >= b,
+    compare_cmds.EqualCmp: lambda a, b: a == b,
+    compare_cmds.NotEqualCmp: lambda a, b: a != b,
+}
+
+
+class _CountedLoop:
+    """An innermost loop with a known trip count.
+
+    func - Name of the function holding the loop.
+    cfg (CFG) - Control flow graph of the function.
+    header - The block testing whether to run another iteration.
+    region - List of the blocks from the header to the latch, in layout
+    order, not including the header. The latch is the last, and jumps back
+    to the header.
+    trips - Number of iterations the loop runs.
+    """
+
+    def __init__(self, func, cfg, header, region, trips):  # noqa D102
+        self.func = func
+        self.cfg = cfg
+        self.header = header
+        self.region = region
+        self.trips = trips
+
+    def options(self):
+        """Return the (saving, cost, factor) unrolling choices of the loop.
+
+        The saving is in clock cycles and the cost in words of ROM. A factor
+        of None unrolls the loop fully.
+        """
+        body = code_words(self._body())
+        overhead = code_words(self.header.commands) + 1
+
+        options = []
+        if self.trips <= MAX_FULL:
+            saving = (self.trips + 1) * overhead * CYCLES_PER_WORD
+            cost = (self.trips - 1) * body - overhead
+            options.append((saving, cost, None))
+
+        for factor in FACTORS:
+            if factor >= self.trips:
+                break
+            remainder = self.trips % factor
+            if remainder and not self._has_fallthrough_entry():
+                continue
+            tests = self.trips // factor
+            saving = (self.trips - tests) * overhead * CYCLES_PER_WORD
+            cost = (factor - 1 + remainder) * body
+            options.append((saving, cost, factor))
+        return options
+
+    def unroll(self, factor):
+        """Unroll the loop by the given factor, or fully if it is None."""
+        if not factor:
+            self.header.commands[1:] = []
+            self.region[0].commands = [
+                command for _ in range(self.trips)
+                for command in self._copy_body()]
+            for b in self.region[1:]:
+                b.commands = []
+            return
+
+        remainder = self.trips % factor
+        if remainder:
+            prologue = [command for _ in range(remainder)
+                        for command in self._copy_body()]
+            i = self.cfg.blocks.index(self.header)
+            self.cfg.blocks.insert(i, BasicBlock(prologue))
+
+        loop = [command for _ in range(factor - 1)
+                for command in self._copy_body()]
+        self.region[0].commands = loop + [
+            command for b in self.region for command in b.commands]
+        for b in self.region[1:]:
+            b.commands = []
+
+    def _body(self):
+        """Return the commands of one iteration after the exit test."""
+        return [command for b in self.region
+                for command in b.commands][:-1]
+
+    def _copy_body(self):
+        """Return a copy of one iteration, with new labels."""
+        labels = {command.label_name(): ASMCode.get_label()
+                  for command in self._body() if command.label_name()}
+
+        copies = []
+        for command in self._body():
+            copy = command.copy()
+            if copy.label_name() or copy.targets():
+                copy.label = labels.get(copy.label, copy.label)
+            copies.append(copy)
+        return copies
+
+    def _has_fallthrough_entry(self):
+        """Return True iff the loop is entered only from the block before it.
+
+        Commands placed between that block and the header then run exactly
+        once before the loop.
+        """
+        i = self.cfg.blocks.index(self.header)
+        entries = [p for p in self.header.preds if p not in self.region]
+        return (i > 0 and entries == [self.cfg.blocks[i - 1]]
+                and entries[0].falls_through())
+
+
+def unroll_loops(il_code, symbol_table, rom_size):
+    """Unroll the loops of a program with known trip counts.
+
+    rom_size - Number of words of program ROM available. Loops are only
+    unrolled as far as the estimated size of the program stays within it.
+
+    Returns the number of loops unrolled.
+    """
+    options = {}
+    for func, commands in il_code.commands.items():
+        cfg = CFG(commands)
+        values = ssa_values(commands, il_code, symbol_table)
+        for loop in _find_loops(func, cfg, values):
+            options[loop] = loop.options()
+
+    # Each step takes the change of a loop's choice which saves the most
+    # cycles per word it adds, so a loop unrolled by 2 may later be
+    # unrolled further while ROM remains.
+    spare = rom_size - program_words(il_code)
+    chosen = {loop: (0, 0, 1) for loop in options}
+    while True:
+        best = None
+        for loop, loop_options in options.items():
+            saved, spent, _ = chosen[loop]
+            for saving, cost, factor in loop_options:
+                if saving <= saved or cost - spent > spare:
+                    continue
+                rate = (saving - saved) / max(cost - spent, 1)
+                if not best or rate > best[0]:
+                    best = (rate, loop, (saving, cost, factor))
+        if not best:
+            break
+        _, loop, choice = best
+        spare -= choice[1] - chosen[loop][1]
+        chosen[loop] = choice
+
+    unrolled = 0
+    for loop, (_, _, factor) in chosen.items():
+        if factor != 1:
+            loop.unroll(factor)
+            unrolled += 1
+            il_code.commands[loop.func] = loop.cfg.commands()
+    return unrolled
+
+
+def _find_loops(func, cfg, values):
+    """Return the innermost loops of a function with known trip counts.
+
+    func - Name of the function.
+    values - Set of the variables which may be renamed, from ssa_values.
+    These are the variables which no command can change through a pointer.
+    """
+    uses = {}
+    for b in cfg.blocks:
+        for command in b.commands:
+            for v in command.inputs():
+                uses[v] = uses.get(v, 0) + 1
+
+    loops = []
+    all_loops = cfg.loops()
+    for header, body in all_loops:
+        if any(other is not header and other in body
+               for other, _ in all_loops):
+            continue
+
+        # The region runs from the header to the latch, and may also hold
+        # blocks which leave the loop, as a break does.
+        latches = [p for p in header.preds if p in body]
+        if len(latches) != 1:
+            continue
+        start = cfg.blocks.index(header) + 1
+        region = cfg.blocks[start:cfg.blocks.index(latches[0]) + 1]
+        if (not body - {header} <= set(region)
+              or any(p not in region and p is not header
+                     for b in region for p in b.preds)):
+            continue
+        trips = _get_trip_count(cfg, header, region, values, uses)
+        if trips is not None:
+            loops.append(_CountedLoop(func, cfg, header, region, trips))
+    return loops
+
+
+def _get_trip_count(cfg, header, region, values, uses):
+    """Return the number of iterations of a loop, or None if not known.
+
+    uses - Dictionary mapping each value to the number of commands in the
+    function which use it.
+    """
+    # The header must hold only the exit test.
+    if len(header.commands) != 3 or not header.label():
+        return None
+    test, jump = header.commands[1:]
+    if (not isinstance(jump, (control_cmds.JumpZero,
+                              control_cmds.JumpNotZero))
+          or type(test) not in _COMPARE or jump.cond is not test.output
+          or uses[test.output] != 1):
+        return None
+
+    latch = region[-1]
+    exit_block = cfg.blocks.index(latch) + 1
+    if (not isinstance(latch.jump(), control_cmds.Jump)
+          or latch.jump().label != header.label()
+          or exit_block == len(cfg.blocks)
+          or cfg.blocks[exit_block].label() != jump.label):
+        return None
+
+    if test.arg1 in values and _literal(test.arg2) is not None:
+        counter, bound = test.arg1, _literal(test.arg2)
+        compare = _COMPARE[type(test)]
+    elif test.arg2 in values and _literal(test.arg1) is not None:
+        counter, bound = test.arg2, _literal(test.arg1)
+        compare = lambda a, b, f=_COMPARE[type(test)]: f(b, a)
+    else:
+        return None
+
+    step = _get_step(counter, region)
+    start = _get_entry_value(counter, header, region)
+    if step is None or start is None or not counter.ctype.is_integral():
+        return None
+
+    # Comparisons are made unsigned in ASM, so the counter must stay within
+    # the nonnegative values its type holds.
+    limit = 1 << (8 * counter.ctype.size - counter.ctype.signed)
+    if not 0 <= bound < limit:
+        return None
+
+    # A JUMP NZ leaves the loop when the test holds.
+    leave = isinstance(jump, control_cmds.JumpNotZero)
+    trips = 0
+    while True:
+        value = start + trips * step
+        if not 0 <= value < limit or trips > MAX_TRIP:
+            return None
+        if compare(value, bound) == leave:
+            return trips
+        trips += 1
+
+
+def _get_step(counter, region):
+    """Return the amount the counter is advanced by in each iteration.
+
+    The counter must be set only once in the loop, in the latch, to its own
+    value plus or minus a literal. Returns None otherwise.
+    """
+    sets = [(b, i) for b in region for i, command in enumerate(b.commands)
+            if counter in command.outputs()]
+    if len(sets) != 1 or sets[0][0] is not region[-1]:
+        return None
+
+    latch, i = sets[0]
+    copy = latch.commands[i]
+    if not isinstance(copy, value_cmds.Set):
+        return None
+    for inc in reversed(latch.commands[:i]):
+        if copy.arg in inc.outputs():
+            break
+    else:
+        return None
+
+    if isinstance(inc, math_cmds.Add):
+        if inc.arg1 is counter and _literal(inc.arg2) is not None:
+            return _literal(inc.arg2)
+        if inc.arg2 is counter and _literal(inc.arg1) is not None:
+            return _literal(inc.arg1)
+    elif isinstance(inc, math_cmds.Subtr):
+        if inc.arg1 is counter and _literal(inc.arg2) is not None:
+            return -_literal(inc.arg2)
+    return None
+
+
+def _get_entry_value(counter, header, region):
+    """Return the literal value of the counter on entry to the loop.
+
+    This follows the blocks leading to the loop back while each has a single
+    predecessor, to the last command setting the counter. Returns None if
+    that is not a SET from a literal.
+    """
+    entries = [p for p in header.preds if p not in region]
+    if len(entries) != 1:
+        return None
+
+    b = entries[0]
+    seen = set()
+    while b not in seen:
+        seen.add(b)
+        for command in reversed(b.commands):
+            if counter in command.outputs():
+                if isinstance(command, value_cmds.Set):
+                    return _literal(command.arg)
+                return None
+        if len(b.preds) != 1:
+            return None
+        b = b.preds[0]
+    return None
+
+
+def _literal(v):
+    """Return the integer value of a literal IL value, or None."""
+    literal = getattr(v, "literal", None)
+    if isinstance(literal, IntegerLiteral):
+        return literal.val
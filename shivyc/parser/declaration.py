@@ -19,6 +19,30 @@ from parser.utils import (add_range, ParserError, match_token, token_is,
                                  raise_error, log_error, token_in)
 
 
+# Kinds of tokens that can only begin a declaration, never a statement
+_decl_start_kinds = (set(ctypes.simple_types.keys()) |
+                     {token_kinds.signed_kw, token_kinds.unsigned_kw,
+                      token_kinds.const_kw, token_kinds.auto_kw,
+                      token_kinds.static_kw, token_kinds.extern_kw,
+                      token_kinds.typedef_kw, token_kinds.struct_kw,
+                      token_kinds.union_kw, token_kinds.inline_kw,
+                      token_kinds.attribute_kw})
+
+
+def starts_declaration(index):
+    """Return True iff a declaration begins at the given token.
+
+    This is true if the token is a declaration specifier keyword or the
+    name of a typedef. Such a token can never begin a statement, so the
+    parser can choose between a statement and a declaration by looking at
+    this one token.
+    """
+    if token_in(index, _decl_start_kinds):
+        return True
+    return (token_is(index, token_kinds.identifier)
+            and p.symbols.is_typedef(p.tokens[index]))
+
+
 @add_range
 def parse_func_definition(index):
     """Parse a function definition.
@@ -165,6 +189,8 @@ def parse_decl_specifiers(index, _spec_qual=False):
     storage_specs = {token_kinds.auto_kw, token_kinds.static_kw,
                      token_kinds.extern_kw, token_kinds.typedef_kw}
 
+    func_specs = {token_kinds.inline_kw}
+
     specs = []
 
     # The type specifier class, either SIMPLE, STRUCT, or TYPEDEF,
@@ -218,6 +244,20 @@ def parse_decl_specifiers(index, _spec_qual=False):
                 error_collector.add(CompilerError(err, p.tokens[index].r))
             index += 1
 
+        elif token_in(index, func_specs):
+            if not _spec_qual:
+                specs.append(p.tokens[index])
+            else:
+                err = "function specifier not permitted here"
+                error_collector.add(CompilerError(err, p.tokens[index].r))
+            index += 1
+
+        # Attributes of struct members have no effect, so they are dropped.
+        elif token_is(index, token_kinds.attribute_kw):
+            node, index = parse_attribute_spec(index + 1)
+            if not _spec_qual:
+                specs.append(node)
+
         else:
             break
 
@@ -285,6 +325,30 @@ def parse_union_spec(index):
     return _parse_struct_union_spec(index, decl_nodes.Union)
 
 
+@add_range
+def parse_attribute_spec(index):
+    """Parse an attribute specifier as a decl_nodes.Attribute node.
+
+    index - index right past the `__attribute__` keyword
+    """
+    index = match_token(index, token_kinds.open_paren, ParserError.AFTER)
+    index = match_token(index, token_kinds.open_paren, ParserError.AFTER)
+
+    names = []
+    while True:
+        match_token(index, token_kinds.identifier, ParserError.GOT,
+                    "expected attribute name")
+        names.append(p.tokens[index])
+        index += 1
+        if not token_is(index, token_kinds.comma):
+            break
+        index += 1
+
+    index = match_token(index, token_kinds.close_paren, ParserError.GOT)
+    index = match_token(index, token_kinds.close_paren, ParserError.GOT)
+    return decl_nodes.Attribute(names), index
+
+
 def parse_struct_union_members(index):
     """Parse the list of members of struct or union as a list of Root nodes.
 
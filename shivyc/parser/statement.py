@@ -4,7 +4,7 @@ import token_kinds as token_kinds
 import tree.nodes as nodes
 import parser.utils as p
 
-from parser.declaration import parse_declaration
+from parser.declaration import parse_declaration, starts_declaration
 from parser.expression import parse_expression
 from parser.utils import (add_range, log_error, match_token, token_is,
                                  ParserError)
@@ -14,14 +14,14 @@ from parser.utils import (add_range, log_error, match_token, token_is,
 def parse_statement(index):
     """Parse a statement.
 
-    Try each possible type of statement, catching/logging exceptions upon
-    parse failures. On the last try, raise the exception on to the caller.
+    The kind of the first token determines which kind of statement to
+    parse, using the _statement_parsers table. If the first token does not
+    begin any other kind of statement, parse an expression statement.
 
     """
-    for func in (parse_compound_statement, parse_return, parse_break,
-                 parse_continue, parse_if_statement, parse_while_statement,
-                 parse_for_statement):
-        with log_error():
+    if index < len(p.tokens):
+        func = _statement_parsers.get(p.tokens[index].kind)
+        if func:
             return func(index)
 
     return parse_expr_statement(index)
@@ -39,12 +39,15 @@ def parse_compound_statement(index):
     index = match_token(index, token_kinds.open_brack, ParserError.GOT)
 
     # Read block items (statements/declarations) until there are no more.
+    # A block item that starts with a declaration specifier can only be a
+    # declaration, so we only try parsing a statement otherwise.
     items = []
     while True:
-        with log_error():
-            item, index = parse_statement(index)
-            items.append(item)
-            continue
+        if not starts_declaration(index):
+            with log_error():
+                item, index = parse_statement(index)
+                items.append(item)
+                continue
 
         with log_error():
             item, index = parse_declaration(index)
@@ -182,7 +185,7 @@ def _get_first_for_clause(index):
     if token_is(index, token_kinds.semicolon):
         return None, index + 1
 
-    with log_error():
+    if starts_declaration(index):
         return parse_declaration(index)
 
     clause, index = parse_expression(index)
@@ -203,3 +206,14 @@ def parse_expr_statement(index):
     node, index = parse_expression(index)
     index = match_token(index, token_kinds.semicolon, ParserError.AFTER)
     return nodes.ExprStatement(node), index
+
+
+# Mapping from the kind of the first token of a statement to the function
+# which parses that kind of statement
+_statement_parsers = {token_kinds.open_brack: parse_compound_statement,
+                      token_kinds.return_kw: parse_return,
+                      token_kinds.break_kw: parse_break,
+                      token_kinds.continue_kw: parse_continue,
+                      token_kinds.if_kw: parse_if_statement,
+                      token_kinds.while_kw: parse_while_statement,
+                      token_kinds.for_kw: parse_for_statement}
@@ -1,7 +1,6 @@
 """Utilities for the parser."""
 
 from contextlib import contextmanager
-import copy
 
 from errors import CompilerError, Range
 
@@ -20,19 +19,45 @@ class SimpleSymbolTable:
     whether a given identifier denotes a type or a value. For every
     declared identifier, the table records whether or not it is a type
     defnition.
+
+    Every change to the table is also recorded in an undo journal, so that
+    log_error() can roll back the changes made by a failed parse attempt
+    in time proportional to the number of changes, rather than copying the
+    whole table before every attempt.
     """
     def __init__(self):
         self.symbols = []
+        self.journal = []
         self.new_scope()
 
     def new_scope(self):
         self.symbols.append({})
+        self.journal.append((self._undo_new_scope,))
 
     def end_scope(self):
-        self.symbols.pop()
+        self.journal.append((self.symbols.append, self.symbols.pop()))
 
     def add_symbol(self, identifier, is_typedef):
-        self.symbols[-1][identifier.content] = is_typedef
+        name = identifier.content
+        table = self.symbols[-1]
+        if name in table:
+            self.journal.append((table.__setitem__, name, table[name]))
+        else:
+            self.journal.append((table.__delitem__, name))
+        table[name] = is_typedef
+
+    def mark(self):
+        """Return a marker of the current state, for use with rollback()."""
+        return len(self.journal)
+
+    def rollback(self, mark):
+        """Undo all changes made since mark() returned the given marker."""
+        while len(self.journal) > mark:
+            undo, *args = self.journal.pop()
+            undo(*args)
+
+    def _undo_new_scope(self):
+        self.symbols.pop()
 
     def is_typedef(self, identifier):
         name = identifier.content
@@ -139,16 +164,16 @@ def log_error():
     The value of e.amount_parsed is used to determine the amount
     successfully parsed before encountering the error.
     """
-    global best_error, symbols
+    global best_error
 
-    # back up the global symbols table, so if parsing fails we can reset it
-    symbols_bak = copy.deepcopy(symbols)
+    # mark the global symbols table, so if parsing fails we can reset it
+    mark = symbols.mark()
     try:
         yield
     except ParserError as e:
         if not best_error or e.amount_parsed >= best_error.amount_parsed:
             best_error = e
-        symbols = symbols_bak
+        symbols.rollback(mark)
 
 
 def token_is(index, kind):
@@ -0,0 +1,269 @@
+"""Objects used for profiling and tracing the compiler itself.
+
+The main executable enables the global profiler when one of the `-z-time-passes`
+or `-z-trace` flags is given. Compiler stages wrap their work in a
+`profiler.stage(...)` block, and the register allocator records per-function
+counters with `profiler.set_value(...)`. When the profiler is not enabled, these
+calls do nothing.
+
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from errors import error_collector, CompilerError
+
+
+class StageStats:
+    """Accumulated statistics for one named stage.
+
+    calls (int) - Number of times this stage was entered.
+    time (float) - Total wall time spent in this stage, in seconds.
+    alloc (int) - Total net bytes allocated by this stage.
+    peak (int) - Largest peak of bytes allocated during one call.
+    depth (int) - Nesting depth at which this stage was first entered, used
+    for indenting the report.
+    """
+
+    def __init__(self, depth):
+        """Initialize StageStats."""
+        self.calls = 0
+        self.time = 0.0
+        self.alloc = 0
+        self.peak = 0
+        self.depth = depth
+
+
+class _Frame:
+    """Bookkeeping for a stage that is currently running."""
+
+    def __init__(self, name, func, start, mem):
+        self.name = name
+        self.func = func
+        self.start = start
+        self.start_mem = mem
+        self.peak_mem = mem
+
+
+class Profiler:
+    """Class that accumulates timing, allocation and counter information.
+
+    We create a global instance of this class, like the error collector,
+    so that every stage of the compiler can report to it without the
+    profiler being passed around.
+
+    stages - Dictionary mapping stage name to StageStats, in the order the
+    stages were first entered.
+    functions - Dictionary mapping a function name to a dictionary of the
+    counters recorded while compiling that function. Counters recorded
+    outside any function, by passes over the whole program, are kept under
+    the name None.
+    """
+
+    def __init__(self):
+        """Initialize a disabled Profiler."""
+        self.enabled = False
+        self.track_memory = False
+        self.trace_events = None
+
+        self.stages = {}
+        self.functions = {}
+
+        self._stack = []
+        self._epoch = time.perf_counter()
+
+    def enable(self, time_passes=False, trace=False):
+        """Enable profiling.
+
+        time_passes (bool) - Collect statistics for the report, including
+        allocations. Allocation tracking uses tracemalloc, which slows
+        down the compiler noticeably.
+        trace (bool) - Collect Chrome trace events.
+        """
+        self.enabled = time_passes or trace
+        if trace:
+            self.trace_events = []
+        if time_passes:
+            self.track_memory = True
+            tracemalloc.start()
+
+    def clear(self):
+        """Forget all collected data and disable profiling."""
+        if self.track_memory:
+            tracemalloc.stop()
+        self.__init__()
+
+    def _memory(self):
+        """Return the (current, peak) traced memory, or zeros if untracked."""
+        if self.track_memory:
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextmanager
+    def stage(self, name, func=None):
+        """Time the enclosed block as a stage with the given name.
+
+        Stages may be nested. If `func` is given, the stage is attributed to
+        the C function with that name, and counters recorded with
+        set_value() inside the block are attributed to that function.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if not func and self._stack:
+            func = self._stack[-1].func
+
+        # Fold the peak so far into the running parent before resetting
+        # the peak for this stage.
+        if self.track_memory:
+            if self._stack:
+                parent = self._stack[-1]
+                parent.peak_mem = max(parent.peak_mem, self._memory()[1])
+            tracemalloc.reset_peak()
+
+        # Register the stage on entry, so the report lists stages in the
+        # order they started rather than the order they finished.
+        if name not in self.stages:
+            self.stages[name] = StageStats(len(self._stack))
+
+        frame = _Frame(name, func, time.perf_counter(), self._memory()[0])
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            current, peak = self._memory()
+            frame.peak_mem = max(frame.peak_mem, peak)
+            self._stack.pop()
+
+            if self._stack:
+                parent = self._stack[-1]
+                parent.peak_mem = max(parent.peak_mem, frame.peak_mem)
+
+            self._record(frame, end, current)
+
+    def _record(self, frame, end, current_mem):
+        """Record a finished stage."""
+        stats = self.stages[frame.name]
+        stats.calls += 1
+        stats.time += end - frame.start
+        stats.alloc += current_mem - frame.start_mem
+        stats.peak = max(stats.peak, frame.peak_mem - frame.start_mem)
+
+        if frame.func:
+            key = f"{frame.name}_time"
+            counters = self.functions.setdefault(frame.func, {})
+            counters[key] = counters.get(key, 0) + end - frame.start
+
+        if self.trace_events is not None:
+            args = {}
+            if frame.func:
+                args["function"] = frame.func
+            if self.track_memory:
+                args["alloc"] = current_mem - frame.start_mem
+                args["peak"] = frame.peak_mem - frame.start_mem
+
+            self.trace_events.append({
+                "name": frame.name,
+                "cat": "compiler",
+                "ph": "X",
+                "ts": (frame.start - self._epoch) * 1e6,
+                "dur": (end - frame.start) * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": args})
+
+    def set_value(self, counter, value):
+        """Set the given counter of the current function to `value`.
+
+        Outside any function, the counter is set for the whole program.
+        """
+        if not self.enabled or not self._stack:
+            return
+
+        self.functions.setdefault(self._stack[-1].func, {})[counter] = value
+
+    def report(self):
+        """Return the -z-time-passes report as a string."""
+        total = sum(s.time for s in self.stages.values() if s.depth == 0)
+
+        lines = ["Execution times (seconds)",
+                 f" {'stage':<24}{'calls':>7}{'wall':>10}{'%':>8}"
+                 f"{'alloc':>12}{'peak':>12}"]
+        for name, s in self.stages.items():
+            percent = 100 * s.time / total if total else 0
+            label = "  " * s.depth + name
+            lines.append(f" {label:<24}{s.calls:>7}{s.time:>10.4f}"
+                         f"{percent:>7.1f}%{_fmt_bytes(s.alloc):>12}"
+                         f"{_fmt_bytes(s.peak):>12}")
+        lines.append(f" {'TOTAL':<24}{'':>7}{total:>10.4f}")
+
+        program = self.functions.get(None)
+        if program:
+            lines.append("")
+            lines.append("Program statistics")
+            for name, value in program.items():
+                lines.append(f" {name:<24}{_fmt_value(value):>10}")
+
+        funcs = {f: c for f, c in self.functions.items() if f}
+        if funcs:
+            columns = []
+            for counters in funcs.values():
+                for name in counters:
+                    if name not in columns:
+                        columns.append(name)
+
+            width = max(len(f) for f in list(funcs) + ["function"]) + 2
+            widths = [max(len(c), 8) + 2 for c in columns]
+
+            lines.append("")
+            lines.append("Per-function statistics")
+            lines.append(f" {'function':<{width}}" +
+                         "".join(f"{c:>{w}}" for c, w in zip(columns, widths)))
+            for func, counters in funcs.items():
+                cells = "".join(f"{_fmt_value(counters.get(c, '')):>{w}}"
+                                for c, w in zip(columns, widths))
+                lines.append(f" {func:<{width}}{cells}")
+
+        return "\n".join(lines)
+
+    def show(self):  # pragma: no cover
+        """Print the -z-time-passes report to stderr."""
+        print(self.report(), file=sys.stderr)
+
+    def write_trace(self, filename):
+        """Save collected trace events in Chrome trace JSON format.
+
+        The file can be opened in chrome://tracing or in Perfetto.
+        """
+        try:
+            with open(filename, "w") as trace_file:
+                json.dump({"traceEvents": self.trace_events or [],
+                           "displayTimeUnit": "ms"}, trace_file)
+        except IOError:
+            descrip = f"could not write trace file '{filename}'"
+            error_collector.add(CompilerError(descrip))
+
+
+def _fmt_bytes(n):
+    """Format a byte count for the report."""
+    if abs(n) >= 1024 * 1024:
+        return f"{n / (1024 * 1024):.1f} MiB"
+    elif abs(n) >= 1024:
+        return f"{n / 1024:.1f} KiB"
+    return f"{n} B"
+
+
+def _fmt_value(v):
+    """Format a counter value for the report."""
+    if isinstance(v, float):
+        return f"{v:.4f}"
+    return str(v)
+
+
+profiler = Profiler()
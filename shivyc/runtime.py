@@ -0,0 +1,193 @@
+"""Runtime routines for the operations KCPSM3 has no instructions for.
+
+KCPSM3 can add, subtract, and shift by one bit, but cannot multiply or
+divide, so the ASM for such operations calls a routine instead. A routine
+is added to the end of the program the first time an IL command asks for
+it with ASMCode.add_routine, so a program only spends ROM on the routines
+it uses.
+
+Every value is held in one 8-bit register, so the routines take 8-bit
+operands. A routine takes its first operand in s0 and its second in s1,
+and returns its result in s0.
+"""
+
+import asm_cmds as asm_cmds
+import spots as spots
+from spots import HexLiteralSpot
+
+
+# Name of the multiply routine
+MULT_ROUTINE = "__mul8"
+
+# Names of the unsigned and signed divide routines
+UDIV_ROUTINE = "__udiv8"
+DIV_ROUTINE = "__div8"
+
+
+def mult_clobber():
+    """Return the registers clobbered by the multiply routine."""
+    return spots.registers[:3]
+
+
+def mult_cycles(multiplier):
+    """Return the clock cycles a call to the multiply routine takes.
+
+    multiplier - Value of the second operand, which the routine shifts
+    right until it is zero.
+    """
+    words = 4
+    for bit in range(max(multiplier.bit_length(), 1)):
+        words += 5
+        if multiplier >> bit & 1:
+            words += 1
+    return 2 * words
+
+
+def div_routine(signed):
+    """Return the name of the divide routine.
+
+    Each divide routine returns the quotient in s0 and the remainder in the
+    register given by div_remainder. Signed division rounds the quotient
+    toward zero, and the remainder has the sign of the dividend.
+    """
+    return DIV_ROUTINE if signed else UDIV_ROUTINE
+
+
+def div_remainder():
+    """Return the register of the remainder of a divide routine."""
+    return spots.S2
+
+
+def div_clobber(signed):
+    """Return the registers clobbered by the divide routine."""
+    return spots.registers[:4 + 2 * signed]
+
+
+def div_cycles(signed):
+    """Return the most clock cycles a call to a divide routine takes."""
+    words = 1 + 2 + 8 * 9 + 1
+    if signed:
+        words += 6 + 4 * 4
+    return 2 * words
+
+
+def routine_lines(name):
+    """Return the ASM lines of the runtime routine with the given name."""
+    if name == MULT_ROUTINE:
+        return _mult_lines()
+    if name == UDIV_ROUTINE:
+        return _udiv_lines()
+    if name == DIV_ROUTINE:
+        return _div_lines()
+    raise NotImplementedError(f"no runtime routine {name}")
+
+
+def routine_calls(name):
+    """Return the names of the routines the given routine calls."""
+    if name == DIV_ROUTINE:
+        return [UDIV_ROUTINE]
+    return []
+
+
+def _mult_lines():
+    """Return the lines of the shift-and-add multiply of 8-bit operands.
+
+    Each iteration shifts the multiplier right, adds the multiplicand to the
+    product if the bit shifted out is set, and shifts the multiplicand
+    left, until no set bit remains in the multiplier. The product is the low
+    8 bits of the full product, which is the same for signed and unsigned
+    operands.
+    """
+    a, b, p = spots.registers[:3]
+    loop = MULT_ROUTINE + "_loop"
+    skip = MULT_ROUTINE + "_skip"
+
+    return [asm_cmds.Label(MULT_ROUTINE),
+            asm_cmds.Load(p, HexLiteralSpot(0), 1),
+            asm_cmds.Label(loop),
+            asm_cmds.Sr0(b, None, 1, 1),
+            asm_cmds.JumpNC(skip),
+            asm_cmds.Add(p, a, 1),
+            asm_cmds.Label(skip),
+            asm_cmds.Sl0(a, None, 1, 1),
+            asm_cmds.Compare(b, HexLiteralSpot(0), 1),
+            asm_cmds.JumpNZ(loop),
+            asm_cmds.Load(a, p, 1),
+            asm_cmds.Return()]
+
+
+def _udiv_lines():
+    """Return the lines of the unsigned divide of 8-bit operands.
+
+    This is a restoring division. Each of the 8 iterations shifts the next
+    bit of the dividend into the partial remainder and the previous
+    quotient bit into the dividend. One COMPARE tests whether the divisor
+    fits in the partial remainder before subtracting it, so nothing is ever
+    restored, and a carry out of the shift means it always fits.
+    """
+    a, d, r, count = spots.registers[:4]
+    name = UDIV_ROUTINE
+    loop = name + "_loop"
+    sub = name + "_sub"
+    next_bit = name + "_next"
+
+    return [asm_cmds.Label(name),
+            asm_cmds.Load(r, HexLiteralSpot(0), 1),
+            asm_cmds.Load(count, HexLiteralSpot(8), 1),
+            asm_cmds.Label(loop),
+            asm_cmds.Sl0(a, None, 1, 1),
+            asm_cmds.Sla(r, None, 1, 1),
+            asm_cmds.JumpC(sub),
+            asm_cmds.Compare(r, d, 1),
+            asm_cmds.JumpC(next_bit),
+            asm_cmds.Label(sub),
+            asm_cmds.Sub(r, d, 1),
+            asm_cmds.Add(a, HexLiteralSpot(1), 1),
+            asm_cmds.Label(next_bit),
+            asm_cmds.Sub(count, HexLiteralSpot(1), 1),
+            asm_cmds.JumpNZ(loop),
+            asm_cmds.Return()]
+
+
+def _div_lines():
+    """Return the lines of the signed divide of 8-bit operands.
+
+    This divides the magnitudes of the operands with the unsigned routine,
+    then negates the quotient if the operands have different signs and the
+    remainder if the dividend is negative.
+    """
+    a, d, r, _, sign, quotient_sign = spots.registers[:6]
+    name = DIV_ROUTINE
+    divisor = name + "_divisor"
+    divide = name + "_divide"
+    remainder = name + "_remainder"
+    sign_bit = HexLiteralSpot(128)
+
+    lines = [asm_cmds.Label(name),
+             asm_cmds.Load(sign, a, 1),
+             asm_cmds.Load(quotient_sign, a, 1),
+             asm_cmds.Xor(quotient_sign, d, 1),
+             asm_cmds.Compare(a, sign_bit, 1),
+             asm_cmds.JumpC(divisor)]
+    lines += _negate_lines(a)
+    lines += [asm_cmds.Label(divisor),
+              asm_cmds.Compare(d, sign_bit, 1),
+              asm_cmds.JumpC(divide)]
+    lines += _negate_lines(d)
+    lines += [asm_cmds.Label(divide),
+              asm_cmds.CallLabel(UDIV_ROUTINE),
+              asm_cmds.Compare(quotient_sign, sign_bit, 1),
+              asm_cmds.JumpC(remainder)]
+    lines += _negate_lines(a)
+    lines += [asm_cmds.Label(remainder),
+              asm_cmds.Compare(sign, sign_bit, 1),
+              asm_cmds.ReturnC()]
+    lines += _negate_lines(r)
+    lines.append(asm_cmds.Return())
+    return lines
+
+
+def _negate_lines(reg):
+    """Return the lines negating the value in the given register."""
+    return [asm_cmds.Xor(reg, HexLiteralSpot(255), 1),
+            asm_cmds.Add(reg, HexLiteralSpot(1), 1)]
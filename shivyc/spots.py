@@ -1,7 +1,32 @@
-"""The Spot object definition and and some predefined spots, like registers."""
+"""The Spot object definition and and some predefined spots, like registers.
 
+Spots are flyweights. Constructing a spot of the same type with the same
+detail always returns the same object, so spots are compared and hashed by
+identity.
+"""
 
-class Spot:
+
+# Canonical spots, keyed by spot class and detail
+_spots = {}
+
+
+class _InternedSpot(type):
+    """Metaclass which returns the canonical instance of a spot.
+
+    Classes using this metaclass define a `spot_key` static method which
+    maps the constructor arguments, positional or keyword, to a key
+    identifying the detail of the spot.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        key = (cls, cls.spot_key(*args, **kwargs))
+        spot = _spots.get(key)
+        if spot is None:
+            spot = _spots[key] = super().__call__(*args, **kwargs)
+        return spot
+
+
+class Spot(metaclass=_InternedSpot):
     """Spot in the machine where an IL value can be.
 
     spot_type (enum) - One of the values below describing the general type of
@@ -11,14 +36,21 @@ class Spot:
 
     """
 
+    __slots__ = ("detail",)
+
     def __init__(self, detail):
         """Initialize a spot.
 
         `detail` should uniquely represent this Spot for this specific spot
-        type, because it will be used for hashing and equality testing.
+        type, because it is used to find the canonical spot.
         """
         self.detail = detail
 
+    @staticmethod
+    def spot_key(detail):
+        """Return the key of the spot built from these arguments."""
+        return detail
+
     def asm_str(self, size):
         """Make the ASM form of this spot, for the given size in bytes.
 
@@ -60,21 +92,12 @@ class Spot:
     def __repr__(self):  # pragma: no cover
         return self.detail
 
-    def __eq__(self, other):
-        """Test equality by comparing Spot type and detail."""
-        if self.__class__.__name__ != other.__class__.__name__:
-            return False
-
-        return self.detail == other.detail
-
-    def __hash__(self):
-        """Hash based on type and detail."""
-        return hash((self.__class__.__name__, self.detail))
-
 
 class RegSpot(Spot):
     """Spot representing a machine register."""
 
+    __slots__ = ("name",)
+
     reg_map = {"s0": "s0",
                "s1": "s1",
                "s2": "s2",
@@ -101,6 +124,10 @@ class RegSpot(Spot):
         super().__init__(name)
         self.name = name
 
+    @staticmethod
+    def spot_key(name):  # noqa D102
+        return name
+
     def asm_str(self, size):  # noqa D102
         return self.reg_map[self.name]
 
@@ -118,6 +145,8 @@ class MemSpot(Spot):
     #             4: "DWORD PTR ",
     #             8: "QWORD PTR "}
 
+    __slots__ = ("base", "offset", "chunk", "count")
+
     def __init__(self, base, offset=0, chunk=0, count=None):  # noqa D102
         super().__init__((base, offset, chunk, count))
 
@@ -126,6 +155,10 @@ class MemSpot(Spot):
         self.chunk = chunk
         self.count = count
 
+    @staticmethod
+    def spot_key(base, offset=0, chunk=0, count=None):  # noqa D102
+        return base, offset, chunk, count
+
     def asm_str(self, size):  # noqa D102
         if isinstance(self.base, Spot):
             base_str = self.base.asm_str(0)
@@ -171,6 +204,9 @@ class MemSpot(Spot):
         if count and self.count:
             raise NotImplementedError("cannot shift by count")
 
+        if not chunk and not count:
+            return self
+
         if count:
             new_offset = self.offset + self.chunk
             new_chunk = chunk
@@ -191,14 +227,56 @@ class LiteralSpot(Spot):
     this literal.
     """
 
+    __slots__ = ("value",)
+
     def __init__(self, value):
         super().__init__(value)
         self.value = value
 
+    @staticmethod
+    def spot_key(value):  # noqa D102
+        # Equal values of different types print differently, as True and 1
+        # or "0" and 0 do, so they are different spots.
+        return type(value), value
+
     def asm_str(self, size):  # noqa D102
         return str(self.value)
 
 
+class HexLiteralSpot(LiteralSpot):
+    """Spot representing a byte constant, written as two hex digits.
+
+    The KCPSM3 assembler reads constants in hexadecimal. The runtime
+    routines and the arithmetic lowered in their place use this spot for
+    the constants they make.
+    """
+
+    __slots__ = ()
+
+    def asm_str(self, size):  # noqa D102
+        return f"{self.value & 0xFF:02X}"
+
+
+class ScratchSpot(Spot):
+    """Spot representing a byte of the scratchpad memory.
+
+    address (int) - Address of the byte, from 0 to 63.
+    """
+
+    __slots__ = ("address",)
+
+    def __init__(self, address):  # noqa D102
+        super().__init__(address)
+        self.address = address
+
+    @staticmethod
+    def spot_key(address):  # noqa D102
+        return address
+
+    def asm_str(self, size):  # noqa D102
+        return f"{self.address:02X}"
+
+
 # RBX is callee-saved, which is still unsupported
 # RBX = RegSpot("s1")
 
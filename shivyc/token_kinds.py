@@ -30,6 +30,8 @@ union_kw = TokenKind("union", keyword_kinds)
 const_kw = TokenKind("const", keyword_kinds)
 typedef_kw = TokenKind("typedef", keyword_kinds)
 sizeof_kw = TokenKind("sizeof", keyword_kinds)
+inline_kw = TokenKind("inline", keyword_kinds)
+attribute_kw = TokenKind("__attribute__", keyword_kinds)
 
 plus = TokenKind("+", symbol_kinds)
 minus = TokenKind("-", symbol_kinds)
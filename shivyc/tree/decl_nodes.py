@@ -145,3 +145,16 @@ class Union(_StructUnion):
     def __init__(self, tag, members, r):
         self.kind = token_kinds.union_kw
         super().__init__(tag, members, r)
+
+
+class Attribute(DeclNode):
+    """Represents a GCC attribute specifier, like __attribute__((noinline)).
+
+    names (List(Token)) - identifier tokens naming each attribute
+    """
+
+    def __init__(self, names):
+        """Generate attribute node."""
+        self.kind = token_kinds.attribute_kw
+        self.names = names
+        super().__init__()
@@ -7,7 +7,7 @@ import token_kinds as token_kinds
 import tree.decl_nodes as decl_nodes
 from ctypes import (PointerCType, ArrayCType, FunctionCType,
                            StructCType, UnionCType)
-from errors import CompilerError
+from errors import CompilerError, error_collector
 from il_gen import ILValue
 from tree.utils import DirectLValue, report_err, set_type, check_cast
 
@@ -296,6 +296,8 @@ class DeclInfo:
     ctype - the ctype of this identifier
     storage - the storage class of this identifier
     init - the initial value of this identifier
+    inline - the inlining hint given for a function, one of "inline",
+    "always_inline", and "noinline", or None
     """
 
     # Storage class specifiers for declarations
@@ -305,7 +307,8 @@ class DeclInfo:
     TYPEDEF = 4
 
     def __init__(self, identifier, ctype, range,
-                 storage=None, init=None, body=None, param_names=None):
+                 storage=None, init=None, body=None, param_names=None,
+                 inline=None):
         self.identifier = identifier
         self.ctype = ctype
         self.range = range
@@ -313,6 +316,7 @@ class DeclInfo:
         self.init = init
         self.body = body
         self.param_names = param_names
+        self.inline = inline
 
     def process(self, il_code, symbol_table, c):
         """Process given DeclInfo object.
@@ -324,6 +328,10 @@ class DeclInfo:
             err = "missing identifier name in declaration"
             raise CompilerError(err, self.range)
 
+        if self.inline and not self.ctype.is_function():
+            err = "inline specified for non-function"
+            raise CompilerError(err, self.range)
+
         # The typedef is special
         if self.storage == self.TYPEDEF:
             self.process_typedef(symbol_table)
@@ -348,6 +356,8 @@ class DeclInfo:
             linkage,
             storage)
 
+        if self.inline:
+            il_code.inline_hints[self.identifier.content] = self.inline
         if self.init:
             self.do_init(var, storage, il_code, symbol_table, c)
         if self.body:
@@ -539,6 +549,7 @@ class Declaration(Node):
 
         any_dec = bool(node.decls)
         base_type, storage = self.make_specs_ctype(node.specs, any_dec)
+        inline = self.get_inline_hint(node.specs)
 
         out = []
         for decl, init in zip(node.decls, node.inits):
@@ -552,7 +563,7 @@ class Declaration(Node):
 
                 out.append(DeclInfo(
                     identifier, ctype, decl.r, storage, init,
-                    self.body, param_identifiers))
+                    self.body, param_identifiers, inline))
 
         return out
 
@@ -777,6 +788,27 @@ class Declaration(Node):
 
         return storage
 
+    def get_inline_hint(self, specs):
+        """Determine the inlining hint from given declaration specifiers.
+
+        Returns "always_inline" or "noinline" if given an attribute of that
+        name, "inline" if given the inline keyword, and None otherwise.
+        """
+        hint = None
+        for spec in specs:
+            if spec.kind == token_kinds.inline_kw and not hint:
+                hint = "inline"
+            elif spec.kind == token_kinds.attribute_kw:
+                for name in spec.names:
+                    if name.content in {"always_inline", "noinline"}:
+                        hint = name.content
+                    else:
+                        err = f"unrecognized attribute '{name.content}'"
+                        error_collector.add(
+                            CompilerError(err, name.r, True))
+
+        return hint
+
     def parse_struct_union_spec(self, node, redec):
         """Parse struct or union ctype from the given decl_nodes.Struct node.
 
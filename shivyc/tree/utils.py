@@ -197,7 +197,7 @@ class RelativeLValue(LValue):
         il_code.register_literal_var(scale, scale_factor)
 
         self.fixed_count = ILValue(ctypes.longint)
-        # il_code.add(math_cmds.Mult(self.fixed_count, resized_count, scale))
+        il_code.add(math_cmds.Mult(self.fixed_count, resized_count, scale))
 
     def ctype(self):
         return self._ctype
@@ -405,7 +405,7 @@ def get_size(ctype, num, il_code):
     total = ILValue(ctypes.longint)
     size = ILValue(ctypes.longint)
     il_code.register_literal_var(size, str(ctype.size))
-    # il_code.add(math_cmds.Mult(total, long_num, size))
+    il_code.add(math_cmds.Mult(total, long_num, size))
 
     return total
 
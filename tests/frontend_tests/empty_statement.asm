@@ -0,0 +1,19 @@
+	; KCPSM3 assemble code
+	ADDRESS 000
+main:
+LABEL1:
+	load s0, 0
+	compare s0, 0
+	jump z LABEL2
+	jump LABEL1
+LABEL2:
+LABEL3:
+	load s0, 0
+	compare s0, 0
+	jump z LABEL5
+LABEL4:
+	jump LABEL3
+LABEL5:
+	load s0, 0
+	return
+	; END
@@ -45,6 +45,26 @@ def compile_with_shivyc(test_file_names):
     class MockArguments:
         files = test_file_names
         show_reg_alloc_perf = False
+        reg_alloc_stats = None
+        regalloc = "graph"
+        regalloc_exact = False
+        regalloc_exact_max_nodes = 24
+        regalloc_exact_budget = 200
+        split_live_ranges = False
+        ssa = False
+        gvn = False
+        licm = False
+        ivopts = False
+        rotate_loops = False
+        tail_calls = False
+        inline_functions = False
+        unroll_loops = False
+        rom_size = 1024
+        ipa_ra = False
+        ipa_cc = False
+        whole_program = False
+        time_passes = False
+        trace_file = None
         variables_on_stack = False
 
     shivyc.main.get_arguments = lambda: MockArguments()
@@ -0,0 +1,907 @@
+"""Tests for the IL optimization passes.
+
+Each test compiles a small C function to IL, runs a pass over it, and
+checks the commands the pass leaves behind. Passes which change the
+commands are also checked by running the function before and after the
+pass with a small IL interpreter, which keeps every value in one 8-bit
+register as KCPSM3 does.
+"""
+
+import unittest
+
+import asm_cmds
+import il_cmds.compare as compare_cmds
+import il_cmds.control as control_cmds
+import il_cmds.math as math_cmds
+import il_cmds.value as value_cmds
+import lexer
+import main
+import preproc
+import spots
+from asm_gen import ASMCode, ASMGen
+from errors import error_collector
+from il_gen import ILCode, SymbolTable, Context
+from opt.cfg import CFG
+from opt.inline import STACK_DEPTH, Inliner
+from opt.optimizer import optimize
+from opt.unroll import _find_loops
+from opt.ssa import Phi, ssa_values, to_ssa, from_ssa
+from parser.parser import parse
+
+
+def compile_il(source):
+    """Return the ILCode and SymbolTable of the given C source."""
+    error_collector.clear()
+    tokens = preproc.process(lexer.tokenize(source, "test.c"), "test.c")
+    il_code = ILCode()
+    symbol_table = SymbolTable()
+    parse(tokens).make_il(il_code, symbol_table, Context())
+    if not error_collector.ok():
+        raise ValueError("test source does not compile")
+    return il_code, symbol_table
+
+
+def compile_opt(source, flags):
+    """Return the ILCode of the given C source after the given passes."""
+    il_code, symbol_table = compile_il(source)
+    optimize(il_code, symbol_table, main.get_arguments(["test.c"] + flags))
+    return il_code
+
+
+def compile_asm(source, flags):
+    """Return the ASM of the given C source compiled with the given flags."""
+    arguments = main.get_arguments(["test.c"] + flags)
+    il_code, symbol_table = compile_il(source)
+    optimize(il_code, symbol_table, arguments)
+    asm_code = ASMCode()
+    ASMGen(il_code, symbol_table, asm_code, arguments).make_asm()
+    return asm_code.full_code()
+
+
+def count(commands, cls):
+    """Return the number of the given commands of class `cls`."""
+    return sum(isinstance(command, cls) for command in commands)
+
+
+def round_trip(il_code, symbol_table, func):
+    """Convert `func` into SSA form and back, and return its commands."""
+    commands = il_code.commands[func]
+    cfg = CFG(commands)
+    to_ssa(cfg, ssa_values(commands, il_code, symbol_table))
+    from_ssa(cfg)
+    return cfg.commands()
+
+
+def run(commands, args, steps=10000):
+    """Run the given IL commands of a function and return its value.
+
+    Raises ValueError if the function runs for more than `steps` commands,
+    which is taken to mean it never returns.
+    """
+    labels = {command.label: i for i, command in enumerate(commands)
+              if isinstance(command, control_cmds.Label)}
+    values = {}
+
+    def get(v):
+        return v.literal.val if v.literal else values[v]
+
+    def put(v, value):
+        if v.ctype.is_bool():
+            value = int(value != 0)
+        value &= 0xFF
+        if v.ctype.signed and value >= 0x80:
+            value -= 0x100
+        values[v] = value
+
+    binary = {math_cmds.Add: lambda a, b: a + b,
+              math_cmds.Subtr: lambda a, b: a - b,
+              math_cmds.Mult: lambda a, b: a * b,
+              math_cmds.Div: lambda a, b: int(a / b),
+              math_cmds.Mod: lambda a, b: a - int(a / b) * b,
+              math_cmds.LBitShift: lambda a, b: a << b,
+              math_cmds.RBitShift: lambda a, b: a >> b,
+              compare_cmds.EqualCmp: lambda a, b: a == b,
+              compare_cmds.NotEqualCmp: lambda a, b: a != b,
+              compare_cmds.LessCmp: lambda a, b: a < b,
+              compare_cmds.GreaterCmp: lambda a, b: a > b,
+              compare_cmds.LessOrEqCmp: lambda a, b: a <= b,
+              compare_cmds.GreaterOrEqCmp: lambda a, b: a >= b}
+
+    i = 0
+    for _ in range(steps):
+        command = commands[i]
+        i += 1
+        if type(command) in binary:
+            put(command.output, binary[type(command)](
+                get(command.arg1), get(command.arg2)))
+        elif isinstance(command, value_cmds.LoadArg):
+            put(command.output, args[command.arg_num])
+        elif isinstance(command, value_cmds.Set):
+            put(command.output, get(command.arg))
+        elif isinstance(command, value_cmds.AddrOf):
+            # Addresses are only kept, for the calls left unused
+            values[command.output] = command.var
+        elif isinstance(command, math_cmds.Neg):
+            put(command.output, -get(command.arg))
+        elif isinstance(command, math_cmds.Not):
+            put(command.output, ~get(command.arg))
+        elif isinstance(command, control_cmds.Jump):
+            i = labels[command.label]
+        elif isinstance(command, control_cmds.JumpZero):
+            if not get(command.cond):
+                i = labels[command.label]
+        elif isinstance(command, control_cmds.JumpNotZero):
+            if get(command.cond):
+                i = labels[command.label]
+        elif isinstance(command, control_cmds.SubtrJumpNotZero):
+            put(command.output, get(command.arg1) - get(command.arg2))
+            if values[command.output]:
+                i = labels[command.label]
+        elif isinstance(command, control_cmds.Return):
+            return get(command.arg) if command.arg else None
+        elif not isinstance(command, control_cmds.Label):
+            raise NotImplementedError(type(command).__name__)
+
+    raise ValueError("function does not return")
+
+
+def literals(commands):
+    """Return the values of the integer literals the commands use."""
+    return {v.literal.val for command in commands for v in command.inputs()
+            if v.literal}
+
+
+def shape(commands):
+    """Return the classes of the given commands, with their jump targets."""
+    return [(type(command), command.label_name(), command.targets())
+            for command in commands]
+
+
+class SSATests(unittest.TestCase):
+    """Tests converting functions into SSA form and back."""
+
+    def check_round_trip(self, source, args_list):
+        """Check that `f` of `source` computes the same after a round trip.
+
+        Returns the commands before and after the round trip.
+        """
+        il_code, symbol_table = compile_il(source)
+        before = list(il_code.commands["f"])
+        expected = [run(before, args) for args in args_list]
+
+        after = round_trip(il_code, symbol_table, "f")
+        self.assertFalse(any(isinstance(c, Phi) for c in after))
+        self.assertEqual([run(after, args) for args in args_list], expected)
+        return before, after
+
+    def test_straight_line(self):
+        """A function with no joins gets back the same commands."""
+        source = """
+        int f(int a, int b) {
+          int x = a + b;
+          x = x * 3;
+          int y = x - a;
+          return y;
+        }"""
+        il_code, symbol_table = compile_il(source)
+        before = shape(il_code.commands["f"])
+
+        self.check_round_trip(source, [(1, 2), (-5, 7), (100, 27)])
+        il_code, symbol_table = compile_il(source)
+        after = shape(round_trip(il_code, symbol_table, "f"))
+        self.assertEqual(after, before)
+
+    def test_branch(self):
+        """A variable set on both sides of an if gets a copy on each side."""
+        source = """
+        int f(int a) {
+          int x;
+          if (a < 10) x = a + 1;
+          else x = a - 1;
+          return x;
+        }"""
+        before, after = self.check_round_trip(
+            source, [(0,), (9,), (10,), (-20,), (100,)])
+
+        # Only copies are added, and the control flow is unchanged
+        added = [c for c in after if c not in before]
+        self.assertTrue(all(isinstance(c, value_cmds.Set) for c in added))
+        self.assertEqual(shape([c for c in after if c in before]),
+                         shape(before))
+
+    def test_loop(self):
+        """Variables updated in a loop keep their values across iterations."""
+        source = """
+        int f(int n) {
+          int i, s = 0, t = 1;
+          for (i = 0; i < n; i++) {
+            s = s + t;
+            t = t + 2;
+          }
+          return s;
+        }"""
+        self.check_round_trip(source, [(0,), (1,), (5,), (10,)])
+
+    def test_swap(self):
+        """Variables swapped in a loop are copied in parallel."""
+        source = """
+        int f(int n) {
+          int a = 1, b = 2, t;
+          while (n) {
+            t = a;
+            a = b;
+            b = t;
+            n = n - 1;
+          }
+          return a * 10 + b;
+        }"""
+        self.check_round_trip(source, [(0,), (1,), (2,), (7,)])
+
+    def test_nested_loops(self):
+        """Values live around an inner loop survive the round trip."""
+        source = """
+        int f(int n) {
+          int i, j, s = 0;
+          for (i = 0; i < n; i++)
+            for (j = 0; j < i; j++)
+              s = s + i - j;
+          return s;
+        }"""
+        self.check_round_trip(source, [(0,), (1,), (4,), (6,)])
+
+    def test_label_at_entry(self):
+        """A function starting with a loop gets an empty entry block."""
+        source = """
+        int f() {
+          int i;
+          for (;;) {
+            i = 11;
+            while (i > 3) i = i - 2;
+            if (i != 10) break;
+          }
+          return i;
+        }"""
+        il_code, symbol_table = compile_il(source)
+        self.assertIsInstance(il_code.commands["f"][0], control_cmds.Label)
+        self.assertEqual(CFG(il_code.commands["f"]).blocks[0].preds, [])
+        self.check_round_trip(source, [()])
+
+
+class GVNTests(unittest.TestCase):
+    """Tests of global value numbering."""
+
+    def test_pointer_index(self):
+        """The address of p[i] is computed once for a read and a write."""
+        source = """
+        int f(int *p, int i) {
+          p[i] = p[i] + 1;
+          return 0;
+        }"""
+        commands = compile_il(source)[0].commands["f"]
+        self.assertEqual(count(commands, math_cmds.Mult), 2)
+
+        commands = compile_opt(source, ["-fgvn"]).commands["f"]
+        self.assertEqual(count(commands, math_cmds.Mult), 1)
+        read = next(c for c in commands if isinstance(c, value_cmds.ReadAt))
+        write = next(c for c in commands if isinstance(c, value_cmds.SetAt))
+        self.assertIs(read.addr, write.addr)
+
+    def test_array_index(self):
+        """buf[i] is read and written at the same index value."""
+        source = """
+        int f(int i) {
+          int buf[5];
+          buf[i] = buf[i] + 1;
+          return buf[0];
+        }"""
+        commands = compile_opt(source, ["-fgvn"]).commands["f"]
+        read = next(c for c in commands if isinstance(c, value_cmds.ReadRel))
+        write = next(c for c in commands if isinstance(c, value_cmds.SetRel))
+        self.assertIs(read.count, write.count)
+
+    def test_dominating_block(self):
+        """A result computed before an if is reused inside it."""
+        source = """
+        int f(int a, int b, int c) {
+          int x = a * b + c;
+          if (c) x = x + (a * b + c);
+          return x;
+        }"""
+        before = compile_il(source)[0].commands["f"]
+        after = compile_opt(source, ["-fgvn"]).commands["f"]
+        self.assertEqual(count(after, math_cmds.Mult), 1)
+        for args in [(2, 3, 0), (2, 3, 1), (-4, 5, 7)]:
+            self.assertEqual(run(after, args), run(before, args))
+
+    def test_sibling_blocks(self):
+        """A result computed in one branch is not used in the other."""
+        source = """
+        int f(int a, int b, int c) {
+          int x;
+          if (c) x = a * b;
+          else x = a * b + 1;
+          return x;
+        }"""
+        before = compile_il(source)[0].commands["f"]
+        after = compile_opt(source, ["-fgvn"]).commands["f"]
+        self.assertEqual(count(after, math_cmds.Mult), 2)
+        for args in [(2, 3, 0), (2, 3, 1)]:
+            self.assertEqual(run(after, args), run(before, args))
+
+    def test_store_between_loads(self):
+        """A load is repeated after a store which may change its value."""
+        source = """
+        int f(int *p, int *q) {
+          int x = *p;
+          *q = 1;
+          return x + *p;
+        }"""
+        commands = compile_opt(source, ["-fgvn"]).commands["f"]
+        self.assertEqual(count(commands, value_cmds.ReadAt), 2)
+
+    def test_loads_without_store(self):
+        """A load with no store since the last one is reused."""
+        source = """
+        int f(int *p) {
+          int x = *p;
+          return x + *p;
+        }"""
+        commands = compile_opt(source, ["-fgvn"]).commands["f"]
+        self.assertEqual(count(commands, value_cmds.ReadAt), 1)
+
+
+class PassTests(unittest.TestCase):
+    """Tests running the loop optimization passes on small loops."""
+
+    def check_same(self, source, flags, args_list):
+        """Check that `f` computes the same with and without the flags.
+
+        Returns the commands of `f` after the passes.
+        """
+        before = compile_il(source)[0].commands["f"]
+        after = compile_opt(source, flags).commands["f"]
+        for args in args_list:
+            self.assertEqual(run(after, args), run(before, args))
+        return after
+
+    def test_ssa(self):
+        """Loops compute the same after a round trip through SSA form."""
+        source = """
+        int f(int n) {
+          int i, s = 0;
+          for (i = 0; i < n; i++) {
+            if (i > 3) s = s + i;
+            else s = s - 1;
+          }
+          return s;
+        }"""
+        after = self.check_same(source, ["-fssa"], [(0,), (3,), (9,)])
+        self.assertFalse(any(isinstance(c, Phi) for c in after))
+
+    def test_licm(self):
+        """An invariant product is computed once, before the loop."""
+        source = """
+        int f(int n, int a, int b) {
+          int i, s = 0;
+          for (i = 0; i < n; i++) s = s + a * b;
+          return s;
+        }"""
+        after = self.check_same(
+            source, ["-flicm"], [(0, 2, 3), (1, 2, 3), (7, -3, 5)])
+        mult = next(i for i, c in enumerate(after)
+                    if isinstance(c, math_cmds.Mult))
+        label = next(i for i, c in enumerate(after)
+                     if isinstance(c, control_cmds.Label))
+        self.assertLess(mult, label)
+
+    def test_ivopts_counter_removed(self):
+        """The counter is replaced by the scaled value in the exit test."""
+        source = """
+        unsigned int f() {
+          unsigned int i, s = 0;
+          for (i = 0; i < 20; i++) s = s + i * 10;
+          return s;
+        }"""
+        after = self.check_same(source, ["-fivopts"], [()])
+        self.assertEqual(count(after, math_cmds.Mult), 0)
+
+        # Only the sum and the scaled counter are advanced
+        self.assertEqual(count(after, math_cmds.Add), 2)
+        test = next(c for c in after if isinstance(c, compare_cmds.LessCmp))
+        self.assertEqual(test.arg2.literal.val, 200)
+
+    def test_ivopts_rotated(self):
+        """The bound is adjusted when the test checks the next counter."""
+        source = """
+        unsigned int f() {
+          unsigned int i, s = 0;
+          for (i = 0; i < 20; i++) s = s + i * 6;
+          return s;
+        }"""
+        after = self.check_same(
+            source, ["-frotate-loops", "-fivopts"], [()])
+        self.assertEqual(count(after, math_cmds.Mult), 0)
+        self.assertTrue(literals(after) <= set(range(256)))
+
+    def test_ivopts_wraps(self):
+        """The exit test is kept when the scaled bound does not fit 8 bits.
+
+        Rewriting `i < 50` as `10 * i < 500` would never end the loop,
+        because the scaled counter wraps around before reaching 500.
+        """
+        source = """
+        int f() {
+          int i, s = 0;
+          for (i = 0; i < 50; i++) s = s + i * 10;
+          return s;
+        }"""
+        after = self.check_same(source, ["-fivopts"], [()])
+        self.assertEqual(count(after, math_cmds.Mult), 0)
+        self.assertTrue(literals(after) <= set(range(-128, 128)))
+        test = next(c for c in after if isinstance(c, compare_cmds.LessCmp))
+        self.assertEqual(test.arg2.literal.val, 50)
+
+        asm = compile_asm(source.replace("int f()", "int main()"),
+                          ["-fivopts"])
+        self.assertIn("compare", asm)
+        self.assertNotIn("500", asm)
+
+    def test_ivopts_variable_bound(self):
+        """The exit test is kept when the bound is not a literal."""
+        source = """
+        int f(int n) {
+          int i, s = 0;
+          for (i = 0; i < n; i++) s = s + i * 3;
+          return s;
+        }"""
+        after = self.check_same(
+            source, ["-fivopts"], [(0,), (1,), (10,), (42,), (127,)])
+        self.assertEqual(count(after, math_cmds.Mult), 0)
+        test = next(c for c in after if isinstance(c, compare_cmds.LessCmp))
+        self.assertIsNone(test.arg2.literal)
+
+
+class CallTests(unittest.TestCase):
+    """Tests moving the arguments of a call into their registers."""
+
+    def make_call(self, source, spotmap):
+        """Lower the call in `f` with the given spots for its inputs.
+
+        spotmap - Dictionary mapping the names of the inputs, in the order
+        of Call.inputs(), to their spots.
+
+        Returns the ASM lines of the call and the registers each input is
+        in right before the CALL, as a dictionary from register to name.
+        """
+        il_code = compile_il(source)[0]
+        call = next(c for c in il_code.commands["f"]
+                    if isinstance(c, control_cmds.Call))
+        names = list(spotmap)
+        spotmap = dict(zip(call.inputs(), spotmap.values()))
+
+        def get_reg(pref=None, conf=None):
+            return next(r for r in (pref or []) + spots.registers
+                        if r not in (conf or []))
+
+        asm_code = ASMCode()
+        call.make_asm(spotmap, spotmap, get_reg, asm_code)
+
+        regs = {spot.asm_str(1): name
+                for name, spot in zip(names, spotmap.values())}
+        for line in asm_code.lines:
+            if isinstance(line, asm_cmds.Load):
+                regs[line.dest] = regs.get(line.source)
+        return asm_code.lines, regs
+
+    def test_cycle_keeps_unmoved_argument(self):
+        """Breaking a cycle does not use a register holding an argument."""
+        source = """
+        void g(int a, int b, int c);
+        void f(int a, int b, int c) { g(b, a, c); }"""
+        lines, regs = self.make_call(
+            source, {"g": spots.S4, "b": spots.S1, "a": spots.S0,
+                     "c": spots.S2})
+        self.assertEqual(
+            [regs["s0"], regs["s1"], regs["s2"]], ["b", "a", "c"])
+
+    def test_function_pointer_keeps_argument(self):
+        """The function pointer is not moved onto an unmoved argument."""
+        source = """
+        void f(void (*g)(int), int a) { g(a); }"""
+        lines, regs = self.make_call(
+            source, {"g": spots.S0, "a": spots.S1})
+        self.assertEqual(regs["s0"], "a")
+        call = next(line for line in lines
+                    if isinstance(line, asm_cmds.Call))
+        self.assertEqual(regs[call.dest], "g")
+
+    def test_tail_call_jump(self):
+        """A tail call jumps when the return registers match."""
+        source = """
+        int g(int a);
+        int f(int a) { return g(a); }"""
+        il_code = compile_opt(source, ["-foptimize-sibling-calls"])
+        commands = il_code.commands["f"]
+        call = next(c for c in commands if isinstance(c, control_cmds.Call))
+        call.callee = "g"
+
+        for ret_reg, jumps in [(spots.S0, True), (spots.S1, False)]:
+            call.ret_reg = ret_reg
+            spotmap = {call.func: spots.S4, call.args[0]: spots.S0,
+                       call.ret: spots.S0}
+            asm_code = ASMCode()
+            for command in commands[commands.index(call):]:
+                command.make_asm(spotmap, spotmap, None, asm_code)
+
+            names = [type(line) for line in asm_code.lines]
+            if jumps:
+                self.assertEqual(names, [asm_cmds.Jump])
+            else:
+                self.assertEqual(names, [asm_cmds.CallLabel, asm_cmds.Load,
+                                         asm_cmds.Return])
+
+
+class TailCallTests(unittest.TestCase):
+    """Tests turning tail calls into jumps and loops."""
+
+    def remove_recursion(self, source):
+        """Return the commands of `f` after its tail calls become loops.
+
+        The address of `f` taken for the removed calls is left unused, and
+        is dropped so the interpreter can run the commands.
+        """
+        commands = compile_opt(
+            source, ["-foptimize-sibling-calls"]).commands["f"]
+        self.assertEqual(count(commands, control_cmds.Call), 0)
+
+        addrs = [c for c in commands if isinstance(c, value_cmds.AddrOf)]
+        used = {v for c in commands for v in c.inputs()}
+        self.assertFalse(any(c.output in used for c in addrs))
+        return [c for c in commands if c not in addrs]
+
+    def test_swapped_arguments(self):
+        """A self call with its arguments swapped becomes a loop."""
+        source = """
+        int f(int a, int b, int n) {
+          if (n == 0) return a * 10 + b;
+          return f(b, a, n - 1);
+        }"""
+        after = self.remove_recursion(source)
+        for n in range(5):
+            self.assertEqual(run(after, (1, 2, n)), 21 if n % 2 else 12)
+
+    def test_shuffled_arguments(self):
+        """Arguments computed from the parameters use their old values."""
+        source = """
+        int f(int a, int b, int n) {
+          if (n == 0) return a;
+          return f(b, a + b, n - 1);
+        }"""
+        after = self.remove_recursion(source)
+        a, b = 0, 1
+        for n in range(10):
+            self.assertEqual(run(after, (0, 1, n)), a)
+            a, b = b, a + b
+
+    def test_mutual_chain(self):
+        """Functions calling each other in tail position jump to each other.
+
+        The functions are recursive, so they keep the default calling
+        convention even with -fipa-cc, and return in the same register.
+        """
+        source = """
+        static int even(int n);
+        static int odd(int n) { if (n == 0) return 0; return even(n - 1); }
+        static int even(int n) { if (n == 0) return 1; return odd(n - 1); }
+        int main() { return odd(7); }"""
+        for flags in [[], ["-fipa-cc"]]:
+            lines = [line.strip() for line in compile_asm(
+                source, ["-foptimize-sibling-calls"] + flags).splitlines()]
+            for callee in ["even", "odd"]:
+                self.assertNotIn(f"call {callee}", lines)
+                i = lines.index(f"jump {callee}")
+                self.assertNotEqual(lines[i + 1], "return")
+
+    def test_return_register_differs(self):
+        """A tail call is kept a call when the callee returns elsewhere.
+
+        With -fipa-cc, h returns its value in s1, but main must return it
+        in s0, so the value is moved after the call.
+        """
+        source = """
+        static int h(int a, int b) { return a - b; }
+        int main() { int x = 3; int y = 4; return h(x, y); }"""
+        lines = [line.strip() for line in compile_asm(
+            source, ["-foptimize-sibling-calls"]).splitlines()]
+        self.assertIn("jump h", lines)
+
+        lines = [line.strip() for line in compile_asm(
+            source, ["-foptimize-sibling-calls", "-fipa-cc"]).splitlines()]
+        self.assertNotIn("jump h", lines)
+        i = lines.index("call h")
+        self.assertEqual(lines[i + 1:i + 3], ["load s0, s1", "return"])
+
+
+class InlineTests(unittest.TestCase):
+    """Tests of function inlining."""
+
+    def test_copy_body(self):
+        """A copy of the body gets its own locals and labels."""
+        source = """
+        int g(int a) {
+          static int calls;
+          int t = a;
+          calls = calls + 1;
+          if (t < 0) return -t;
+          while (t > 10) t = t - 10;
+          return t;
+        }
+        int f(int a) { return g(a) + g(a + 1); }"""
+        il_code, symbol_table = compile_il(source)
+        inliner = Inliner(il_code, symbol_table, 1024)
+        calls = [c for c in il_code.commands["f"]
+                 if isinstance(c, control_cmds.Call)]
+        bodies = [inliner._copy_body(call, "g") for call in calls]
+
+        callee = il_code.commands["g"]
+        callee_values = {v for c in callee for v in c.inputs() + c.outputs()}
+        callee_labels = {c.label_name() for c in callee} - {None}
+        static = {v for v in callee_values if symbol_table.storage.get(v)
+                  == symbol_table.STATIC}
+        self.assertEqual(len(static), 1)
+
+        labels = []
+        for call, body in zip(calls, bodies):
+            values = {v for c in body for v in c.inputs() + c.outputs()}
+            locals_kept = {v for v in callee_values - static
+                           if symbol_table.storage.get(v)
+                           == symbol_table.AUTOMATIC}
+            self.assertFalse(values & locals_kept)
+            self.assertLessEqual(static, values)
+
+            body_labels = [c.label_name() for c in body if c.label_name()]
+            self.assertFalse(set(body_labels) & callee_labels)
+            labels += body_labels
+
+            # Each return writes the output of the call and leaves the body
+            sets = [c for c in body if isinstance(c, value_cmds.Set)
+                    and c.output is call.ret]
+            self.assertEqual(len(sets), 2)
+            self.assertEqual(count(body, control_cmds.Return), 0)
+            end = body[-1].label_name()
+            self.assertEqual(
+                [c for c in body if end in c.targets()],
+                [body[body.index(sets[0]) + 1]])
+
+        self.assertEqual(len(labels), len(set(labels)))
+
+    def test_inlined_result(self):
+        """A function computes the same with its calls inlined."""
+        source = """
+        static inline int g(int a) {
+          if (a < 0) return -a;
+          while (a > 10) a = a - 10;
+          return a;
+        }
+        int f(int a) { return g(a) + g(a + 1) * 2; }"""
+        before = compile_il(source)[0].commands["g"]
+        after = compile_opt(source, ["-finline-functions"]).commands["f"]
+        self.assertEqual(count(after, control_cmds.Call), 0)
+
+        for a in [-20, -3, 0, 9, 10, 33, 100]:
+            expected = run(before, (a,)) + run(before, (a + 1,)) * 2
+            self.assertEqual(run(after, (a,)), expected)
+
+    def test_last_call_removes_function(self):
+        """The last call to a static function is inlined, and it is removed.
+
+        The body of g is too large to be inlined into two callers, but
+        removing the only copy pays for inlining it once.
+        """
+        body = "\n".join(f"  a = a * {i} + b;" for i in range(3, 12))
+        callee = f"static int g(int a, int b) {{\n{body}\n  return a;\n}}"
+        once = compile_opt(callee + "int f(int x) { return g(x, 1); }",
+                           ["-finline-functions"]).commands
+        self.assertNotIn("g", once)
+        self.assertEqual(count(once["f"], control_cmds.Call), 0)
+
+        twice = compile_opt(
+            callee + "int f(int x) { return g(x, 1) + g(x, 2); }",
+            ["-finline-functions", "-mrom-size=0"]).commands
+        self.assertIn("g", twice)
+        self.assertEqual(count(twice["f"], control_cmds.Call), 2)
+
+    def test_shorten_deepest_path(self):
+        """Calls are inlined until the deepest chain fits the call stack."""
+        depth = STACK_DEPTH + 4
+        source = "int f0(int x) { return x + 1; }\n" + "\n".join(
+            f"int f{i}(int x) {{ return f{i - 1}(x) * 3; }}"
+            for i in range(1, depth))
+        il_code, symbol_table = compile_il(source)
+        inliner = Inliner(il_code, symbol_table, 1024)
+        self.assertEqual(len(inliner._get_deepest_path()), depth - 1)
+
+        # The chain needs depth levels, with the call to its first function
+        inlined = inliner._shorten_deepest_path()
+        self.assertEqual(inlined, depth - STACK_DEPTH)
+        self.assertEqual(len(inliner._get_deepest_path()), STACK_DEPTH)
+
+
+class UnrollTests(unittest.TestCase):
+    """Tests of loop unrolling."""
+
+    def find_loops(self, source):
+        """Return the commands of `f` and its loops with known trip counts."""
+        il_code, symbol_table = compile_il(source)
+        commands = il_code.commands["f"]
+        cfg = CFG(commands)
+        values = ssa_values(commands, il_code, symbol_table)
+        return list(commands), _find_loops("f", cfg, values)
+
+    def trip_count(self, loop):
+        """Return the trip count of the loop in `f`, or None if unknown."""
+        source = f"""
+        int f() {{
+          {loop}
+          return s;
+        }}"""
+        loops = self.find_loops(source)[1]
+        return loops[0].trips if loops else None
+
+    def test_trip_count(self):
+        """The trip count is found by running the counter to the bound."""
+        self.assertEqual(self.trip_count(
+            "int i, s = 0; for (i = 0; i < 100; i++) s++;"), 100)
+        self.assertEqual(self.trip_count(
+            "int i, s = 0; for (i = 10; i > 0; i--) s++;"), 10)
+        self.assertEqual(self.trip_count(
+            "int i, s = 0; for (i = 3; i <= 30; i += 3) s++;"), 10)
+        self.assertEqual(self.trip_count(
+            "unsigned int i, s = 0; for (i = 0; i < 200; i++) s++;"), 200)
+        self.assertEqual(self.trip_count(
+            "int i, s = 0; for (i = 0; i < 0; i++) s++;"), 0)
+
+    def test_trip_count_limits(self):
+        """The trip count is unknown if the counter leaves its range.
+
+        Comparisons are made unsigned in ASM, so a signed counter must stay
+        nonnegative.
+        """
+        self.assertIsNone(self.trip_count(
+            "int i, s = 0; for (i = 5; i >= 0; i--) s++;"))
+        self.assertIsNone(self.trip_count(
+            "int i, s = 0;"
+            "for (i = 2147483640; i < 2147483647; i += 4) s++;"))
+        self.assertEqual(self.trip_count(
+            "unsigned int i; int s = 0;"
+            "for (i = 2147483640; i < 2147483647; i += 4) s++;"), 2)
+        self.assertIsNone(self.trip_count(
+            "unsigned int i; int s = 0;"
+            "for (i = 4294967290; i != 4; i += 2) s++;"))
+        self.assertIsNone(self.trip_count(
+            "int i, n = 5, s = 0; for (i = 0; i < n; i++) s++;"))
+
+    def test_full_unroll(self):
+        """A loop unrolled fully runs its body once per trip, untested."""
+        source = """
+        int f(int a) {
+          int i, s = 0;
+          for (i = 0; i < 4; i++) s = s + a * i;
+          return s;
+        }"""
+        before, loops = self.find_loops(source)
+        self.assertEqual(loops[0].trips, 4)
+        loops[0].unroll(None)
+        after = loops[0].cfg.commands()
+
+        self.assertEqual(count(after, math_cmds.Mult), 4)
+        self.assertEqual(count(after, compare_cmds.LessCmp), 0)
+        self.assertEqual(
+            count(after, control_cmds.Jump) + count(
+                after, control_cmds.JumpZero), 0)
+        for a in [0, 1, 7, -3]:
+            self.assertEqual(run(after, (a,)), run(before, (a,)))
+
+    def test_partial_unroll(self):
+        """A loop unrolled by 4 runs the remaining trips before it."""
+        source = """
+        int f(int a) {
+          int i, s = 0;
+          for (i = 0; i < 18; i++) s = s + a * i;
+          return s;
+        }"""
+        before, loops = self.find_loops(source)
+        self.assertEqual(loops[0].trips, 18)
+        header = loops[0].header.label()
+        loops[0].unroll(4)
+        after = loops[0].cfg.commands()
+
+        # Two trips before the loop, and four in each iteration of it
+        start = next(i for i, c in enumerate(after)
+                     if c.label_name() == header)
+        self.assertEqual(count(after[:start], math_cmds.Mult), 2)
+        self.assertEqual(count(after[start:], math_cmds.Mult), 4)
+        self.assertEqual(count(after, compare_cmds.LessCmp), 1)
+        self.assertIsInstance(after[start + 1], compare_cmds.LessCmp)
+        for a in [0, 1, 2, -3]:
+            self.assertEqual(run(after, (a,)), run(before, (a,)))
+
+    def test_unroll_within_rom(self):
+        """Loops are only unrolled while the program fits in the ROM."""
+        source = """
+        int f(int a) {
+          int i, s = 0;
+          for (i = 0; i < 4; i++) s = s + a * i;
+          return s;
+        }"""
+        commands = compile_opt(source, ["-funroll-loops"]).commands["f"]
+        self.assertEqual(count(commands, math_cmds.Mult), 4)
+
+        commands = compile_opt(
+            source, ["-funroll-loops", "-mrom-size=0"]).commands["f"]
+        self.assertEqual(count(commands, math_cmds.Mult), 1)
+
+
+class RotateTests(unittest.TestCase):
+    """Tests of loop rotation."""
+
+    def check_rotated(self, source, args_list):
+        """Check that `f` computes the same with its loop rotated.
+
+        Returns the commands of `f` after rotation, from the label of the
+        rotated body to the label after the loop.
+        """
+        before = compile_il(source)[0].commands["f"]
+        after = compile_opt(source, ["-frotate-loops"]).commands["f"]
+        for args in args_list:
+            self.assertEqual(run(after, args), run(before, args))
+
+        # The loop is entered through a guard testing the condition once,
+        # which jumps to the label after the loop.
+        self.assertEqual(count(after, control_cmds.Jump), 0)
+        guard = next(c for c in after
+                     if isinstance(c, control_cmds.JumpZero))
+        i = after.index(guard)
+        self.assertIsInstance(after[i + 1], control_cmds.Label)
+        end = next(j for j, c in enumerate(after)
+                   if c.label_name() == guard.label)
+        return after[i + 1:end + 1]
+
+    def test_down_counter(self):
+        """A loop counting down to zero closes with a SUB and JUMP NZ."""
+        source = """
+        int f(int n) {
+          int s = 0;
+          while (n != 0) {
+            s = s + 3;
+            n = n - 1;
+          }
+          return s;
+        }"""
+        loop = self.check_rotated(source, [(0,), (1,), (5,), (40,)])
+        back = loop[-2]
+        self.assertIsInstance(back, control_cmds.SubtrJumpNotZero)
+        self.assertEqual(back.label, loop[0].label_name())
+        self.assertEqual(count(loop, compare_cmds.NotEqualCmp), 0)
+
+        lines = [line.strip() for line in compile_asm(
+            source, ["-frotate-loops"]).splitlines()]
+        i = max(j for j, line in enumerate(lines)
+                if line.startswith("jump nz"))
+        self.assertTrue(lines[i - 1].startswith("sub "))
+
+    def test_up_counter(self):
+        """A loop counting up gets its test copied to the bottom."""
+        source = """
+        int f(int n) {
+          int i, s = 0;
+          for (i = 0; i < n; i++) s = s + i;
+          return s;
+        }"""
+        loop = self.check_rotated(source, [(0,), (1,), (5,), (12,)])
+        test, back = loop[-3:-1]
+        self.assertIsInstance(test, compare_cmds.LessCmp)
+        self.assertIsInstance(back, control_cmds.JumpNotZero)
+        self.assertIs(back.cond, test.output)
+        self.assertEqual(back.label, loop[0].label_name())
+        self.assertEqual(count(loop, control_cmds.SubtrJumpNotZero), 0)
@@ -0,0 +1,332 @@
+"""Tests for the register allocators and live range splitting.
+
+Each test compiles a small C function to IL and runs one stage of the ASM
+generator over it, or builds a conflict graph by hand, and checks the
+registers chosen or the commands added.
+"""
+
+import itertools
+import random
+import unittest
+
+import il_cmds.control as control_cmds
+import il_cmds.value as value_cmds
+import main
+import spots
+from alloc_stats import RegAllocStats
+from asm_gen import ASMCode, ASMGen, NodeGraph
+from exact_alloc import ExactAllocator
+from il_index import ILIndex
+from linear_scan import LinearScan
+from live_split import LiveRangeSplitter
+from opt.optimizer import optimize
+from spots import ScratchSpot
+
+from tests.test_opt import compile_il
+
+
+class LinearScanTests(unittest.TestCase):
+    """Tests of the linear scan register allocator."""
+
+    source = """
+    int f(int (*p)(int, int), int a, int b) {
+      int x = a + b, y = a - b, z = b - a;
+      int r = p(x, y);
+      return r + x + y + z;
+    }"""
+
+    def allocate(self, callee_clobber):
+        """Allocate registers for `f`, with the call clobbering the given.
+
+        Returns the index, live ranges, and spotmap of `f`.
+        """
+        arguments = main.get_arguments(["test.c", "-fregalloc=linear"])
+        il_code, symbol_table = compile_il(self.source)
+        gen = ASMGen(il_code, symbol_table, ASMCode(), arguments)
+        commands = il_code.commands["f"]
+        for command in commands:
+            if isinstance(command, control_cmds.Call):
+                command.callee_clobber = callee_clobber
+
+        index = ILIndex(commands)
+        free_values = gen._get_free_values(index, gen._get_global_spotmap())
+        live_vars = gen._get_live_vars(index, free_values, RegAllocStats("f"))
+        allocator = LinearScan(
+            index, free_values, live_vars, gen.alloc_registers)
+        spotmap, spilled = allocator.allocate(RegAllocStats("f"))
+        return index, live_vars, spotmap, spilled
+
+    def check_allocation(self, index, live_vars, spotmap):
+        """Check that the spotmap meets every register constraint."""
+        for in_live, out_live in live_vars:
+            for live in (in_live, out_live):
+                for v1, v2 in itertools.combinations(live, 2):
+                    if v1 in spotmap and v2 in spotmap:
+                        self.assertIsNot(spotmap[v1], spotmap[v2])
+
+        for i, (in_live, out_live) in enumerate(live_vars):
+            for v in set(in_live) & set(out_live):
+                if v in spotmap:
+                    self.assertNotIn(spotmap[v], index.clobber[i])
+            for v, confs in index.abs_spot_conf[i].items():
+                if v in spotmap:
+                    self.assertNotIn(spotmap[v], confs)
+
+    def test_call_clobbering_some(self):
+        """Values live across a call avoid the registers it clobbers."""
+        clobber = [spots.S0, spots.S1, spots.S2, spots.S3]
+        index, live_vars, spotmap, spilled = self.allocate(clobber)
+        self.assertEqual(spilled, [])
+        self.check_allocation(index, live_vars, spotmap)
+
+        # The function pointer is a parameter passed in s0, but conflicts
+        # with the registers the arguments are passed in.
+        call = next(c for c in index.commands
+                    if isinstance(c, control_cmds.Call))
+        self.assertNotIn(spotmap[call.func], [spots.S0, spots.S1])
+
+    def test_call_clobbering_all(self):
+        """Values live across a call clobbering every register are spilled."""
+        index, live_vars, spotmap, spilled = self.allocate(None)
+        self.assertEqual(len(spilled), 3)
+        self.check_allocation(index, live_vars, spotmap)
+
+    def test_compile(self):
+        """A whole program compiles with the linear scan allocator."""
+        source = """
+        int g(int a, int b) { return a * b + a; }
+        int main() {
+          int i, s = 0;
+          for (i = 0; i < 5; i++) s = s + g(i, s);
+          return s;
+        }"""
+        arguments = main.get_arguments(
+            ["test.c", "-fregalloc=linear", "-fipa-ra"])
+        il_code, symbol_table = compile_il(source)
+        asm_code = ASMCode()
+        ASMGen(il_code, symbol_table, asm_code, arguments).make_asm()
+        self.assertIn("call g", asm_code.full_code())
+
+
+class ExactAllocatorTests(unittest.TestCase):
+    """Tests of the branch and bound register allocator."""
+
+    registers = [spots.S0, spots.S1, spots.S2]
+
+    def heuristic(self, g):
+        """Return the coloring of `g` by the graph coloring allocator."""
+        gen = ASMGen(None, None, None, None)
+        gen.alloc_registers = gen.all_registers = self.registers
+        return gen._color(g, set(), RegAllocStats("f"))
+
+    def random_graph(self, rand):
+        """Return a random graph with preferences and precolored nodes."""
+        nodes = [f"n{i}" for i in range(rand.randint(3, 8))]
+        g = NodeGraph(nodes)
+        for reg in self.registers:
+            g.add_dummy_node(reg)
+
+        for n1, n2 in itertools.combinations(nodes, 2):
+            r = rand.random()
+            if r < 0.4:
+                g.add_conflict(n1, n2)
+            elif r < 0.6:
+                g.add_pref(n1, n2)
+        for n in nodes:
+            reg = rand.choice(self.registers)
+            r = rand.random()
+            if r < 0.2:
+                g.add_conflict(n, reg)
+            elif r < 0.4:
+                g.add_pref(n, reg)
+        return g
+
+    def check_coloring(self, g, spotmap):
+        """Check that no conflicting nodes share a register."""
+        for n in g.nodes():
+            for m in g.confs(n):
+                if n in spotmap and spotmap.get(m):
+                    self.assertIsNot(spotmap[n], spotmap[m])
+
+    def test_matches_or_beats_heuristic(self):
+        """The exact coloring costs no more than the heuristic one."""
+        rand = random.Random(1)
+        better = 0
+        for _ in range(200):
+            g = self.random_graph(rand)
+            spotmap, spilled = self.heuristic(g)
+            allocator = ExactAllocator(g, self.registers)
+            exact, exact_spilled = allocator.allocate(spotmap, 10)
+
+            self.check_coloring(g, exact)
+            self.assertEqual(set(exact_spilled),
+                             {n for n in g.nodes() if n not in exact})
+            self.assertLessEqual(allocator.cost(exact),
+                                 allocator.cost(spotmap))
+            better += allocator.cost(exact) < allocator.cost(spotmap)
+        self.assertGreater(better, 0)
+
+    def test_odd_cycle(self):
+        """A cycle of five nodes is colored with three registers."""
+        nodes = [f"n{i}" for i in range(5)]
+        g = NodeGraph(nodes)
+        for i in range(5):
+            g.add_conflict(nodes[i], nodes[(i + 1) % 5])
+
+        allocator = ExactAllocator(g, self.registers[:2])
+        spotmap, spilled = allocator.allocate({}, 10)
+        self.assertEqual(len(spilled), 1)
+
+        allocator = ExactAllocator(g, self.registers)
+        spotmap, spilled = allocator.allocate({}, 10)
+        self.assertEqual(spilled, [])
+        self.check_coloring(g, spotmap)
+
+    def test_remat_spilled_first(self):
+        """A rematerializable node is spilled rather than another node.
+
+        Spilling `a` also leaves its preference for `c` unsatisfied, which
+        costs less than spilling `b` only if `a` is rematerializable.
+        """
+        g = NodeGraph(["a", "b", "c"])
+        g.add_conflict("a", "b")
+        g.add_pref("a", "c")
+        allocator = ExactAllocator(g, self.registers[:1], remat={"a"})
+        spotmap, spilled = allocator.allocate({}, 10)
+        self.assertEqual(spilled, ["a"])
+
+    def test_out_of_time(self):
+        """The search returns None once its budget is spent."""
+        g = NodeGraph(["a", "b", "c"])
+        for n1, n2 in itertools.combinations("abc", 2):
+            g.add_conflict(n1, n2)
+        allocator = ExactAllocator(g, self.registers[:2])
+        self.assertIsNone(allocator.allocate({}, -1))
+
+
+def prepare(source, flags=()):
+    """Return the inputs of register allocation for `f` of the source.
+
+    Returns the ASMGen, the ILIndex of `f`, its free values and their live
+    ranges.
+    """
+    arguments = main.get_arguments(["test.c"] + list(flags))
+    il_code, symbol_table = compile_il(source)
+    optimize(il_code, symbol_table, arguments)
+    gen = ASMGen(il_code, symbol_table, ASMCode(), arguments)
+
+    index = ILIndex(il_code.commands["f"])
+    free_values = gen._get_free_values(index, gen._get_global_spotmap())
+    live_vars = gen._get_live_vars(index, free_values, RegAllocStats("f"))
+    return gen, index, free_values, live_vars
+
+
+def count_split(commands):
+    """Return the number of stores and fetches among the commands."""
+    return sum(isinstance(c, (value_cmds.Store, value_cmds.Fetch))
+               for c in commands)
+
+
+class LiveSplitTests(unittest.TestCase):
+    """Tests of live range splitting around calls and loops."""
+
+    def split(self, source, flags=()):
+        """Split the live ranges of `f` and return its new commands.
+
+        Every call may be split around, and the scratchpad has room for
+        every value.
+        """
+        gen, index, free_values, live_vars = prepare(source, flags)
+        splitter = LiveRangeSplitter(
+            index, free_values, live_vars, gen.alloc_registers)
+        split_calls = {c for c in index.commands
+                       if isinstance(c, control_cmds.Call)}
+        slots = iter(range(64))
+        commands, _ = splitter.split(
+            split_calls, {}, lambda: ScratchSpot(next(slots)))
+        return commands
+
+    def split_values(self, commands, i):
+        """Return the values stored before or fetched after command `i`."""
+        stored = []
+        j = i - 1
+        while isinstance(commands[j], value_cmds.Store):
+            stored.append(commands[j].arg)
+            j -= 1
+        fetched = []
+        j = i + 1
+        while isinstance(commands[j], value_cmds.Fetch):
+            fetched.append(commands[j].output)
+            j += 1
+        return stored, fetched
+
+    def test_around_call(self):
+        """A value live across a call is stored before it, fetched after."""
+        source = """
+        int g(int a);
+        int f(int a, int b) {
+          int x = a + b;
+          int r = g(a);
+          return r + x;
+        }"""
+        after = self.split(source)
+        call = next(c for c in after if isinstance(c, control_cmds.Call))
+        stored, fetched = self.split_values(after, after.index(call))
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(stored, fetched)
+        self.assertNotIn(call.ret, stored)
+        self.assertEqual(count_split(after), 2)
+
+    def test_around_loop(self):
+        """A value unused in a loop with a call is split around the loop.
+
+        It is stored before the header label, fetched after the exit label,
+        and not split again around the call inside the loop.
+        """
+        source = """
+        void g(int a);
+        int f(int a, int n) {
+          int x = a * 3;
+          int i;
+          for (i = 0; i < n; i++) g(i);
+          return x;
+        }"""
+        after = self.split(source)
+        labels = [i for i, c in enumerate(after)
+                  if isinstance(c, control_cmds.Label)]
+        header, exit_label = labels[0], labels[-1]
+
+        stored = after[header - 1]
+        self.assertIsInstance(stored, value_cmds.Store)
+        fetched = after[exit_label + 1]
+        self.assertIsInstance(fetched, value_cmds.Fetch)
+        self.assertIs(fetched.output, stored.arg)
+        self.assertIs(fetched.slot, stored.slot)
+
+        call = next(c for c in after if isinstance(c, control_cmds.Call))
+        around_call = self.split_values(after, after.index(call))
+        self.assertNotIn(stored.arg, around_call[0] + around_call[1])
+
+    def test_loop_exit_reached_from_outside(self):
+        """A loop is not split if its exit is reached from outside it.
+
+        The guard of a rotated loop jumps straight to the exit label, where
+        a fetch would read a slot never stored.
+        """
+        source = """
+        void g(int a);
+        int f(int a, int n) {
+          int x = a * 3;
+          int i;
+          for (i = 0; i < n; i++) g(i);
+          return x;
+        }"""
+        after = self.split(source, ["-frotate-loops"])
+        call = next(c for c in after if isinstance(c, control_cmds.Call))
+        i = after.index(call)
+
+        # Every store and fetch is next to the call
+        stored, fetched = self.split_values(after, i)
+        self.assertEqual(count_split(after), len(stored) + len(fetched))
+        self.assertTrue(stored)
+
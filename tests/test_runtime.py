@@ -0,0 +1,327 @@
+"""Tests for the runtime routines and the arithmetic lowered without them.
+
+The routines are run on a small simulator of the KCPSM3 instructions they
+use, which reads the ASM lines as they would be written to the output
+file, with constants in hexadecimal.
+"""
+
+import unittest
+
+import asm_cmds
+import ctypes
+import il_cmds.math as math_cmds
+import runtime
+import spots
+from asm_gen import ASMCode
+from il_cmds.math import (_get_chain, _get_div_plan, _get_mult_steps,
+                          _get_reciprocal)
+from il_gen import ILValue, IntegerLiteral
+
+
+def simulate(lines, entry, regs):
+    """Run the routine at label `entry` of the given ASM lines.
+
+    regs - Dictionary mapping register names to their initial values.
+
+    Returns the registers written by the routine, with their values, and
+    the clock cycles it took until it returned.
+    """
+    text = [str(line).strip() for line in lines]
+    labels = {t[:-1]: i for i, t in enumerate(text) if t.endswith(":")}
+    regs = dict(regs)
+    written = {}
+    carry = zero = False
+    stack = []
+    pc = labels[entry]
+    cycles = 0
+
+    def value(arg):
+        return regs.get(arg, 0) if arg.startswith("s") else int(arg, 16)
+
+    while True:
+        line = text[pc]
+        pc += 1
+        if line.endswith(":"):
+            continue
+        cycles += 2
+        if cycles > 100000:
+            raise ValueError("routine does not return")
+
+        name, _, rest = line.partition(" ")
+        args = rest.replace(",", " ").split()
+        if name in ("jump", "call", "return"):
+            cond = args.pop(0) if args and args[0] in ("c", "nc",
+                                                       "z", "nz") else None
+            if cond and {"c": carry, "nc": not carry,
+                         "z": zero, "nz": not zero}[cond] is False:
+                continue
+            if name == "return":
+                if not stack:
+                    return written, cycles
+                pc = stack.pop()
+            else:
+                if name == "call":
+                    stack.append(pc)
+                pc = labels[args[0]]
+            continue
+
+        dest = args[0]
+        old = regs.get(dest, 0)
+        source = value(args[1]) if len(args) > 1 else None
+        if name == "load":
+            regs[dest] = written[dest] = source
+            continue
+        elif name == "compare":
+            carry = old < source
+            zero = old == source
+            continue
+        elif name in ("add", "addcy"):
+            new = old + source + (carry if name == "addcy" else 0)
+            carry = new > 0xFF
+        elif name in ("sub", "subcy"):
+            new = old - source - (carry if name == "subcy" else 0)
+            carry = new < 0
+        elif name in ("and", "or", "xor"):
+            new = {"and": old & source, "or": old | source,
+                   "xor": old ^ source}[name]
+            carry = False
+        elif name == "srx":
+            new = old >> 1 | old & 0x80
+            carry = bool(old & 1)
+        elif name in ("sl0", "sla"):
+            new = old << 1 | (carry if name == "sla" else 0)
+            carry = bool(old & 0x80)
+        elif name in ("sr0", "sra"):
+            new = old >> 1 | (carry << 7 if name == "sra" else 0)
+            carry = bool(old & 1)
+        else:
+            raise NotImplementedError(line)
+
+        regs[dest] = written[dest] = new & 0xFF
+        zero = regs[dest] == 0
+
+
+def to_signed(value):
+    """Return the signed value of the given byte."""
+    return value - 256 if value >> 7 else value
+
+
+def c_divide(a, b):
+    """Return the quotient and remainder of a / b and a % b in C."""
+    quotient = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        quotient = -quotient
+    return quotient, a - quotient * b
+
+
+def apply_mult_steps(steps, value):
+    """Return the 8-bit result of the given steps on a value."""
+    acc = saved = 0
+    for step in steps:
+        acc = {"load": value, "zero": 0, "shift": acc << 1,
+               "add": acc + value, "sub": acc - value, "save": acc,
+               "add_saved": acc + saved, "sub_saved": acc - saved}[step]
+        if step == "save":
+            saved = acc
+        acc &= 0xFF
+    return acc
+
+
+class MultStepTests(unittest.TestCase):
+    """Tests of the shifts and adds multiplying by a literal."""
+
+    def test_every_multiplier(self):
+        """The steps multiply every value by every multiplier."""
+        for multiplier in range(1, 256):
+            cycles, steps = _get_mult_steps(multiplier)
+            self.assertEqual(cycles, 2 * len(steps))
+            for value in range(256):
+                self.assertEqual(apply_mult_steps(steps, value),
+                                 value * multiplier % 256)
+
+    def test_chain(self):
+        """A chain is a product by its positive multiplier."""
+        for multiplier in range(1, 512):
+            steps = _get_chain(multiplier)
+            self.assertNotIn("zero", steps)
+            for value in (1, 3, 100):
+                self.assertEqual(apply_mult_steps(steps, value),
+                                 value * multiplier % 256)
+
+    def test_short_chains(self):
+        """Chains use signed digits and factors where they are shorter."""
+        self.assertEqual(_get_chain(1), ["load"])
+        self.assertEqual(_get_chain(8), ["load"] + ["shift"] * 3)
+        self.assertEqual(_get_chain(10),
+                         ["load", "shift", "shift", "add", "shift"])
+        self.assertEqual(_get_chain(15),
+                         ["load"] + ["shift"] * 4 + ["sub"])
+        self.assertEqual(len(_get_chain(45)), 9)
+
+    def test_negated(self):
+        """Multipliers close to 256 are computed as negative products."""
+        self.assertEqual(_get_mult_steps(255), (4, ["zero", "sub"]))
+        self.assertEqual(_get_mult_steps(252),
+                         (8, ["zero", "sub", "shift", "shift"]))
+
+
+class MultRoutineTests(unittest.TestCase):
+    """Tests of the multiply routine."""
+
+    def test_mul8(self):
+        """The routine multiplies every pair of operands."""
+        lines = runtime.routine_lines(runtime.MULT_ROUTINE)
+        clobber = {spot.asm_str(1) for spot in runtime.mult_clobber()}
+        for a in range(0, 256, 3):
+            for b in range(256):
+                written, cycles = simulate(
+                    lines, runtime.MULT_ROUTINE, {"s0": a, "s1": b})
+
+                self.assertEqual(written["s0"], a * b % 256)
+                self.assertLessEqual(set(written), clobber)
+
+                # The cycles of the routine, plus the call which reaches it
+                self.assertEqual(runtime.mult_cycles(b), cycles + 2)
+
+    def test_names(self):
+        """The routine calls no other, and unknown routines are refused."""
+        self.assertEqual(runtime.routine_calls(runtime.MULT_ROUTINE), [])
+        with self.assertRaises(NotImplementedError):
+            runtime.routine_lines("__mul16")
+
+
+class DivPlanTests(unittest.TestCase):
+    """Tests of the plans for dividing by a literal."""
+
+    def test_plans(self):
+        """The fastest plan is chosen for each kind of divisor."""
+        self.assertEqual(_get_div_plan(8, False, False), (8, "shift", 3))
+        self.assertEqual(_get_div_plan(8, True, True), (14, "shift", 3))
+        self.assertEqual(_get_div_plan(10, False, False),
+                         (34, "reciprocal", 205, 3, 10))
+        self.assertEqual(_get_div_plan(10, False, True),
+                         (32, "subtract", 5, 10))
+        self.assertEqual(_get_div_plan(200, False, False),
+                         (12, "subtract", 1, 200))
+
+    def test_subtract_bits(self):
+        """A subtraction plan covers every bit the quotient may have."""
+        for divisor in range(1, 256):
+            for signed in (False, True):
+                largest = 128 if signed else 255
+                plan = _get_div_plan(divisor, signed, False)
+                if plan[1] == "subtract":
+                    self.assertLess(largest // divisor, 1 << plan[2])
+
+    def test_reciprocal(self):
+        """Every reciprocal found gives every quotient."""
+        for largest in (128, 255):
+            for divisor in range(2, 256):
+                reciprocal = _get_reciprocal(divisor, largest)
+                if not reciprocal:
+                    continue
+                multiplier, shift = reciprocal
+                self.assertEqual(multiplier % 2, 1)
+                self.assertLess(multiplier, 256)
+                total = multiplier.bit_length() + shift
+                for x in range(largest + 1):
+                    self.assertEqual(x * multiplier >> total, x // divisor)
+
+        self.assertEqual(_get_reciprocal(10, 255), (205, 3))
+        self.assertIsNone(_get_reciprocal(7, 255))
+
+
+class DivLiteralTests(unittest.TestCase):
+    """Tests of the ASM dividing by a literal."""
+
+    def check_divisor(self, cls, signed, divisor):
+        """Check the ASM of `cls` by a literal for sampled dividends."""
+        ctype = ctypes.integer if signed else ctypes.unsig_int
+        value = ILValue(ctype)
+        output = ILValue(ctype)
+        literal = ILValue(ctype)
+        literal.literal = IntegerLiteral(divisor)
+        command = cls(output, value, literal)
+        if not command._get_literal_divisor():
+            return
+
+        def get_reg(pref=None, conf=None):
+            for spot in (pref or []) + spots.registers:
+                if (isinstance(spot, spots.RegSpot)
+                      and spot not in (conf or [])):
+                    return spot
+
+        asm_code = ASMCode()
+        asm_code.add(asm_cmds.Label("test"))
+        spotmap = {value: spots.S0, output: spots.S1,
+                   literal: spots.LiteralSpot(divisor)}
+        command.make_asm(spotmap, spotmap, get_reg, asm_code)
+        asm_code.add(asm_cmds.Return())
+
+        for x in list(range(0, 256, 5)) + [1, 127, 128, 129, 255]:
+            written, cycles = simulate(asm_code.lines, "test", {"s0": x})
+            if not signed:
+                # The plan does not count the final move or the return
+                self.assertLessEqual(cycles - 4,
+                                     command._get_literal_divisor()[1][0])
+            a = to_signed(x) if signed else x
+            if a == -128 and divisor == -1:
+                continue
+            quotient, rem = c_divide(a, divisor)
+            want = rem if command.remainder else quotient
+            self.assertEqual(written["s1"], want % 256,
+                             f"{a} {cls.__name__} {divisor}")
+
+    def test_unsigned(self):
+        """Unsigned values are divided by every divisor."""
+        for divisor in range(1, 256):
+            self.check_divisor(math_cmds.Div, False, divisor)
+            self.check_divisor(math_cmds.Mod, False, divisor)
+
+    def test_signed(self):
+        """Signed values are divided by every divisor."""
+        for divisor in range(-127, 128):
+            if divisor:
+                self.check_divisor(math_cmds.Div, True, divisor)
+                self.check_divisor(math_cmds.Mod, True, divisor)
+
+
+class DivRoutineTests(unittest.TestCase):
+    """Tests of the divide routines."""
+
+    def check_routine(self, signed):
+        """Check the routine on every divisor for sampled dividends."""
+        name = runtime.div_routine(signed)
+        lines = []
+        for routine in [name] + runtime.routine_calls(name):
+            lines += runtime.routine_lines(routine)
+        clobber = {spot.asm_str(1) for spot in runtime.div_clobber(signed)}
+        rem = runtime.div_remainder().asm_str(1)
+
+        for a in range(0, 256, 3):
+            for b in range(1, 256):
+                x, y = (to_signed(a), to_signed(b)) if signed else (a, b)
+                if x == -128 and y == -1:
+                    continue
+                quotient, remainder = c_divide(x, y)
+
+                written, cycles = simulate(lines, name, {"s0": a, "s1": b})
+                regs = {"s0": a, **written}
+                self.assertEqual(regs["s0"], quotient % 256)
+                self.assertEqual(regs.get(rem, 0), remainder % 256)
+                self.assertLessEqual(set(written), clobber)
+                self.assertLessEqual(cycles + 2, runtime.div_cycles(signed))
+
+    def test_unsigned(self):
+        """The unsigned routine divides every pair of operands."""
+        self.check_routine(False)
+
+    def test_signed(self):
+        """The signed routine divides every pair of operands."""
+        self.check_routine(True)
+
+    def test_calls(self):
+        """The signed routine calls the unsigned one."""
+        self.assertEqual(runtime.routine_calls(runtime.DIV_ROUTINE),
+                         [runtime.UDIV_ROUTINE])
+        self.assertEqual(runtime.routine_calls(runtime.UDIV_ROUTINE), [])